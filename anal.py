@@ -1,106 +1,263 @@
 import cv2
 import numpy as np
-from PIL import Image, ImageFilter, ImageCms
+from PIL import Image
 from io import BytesIO
 import os
+import math
+from dataclasses import dataclass, field, asdict, replace, fields
+from functools import lru_cache
 from scipy.signal import convolve2d
+from config import load_print_config, load_color_config
+from colormgmt import embedded_profile, convert_to_profile, cmyk_soft_proof, lab_colors, srgb_from_lab
+from autoediting.refine import resize_band
 
 def load_image(image_path):
     return Image.open(image_path).convert('L')  # Convert to grayscale
 
-def check_resolution(image):
-    width, height = image.size
-    return f"Image resolution: {width}x{height} pixels"
-
-def check_color_depth(image):
-    mode = image.mode
-    if mode == 'RGB':
-        return "Color depth: 24-bit (8 bits per channel), adequate for high-quality printing."
-    elif mode == 'RGBA':
-        return "Color depth: 32-bit (8 bits per channel with alpha), adequate for high-quality printing."
-    elif mode == 'L':
-        return "Color depth: 8-bit grayscale, may be adequate depending on print requirements."
-    elif mode == 'CMYK':
-        return "Color depth: 32-bit CMYK, suitable for professional printing."
-    else:
-        return f"Color depth: {mode}, may not be optimal for high-quality printing."
+# The checks measure; they don't judge. run_checks returns an ImageMetrics
+# record of raw numbers, assess_metrics applies the thresholds from the print
+# and colour config, and the reply code turns both into text. Stored metrics
+# can be re-assessed under new thresholds without touching any pixels.
+@dataclass(slots=True)
+class ImageMetrics:
+    width: int
+    height: int
+    mode: str
+    file_size: int  # Bytes
+    icc_profile: str
+    sharpness: float = None  # Variance of the Laplacian
+    dark_percent: float = None
+    bright_percent: float = None
+    blockiness: float = None
+    detail_loss: float = None
+    ringing: float = None
+    gamut_percent: float = None  # Share of the design outside the CMYK gamut
+    gamut_approximate: bool = True  # No press profile; Lab chroma estimate
+    inks: dict = None  # estimate_ink_colours output
+    ink_basis: str = "whole image"
+    halftone: dict = None
+    errors: dict = field(default_factory=dict)  # Check name -> why it could not be measured
 
-def simulate_halftone_screening(image, print_dpi):
-    halftone_image = image.filter(ImageFilter.CONTOUR)  # Basic example of a simulation
-    return halftone_image, "Halftone screening simulation complete."
+def metrics_from_dict(data):
+    # Records stored before a field was added or removed are not reused
+    if not data or set(data) != {f.name for f in fields(ImageMetrics)}:
+        return None
+    return ImageMetrics(**data)
 
-def check_file_size(image_data):
-    size_bytes = len(image_data)
-    size_mb = size_bytes / (1024 * 1024)
-    return f"File size: {size_mb:.2f} MB"
+def metrics_to_dict(metrics):
+    return asdict(metrics)
 
-def check_bleed_and_margins(image, desired_width_inch, desired_height_inch, bleed_inch, dpi):
-    required_width_px = int((desired_width_inch + 2 * bleed_inch) * dpi)
-    required_height_px = int((desired_height_inch + 2 * bleed_inch) * dpi)
+@lru_cache(maxsize=64)
+def am_screen_tile(print_dpi, lpi, angle):
+    # Rational-tangent AM screen: the cell vector (a, b) is the integer
+    # approximation of the requested period and angle, which makes the screen
+    # exactly periodic over an n x n pixel tile. Returns the uint8 threshold
+    # tile plus the LPI and angle actually achieved.
+    period = print_dpi / lpi
+    a = round(period * math.cos(math.radians(angle)))
+    b = round(period * math.sin(math.radians(angle)))
+    if a == 0 and b == 0:
+        a = 1
+    cell_area = a * a + b * b
+    n = cell_area // math.gcd(a, b)
+    y, x = np.mgrid[0:n, 0:n].astype(np.float64) + 0.5
+    u = (x * a + y * b) / cell_area
+    v = (y * a - x * b) / cell_area
+    # Round dot spot function; cell centres ink first as coverage rises
+    spot = np.cos(2 * np.pi * u) + np.cos(2 * np.pi * v)
+    ranks = np.empty(spot.size, dtype=np.int64)
+    ranks[np.argsort(-spot.ravel(), kind='stable')] = np.arange(spot.size)
+    tile = (ranks * 255 // spot.size).astype(np.uint8).reshape(n, n)
+    return tile, print_dpi / math.sqrt(cell_area), math.degrees(math.atan2(b, a)) % 180
 
-    if image.width >= required_width_px and image.height >= required_height_px:
-        return "Image dimensions are sufficient for bleed."
-    else:
-        return f"Image is too small. Required: {required_width_px}x{required_height_px}px, Actual: {image.width}x{image.height}px"
+@lru_cache(maxsize=8)
+def fm_screen_tile(size=64, seed=0):
+    # Stochastic (FM) screen: ranked high-pass noise approximates blue noise,
+    # so equal-sized dots are scattered with density following the tone
+    noise = np.random.default_rng(seed).random((size, size)).astype(np.float32)
+    high_pass = noise - cv2.GaussianBlur(noise, (0, 0), 1.5, borderType=cv2.BORDER_WRAP)
+    ranks = np.empty(noise.size, dtype=np.int64)
+    ranks[np.argsort(high_pass.ravel(), kind='stable')] = np.arange(noise.size)
+    return (ranks * 255 // noise.size).astype(np.uint8).reshape(size, size)
+
+def screen_inks(mode):
+    # Greyscale images print as K only, everything else as CMYK
+    return 'K' if mode in ('1', 'L', 'LA', 'I', 'F') else 'CMYK'
+
+def halftone_screens(image_mode, print_dpi, size, config=None):
+    # The screens a halftone at this resolution would achieve, from the
+    # config and the (cached) screen tiles alone, without rendering anything
+    config = config or load_print_config()
+    lpi, angles, mode = config['halftone_lpi'], config['halftone_angles'], config['halftone_mode']
+    width, height = size
+    halftone = {'mode': mode, 'print_dpi': print_dpi, 'width': width, 'height': height, 'screens': [], 'levels': None}
+    if mode != 'fm':
+        inks = screen_inks(image_mode)
+        achieved = [am_screen_tile(print_dpi, lpi, angles[ink]) for ink in inks]
+        halftone['screens'] = [[ink, round(tile_lpi, 2), round(angle, 2)] for ink, (_, tile_lpi, angle) in zip(inks, achieved)]
+        halftone['levels'] = min(int(round((print_dpi / tile_lpi) ** 2)) + 1 for _, tile_lpi, _ in achieved)
+    return halftone
+
+def simulate_halftone_screening(image, print_dpi, size=None, config=None):
+    # Screens each ink separately at print resolution and recombines the inks
+    # into an RGB preview. Greyscale images print as K only, everything else
+    # as CMYK. size is the output size in device pixels (defaults to the image).
+    # Returns the preview and the screens actually achieved.
+    config = config or load_print_config()
+    lpi, angles, mode = config['halftone_lpi'], config['halftone_angles'], config['halftone_mode']
+    band_rows = config['halftone_band_rows']
+    inks = screen_inks(image.mode)
+    source = np.asarray(image.convert('L' if inks == 'K' else 'CMYK'))
+    if inks == 'K':
+        source = 255 - source  # Ink coverage, not lightness
+    width, height = size or image.size
+
+    tiles = {}
+    for ink in inks:
+        tile = fm_screen_tile() if mode == 'fm' else am_screen_tile(print_dpi, lpi, angles[ink])[0]
+        # One wide threshold plane per ink, sliced at each band's phase
+        n = tile.shape[0]
+        tiles[ink] = (n, np.tile(tile, (-(-band_rows // n) + 1, -(-width // n)))[:, :width])
+
+    preview = np.empty((height, width, 3), dtype=np.uint8)
+    for y0 in range(0, height, band_rows):
+        y1 = min(y0 + band_rows, height)
+        band = resize_band(source, (width, height), y0, y1) if (width, height) != image.size else source[y0:y1]
+        band = band.reshape(y1 - y0, width, len(inks))
+        dots = {}
+        for channel, ink in enumerate(inks):
+            n, thresholds = tiles[ink]
+            dots[ink] = band[..., channel] > thresholds[y0 % n:y0 % n + y1 - y0]
+        paper = ~dots['K']
+        if inks == 'K':
+            preview[y0:y1] = (paper * 255).astype(np.uint8)[..., None]
+        else:
+            for channel, ink in enumerate('CMY'):
+                preview[y0:y1, :, channel] = (paper & ~dots[ink]) * np.uint8(255)
+
+    return Image.fromarray(preview), halftone_screens(image.mode, print_dpi, (width, height), config)
 
 def get_icc_profile(image):
     if 'icc_profile' in image.info:
-        try:
-            profile = ImageCms.ImageCmsProfile(BytesIO(image.info['icc_profile']))
-            return profile.profile.profile_description
-        except Exception as e:
-            return f"ICC profile present but unreadable: {str(e)}"
+        _, profile, description = embedded_profile(image)
+        if profile is None:
+            return f"ICC profile present but unreadable: {description.split(': ', 1)[-1]}"
+        return description
     return "No ICC profile found"
 
-def check_color_profile(image):
-    profile_description = get_icc_profile(image)
-    color_mode = image.mode
-    return f"Color mode: {color_mode}, ICC Profile: {profile_description}"
-
 def convert_color_profile(image, target_profile_path):
     if not os.path.exists(target_profile_path):
         return image, f"Color profile conversion failed: Profile file not found at {target_profile_path}"
     
     try:
-        target_profile = ImageCms.ImageCmsProfile(target_profile_path)
-        
-        # Get the input profile from the image, or use a default sRGB profile
-        if 'icc_profile' in image.info:
-            input_profile = ImageCms.ImageCmsProfile(BytesIO(image.info['icc_profile']))
-        else:
-            input_profile = ImageCms.createProfile('sRGB')
-        
-        # Convert to the desired color profile
-        converted_image = ImageCms.profileToProfile(image, input_profile, target_profile)
+        # Transforms are cached per profile pair, so repeat conversions only pay for pixels
+        converted_image = convert_to_profile(image, target_profile_path)
         return converted_image, "Color profile conversion completed successfully."
     except Exception as e:
         return image, f"Color profile conversion failed: {str(e)}"
 
-def check_sharpness(image):
+def measure_cmyk_gamut(image):
+    # Returns (percent out of gamut, whether it was estimated without a press profile)
+    soft_proof, percent, approximate = cmyk_soft_proof(image, load_color_config())
+    return float(percent), approximate
+
+def sample_opaque_lab(image, sample_size, alpha=None):
+    # Stratified sample: a NEAREST resize to about sample_size pixels picks one
+    # real pixel per grid cell, at a cost set by the sample, not the image.
+    # Pixels under half opacity (the image's own alpha, or a cutout's) are dropped.
+    scale = min(1.0, math.sqrt(sample_size / (image.width * image.height)))
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    sample = image.resize(size, Image.NEAREST)
+    if 'icc_profile' in image.info:
+        sample.info['icc_profile'] = image.info['icc_profile']
+    if alpha is not None:
+        opaque = np.asarray(alpha.resize(size, Image.NEAREST)).reshape(-1) >= 128
+    elif sample.mode in ('RGBA', 'LA', 'PA') or (sample.mode == 'P' and 'transparency' in sample.info):
+        opaque = np.asarray(sample.convert('RGBA').getchannel('A')).reshape(-1) >= 128
+    else:
+        opaque = np.ones(size[0] * size[1], dtype=bool)
+    return lab_colors(sample)[opaque]
+
+def squared_distances(points, centres):
+    # |p|^2 - 2 p.c + |c|^2, one matrix product instead of an (N, k, 3) array
+    return np.maximum((points ** 2).sum(axis=1)[:, None] - 2 * points @ centres.T + (centres ** 2).sum(axis=1)[None], 0)
+
+def mini_batch_kmeans(points, k, rng, batch_size=1024, iterations=30):
+    # k-means++ seeding, then mini-batch updates with a per-centre learning
+    # rate of 1/(points seen), as in Sculley's web-scale k-means
+    seeds = points[rng.choice(len(points), min(len(points), 2048), replace=False)]
+    centres = seeds[[rng.integers(len(seeds))]]
+    closest = squared_distances(seeds, centres)[:, 0]
+    for _ in range(1, k):
+        if closest.sum() == 0:
+            break  # Fewer distinct colours than k
+        centre = seeds[[rng.choice(len(seeds), p=closest / closest.sum())]]
+        centres = np.vstack([centres, centre])
+        closest = np.minimum(closest, squared_distances(seeds, centre)[:, 0])
+    seen = np.zeros(len(centres))
+    for _ in range(iterations):
+        batch = points[rng.integers(0, len(points), batch_size)]
+        nearest = squared_distances(batch, centres).argmin(axis=1)
+        counts = np.bincount(nearest, minlength=len(centres))
+        sums = np.stack([np.bincount(nearest, weights=batch[:, c], minlength=len(centres)) for c in range(3)], axis=1)
+        seen += counts
+        moved = counts > 0
+        centres[moved] += (sums[moved] - counts[moved, None] * centres[moved]) / seen[moved, None]
+    return centres
+
+def estimate_ink_colours(image, alpha=None, config=None):
+    # Returns {'count', 'palette': [{'hex', 'lab', 'coverage'}], 'off_palette',
+    # 'photographic'}; coverage and off_palette are percent of the opaque area
+    config = config or load_print_config()
+    points = sample_opaque_lab(image, config['ink_sample_size'], alpha).astype(np.float64)
+    if len(points) == 0:
+        return {'count': 0, 'palette': [], 'off_palette': 0.0, 'photographic': False}
+    rng = np.random.default_rng(0)
+    centres = mini_batch_kmeans(points, config['ink_max_colours'], rng)
+    labels = squared_distances(points, centres).argmin(axis=1)
+    counts = np.bincount(labels, minlength=len(centres)).astype(np.float64)
+
+    # Merge clusters that are the same ink to the eye (CIE76 delta E), then
+    # drop slivers, which are mostly anti-aliased blends between inks
+    while len(centres) > 1:
+        gaps = squared_distances(centres, centres)
+        np.fill_diagonal(gaps, np.inf)
+        i, j = np.unravel_index(gaps.argmin(), gaps.shape)
+        if gaps[i, j] >= config['ink_merge_delta_e'] ** 2:
+            break
+        total = counts[i] + counts[j]
+        if total:
+            centres[i] = (centres[i] * counts[i] + centres[j] * counts[j]) / total
+        counts[i] = total
+        centres, counts = np.delete(centres, j, axis=0), np.delete(counts, j)
+    keep = counts * 100 / len(points) >= config['ink_min_coverage']
+    centres = centres[keep] if keep.any() else centres[[counts.argmax()]]
+    distance = squared_distances(points, centres)
+    labels = distance.argmin(axis=1)
+    coverage = np.bincount(labels, minlength=len(centres)) * 100 / len(points)
+    off_palette = float((distance.min(axis=1) > config['ink_tone_delta_e'] ** 2).mean() * 100)
+
+    order = np.argsort(-coverage)
+    rgb = srgb_from_lab(centres[order])
+    palette = [
+        {'hex': '#{:02X}{:02X}{:02X}'.format(*colour), 'lab': [round(float(v), 1) for v in centres[index]],
+         'coverage': round(float(coverage[index]), 1)}
+        for index, colour in zip(order, rgb)
+    ]
+    return {'count': len(palette), 'palette': palette, 'off_palette': round(off_palette, 1),
+            'photographic': off_palette > config['ink_photo_percent']}
+
+def measure_sharpness(image):
     # Convert PIL Image to OpenCV format
     cv_image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
     gray = cv2.cvtColor(cv_image, cv2.COLOR_BGR2GRAY)
     
     # Use the variance of the Laplacian as a sharpness metric
     laplacian = cv2.Laplacian(gray, cv2.CV_64F)
-    sharpness = laplacian.var()
-    
-    threshold = 100  # This threshold should be adjusted based on testing
-    if sharpness < threshold:
-        return f"Image appears blurry (sharpness: {sharpness:.2f}). Consider sharpening or using a different image."
-    else:
-        return f"Image sharpness is adequate for printing (sharpness: {sharpness:.2f})."
+    return float(laplacian.var())
 
-def check_aspect_ratio(image, desired_width_inch, desired_height_inch):
-    image_aspect_ratio = image.width / image.height
-    desired_aspect_ratio = desired_width_inch / desired_height_inch
-
-    if abs(image_aspect_ratio - desired_aspect_ratio) < 0.01:  # Allow for small rounding differences
-        return f"Aspect ratio matches the print dimensions. Image: {image_aspect_ratio:.2f}, Desired: {desired_aspect_ratio:.2f}"
-    else:
-        return f"Aspect ratio mismatch. Image: {image_aspect_ratio:.2f}, Desired: {desired_aspect_ratio:.2f}. Cropping or distortion may occur."
-
-def detect_compression_artifacts(image, block_size=8, detail_threshold=0.1, edge_threshold=20):
+def measure_compression_artifacts(image, block_size=8, detail_threshold=0.1, edge_threshold=20):
+    # Returns (blockiness, detail loss, ringing)
     # Convert PIL Image to numpy array
     img_array = np.array(image)
     
@@ -150,19 +307,10 @@ def detect_compression_artifacts(image, block_size=8, detail_threshold=0.1, edge
 
     ringing = detect_ringing(img_gray, edge_threshold)
 
-    # Combine metrics and determine overall artifact level
-    artifact_level = (blockiness + detail_loss + ringing) / 3
+    return float(blockiness), float(detail_loss), float(ringing)
 
-    if artifact_level > 0.1:  # This threshold can be adjusted based on testing
-        return f"Significant compression artifacts detected (level: {artifact_level:.2f}). " \
-               f"Blockiness: {blockiness:.2f}, Detail loss: {detail_loss:.2f}, Ringing: {ringing:.2f}. " \
-               f"This may affect print quality on physical media."
-    else:
-        return f"No significant compression artifacts detected (level: {artifact_level:.2f}). " \
-               f"Blockiness: {blockiness:.2f}, Detail loss: {detail_loss:.2f}, Ringing: {ringing:.2f}. " \
-               f"The image should print well on physical media."
-
-def check_exposure(image):
+def measure_exposure(image):
+    # Returns the percentages of very dark and very bright pixels
     # Convert PIL Image to OpenCV format
     cv_image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
     grayscale = cv2.cvtColor(cv_image, cv2.COLOR_BGR2GRAY)
@@ -170,45 +318,103 @@ def check_exposure(image):
     # Calculate histogram
     hist = cv2.calcHist([grayscale], [0], None, [256], [0, 256])
     
-    # Analyze histogram for exposure issues
-    dark_threshold = 5  # Percentage of pixels that can be very dark
-    bright_threshold = 5  # Percentage of pixels that can be very bright
     total_pixels = grayscale.shape[0] * grayscale.shape[1]
-    
     dark_pixels = np.sum(hist[:10]) / total_pixels * 100
     bright_pixels = np.sum(hist[-10:]) / total_pixels * 100
-    
-    if dark_pixels > dark_threshold:
-        return f"Image may be underexposed. {dark_pixels:.2f}% of pixels are very dark (threshold: {dark_threshold}%)."
-    elif bright_pixels > bright_threshold:
-        return f"Image may be overexposed. {bright_pixels:.2f}% of pixels are very bright (threshold: {bright_threshold}%)."
-    else:
-        return f"Exposure is within acceptable limits. Dark pixels: {dark_pixels:.2f}%, Bright pixels: {bright_pixels:.2f}%."
+    return float(dark_pixels), float(bright_pixels)
 
-def run_checks(image_data, print_dpi, desired_width_inch, desired_height_inch, bleed_inch):
+def run_checks(image_data, print_dpi, desired_width_inch, desired_height_inch, bleed_inch, halftone_preview=True):
+    # Returns (ImageMetrics, halftone preview); raises if the image can't be opened.
+    # Without halftone_preview the screens are worked out but the preview
+    # is not rendered, and None is returned in its place.
+    image = Image.open(BytesIO(image_data))
+    metrics = run_header_checks(image_data)
+    metrics.sharpness = measure_sharpness(image)
+    metrics.blockiness, metrics.detail_loss, metrics.ringing = measure_compression_artifacts(image)
+    metrics.dark_percent, metrics.bright_percent = measure_exposure(image)
     try:
-        image = Image.open(BytesIO(image_data))
+        metrics.gamut_percent, metrics.gamut_approximate = measure_cmyk_gamut(image)
     except Exception as e:
-        return {"error": f"Failed to open image: {str(e)}"}, None
-
-    results = {
-        "resolution": check_resolution(image),
-        "color_depth": check_color_depth(image),
-        "file_size": check_file_size(image_data),
-        "bleed_and_margins": check_bleed_and_margins(image, desired_width_inch, desired_height_inch, bleed_inch, print_dpi),
-        "color_profile": check_color_profile(image),
-        "sharpness": check_sharpness(image),
-        "aspect_ratio": check_aspect_ratio(image, desired_width_inch, desired_height_inch),
-        "compression_artifacts": detect_compression_artifacts(image),
-        "exposure": check_exposure(image),
-    }
-    
-    # Convert to grayscale for halftone simulation
-    grayscale_image = image.convert('L')
-    halftone_image, halftone_message = simulate_halftone_screening(grayscale_image, print_dpi)
-    results["halftone"] = halftone_message
+        metrics.errors["cmyk_gamut"] = str(e)
+    try:
+        metrics.inks = estimate_ink_colours(image)
+    except Exception as e:
+        metrics.errors["ink_colours"] = str(e)
+
+    # Halftone preview of the design fitted to the bleed box at print resolution
+    page_width = (desired_width_inch + 2 * bleed_inch) * print_dpi
+    page_height = (desired_height_inch + 2 * bleed_inch) * print_dpi
+    scale = min(page_width / image.width, page_height / image.height)
+    halftone_size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    if not halftone_preview:
+        metrics.halftone = halftone_screens(image.mode, print_dpi, halftone_size)
+        return metrics, None
+    halftone_image, metrics.halftone = simulate_halftone_screening(image, print_dpi, halftone_size)
     
-    return results, halftone_image
+    return metrics, halftone_image
+
+def run_header_checks(image_data):
+    # Measurements that only need the image header, so they stay cheap to
+    # recompute when pixel-level metrics are reused from a near-duplicate design
+    image = Image.open(BytesIO(image_data))
+    return ImageMetrics(width=image.width, height=image.height, mode=image.mode,
+                        file_size=len(image_data), icc_profile=get_icc_profile(image))
+
+def check_print_readiness(image_data, previous_analysis, print_dpi, desired_width_inch, desired_height_inch, bleed_inch):
+    # Entry point for the pipeline's process pool: returns only the metrics,
+    # and skips rendering the halftone preview nobody here looks at. A
+    # near-duplicate's pixel-level metrics (a metrics_to_dict record) are
+    # reused and only the header is re-read.
+    previous = metrics_from_dict(previous_analysis)
+    if previous is not None:
+        header = run_header_checks(image_data)
+        return replace(previous, width=header.width, height=header.height, mode=header.mode,
+                       file_size=header.file_size, icc_profile=header.icc_profile)
+    return run_checks(image_data, print_dpi, desired_width_inch, desired_height_inch, bleed_inch,
+                      halftone_preview=False)[0]
+
+def assess_metrics(metrics, print_dpi, desired_width_inch, desired_height_inch, bleed_inch, config=None, color_config=None):
+    # The policy step: thresholds only, no pixels. Returns {check: verdict}
+    # for the checks that have a pass/fail threshold; a missing metric (a
+    # check that failed) has no verdict.
+    config = config or load_print_config()
+    color_config = color_config or load_color_config()
+    verdicts = {}
+
+    required = (int((desired_width_inch + 2 * bleed_inch) * print_dpi),
+                int((desired_height_inch + 2 * bleed_inch) * print_dpi))
+    verdicts["bleed_and_margins"] = {'ok': metrics.width >= required[0] and metrics.height >= required[1],
+                                     'required': required}
+
+    image_ratio, desired_ratio = metrics.width / metrics.height, desired_width_inch / desired_height_inch
+    verdicts["aspect_ratio"] = {'ok': abs(image_ratio - desired_ratio) < config['aspect_tolerance'],
+                                'image': image_ratio, 'desired': desired_ratio}
+
+    if metrics.sharpness is not None:
+        verdicts["sharpness"] = {'ok': metrics.sharpness >= config['sharpness_threshold']}
+
+    if metrics.blockiness is not None:
+        level = (metrics.blockiness + metrics.detail_loss + metrics.ringing) / 3
+        verdicts["compression_artifacts"] = {'ok': level <= config['artifact_level_limit'], 'level': level}
+
+    if metrics.dark_percent is not None:
+        underexposed = metrics.dark_percent > config['dark_percent_limit']
+        overexposed = not underexposed and metrics.bright_percent > config['bright_percent_limit']
+        verdicts["exposure"] = {'ok': not (underexposed or overexposed), 'underexposed': underexposed,
+                                'overexposed': overexposed, 'dark_limit': config['dark_percent_limit'],
+                                'bright_limit': config['bright_percent_limit']}
+
+    if metrics.gamut_percent is not None:
+        verdicts["cmyk_gamut"] = {'ok': metrics.gamut_percent <= color_config['gamut_warning_percent']}
+
+    if metrics.inks is not None:
+        verdicts["ink_colours"] = {'ok': bool(metrics.inks['count']),
+                                   'photographic': metrics.inks['off_palette'] > config['ink_photo_percent']}
+
+    if metrics.halftone is not None and metrics.halftone['levels'] is not None:
+        verdicts["halftone"] = {'ok': metrics.halftone['levels'] >= config['halftone_min_levels']}
+
+    return verdicts
 
 def print_image_info(image_data, info_dict):
     try:
@@ -227,11 +433,9 @@ def print_image_info(image_data, info_dict):
                 info_dict["EXIF"] = dict(img.getexif())
             
             if 'icc_profile' in img.info:
-                try:
-                    profile = ImageCms.ImageCmsProfile(BytesIO(img.info['icc_profile']))
-                    info_dict["ICC Profile"] = profile.profile.profile_description
-                except Exception as e:
-                    info_dict["ICC Profile"] = f"Present but unreadable: {str(e)}"
+                # Shares the parsed profile with the colour checks
+                _, profile, description = embedded_profile(img)
+                info_dict["ICC Profile"] = description
             else:
                 info_dict["ICC Profile"] = "Not found"
             
@@ -257,10 +461,10 @@ if __name__ == "__main__":
     
     with open(image_path, 'rb') as f:
         image_data = f.read()
-    results, halftone_image = run_checks(image_data, print_dpi, desired_width_inch, desired_height_inch, bleed_inch) #target_profile_path)
+    metrics, halftone_image = run_checks(image_data, print_dpi, desired_width_inch, desired_height_inch, bleed_inch) #target_profile_path)
     
-    for check, result in results.items():
-        print(f"{check.capitalize()}: {result}")
+    print(metrics)
+    print(assess_metrics(metrics, print_dpi, desired_width_inch, desired_height_inch, bleed_inch))
     
     if halftone_image:
         halftone_image.show()  # Preview the halftone simulation
@@ -0,0 +1,109 @@
+import logging
+import threading
+from io import BytesIO
+from PIL import Image
+from encoding import encode_image, get_encode_executor
+from store import get_store
+
+logger = logging.getLogger(__name__)
+
+# Stage output held in memory: a decoded raster and/or its encoded bytes.
+# Whichever side is missing is produced lazily on first access, so a stage
+# that only needs pixels never pays for encoding and vice versa. A factory
+# defers building the raster itself until something asks for it.
+class Artifact:
+    def __init__(self, filename, image=None, data=None, profile='master', factory=None):
+        if image is None and data is None and factory is None:
+            raise ValueError("Artifact needs an image, encoded data or a factory")
+        self.filename = filename
+        self.profile = profile
+        self.path = None
+        self._image = image
+        self._factory = factory
+        self._encoded = {}
+        if data is not None:
+            self._encoded[profile] = {'data': data, 'profile': profile, 'size': len(data)}
+        self._lock = threading.Lock()
+
+    @property
+    def image(self):
+        with self._lock:
+            return self._decoded()
+
+    def _decoded(self):
+        # Caller holds the lock
+        if self._image is None:
+            if self.profile in self._encoded:
+                image = Image.open(BytesIO(self._encoded[self.profile]['data']))
+                image.load()
+            else:
+                image = self._factory()
+            self._image = image
+        return self._image
+
+    def release_image(self):
+        # Drop the raster when it can be rebuilt, to keep large outputs from piling up
+        with self._lock:
+            if self._factory is not None or self.profile in self._encoded:
+                self._image = None
+
+    @property
+    def data(self):
+        return self.encoded(self.profile)['data']
+
+    def encoded(self, profile):
+        with self._lock:
+            encoded = self._encoded.get(profile)
+            if encoded is None:
+                image = self._decoded()
+        if encoded is None:
+            # Encode outside the lock so readers of .image are not held up
+            encoded = encode_image(image, profile)
+            with self._lock:
+                encoded = self._encoded.setdefault(profile, encoded)
+        return encoded
+
+    def encoded_async(self, profile):
+        return get_encode_executor().submit(self.encoded, profile)
+
+    def encoded_size(self, profile=None):
+        # Only reports sizes that are already known; never triggers an encode
+        encoded = self._encoded.get(profile or self.profile)
+        return encoded['size'] if encoded else None
+
+    def describe(self):
+        return {
+            'filename': self.filename,
+            'path': self.path,
+            'size': self.encoded_size(),
+        }
+
+# Optional, asynchronous persistence for artifacts through the artifact
+# store. Writes happen on the encode pool so the pipeline never waits on
+# disk; call flush() when the files themselves are needed.
+class StoreSink:
+    def __init__(self, job_id, store=None):
+        self.job_id = job_id
+        self.store = store or get_store()
+        self._pending = []
+
+    def persist(self, artifact):
+        future = get_encode_executor().submit(self._write, artifact)
+        self._pending.append(future)
+        return future
+
+    def _write(self, artifact):
+        stored = self.store.put(self.job_id, artifact.filename, artifact.data)
+        artifact.path = stored['path']
+        artifact.release_image()
+        return artifact.path
+
+    def flush(self):
+        paths = []
+        for future in self._pending:
+            try:
+                paths.append(future.result())
+            except Exception as e:
+                logger.error(f"Failed to persist artifact: {str(e)}")
+        self._pending = []
+        return paths
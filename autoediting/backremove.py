@@ -1,81 +1,91 @@
 import os
-from backgroundremover.bg import remove
+import numpy as np
+from PIL import Image
+from backgroundremover.bg import naive_cutout
 from io import BytesIO
+from encoding import get_profile
+from artifacts import Artifact, StoreSink
+from autoediting.inference import get_backend
+from autoediting.refine import decode_proxy, guided_upsample, compose_cutout
+from autoediting.matting import band_matting_alpha, band_matting_cutout
+from autoediting.router import choose_models
+from config import load_segmentation_config
+
+MODEL_CHOICES = ["u2net", "u2netp", "u2net_human_seg", "silueta", "isnet-general-use", "sam"]
 
 def remove_background(input_path):
     try:
-        model_choices = ["u2net", "u2netp", "u2net_human_seg", "silueta", "isnet-general-use", "sam"]
         with open(input_path, "rb") as f:
             data = f.read()
         
         base_filename = os.path.splitext(os.path.basename(input_path))[0]
-        output_folder = f"{base_filename}_output"
-        os.makedirs(output_folder, exist_ok=True)
-        
-        for model in model_choices:
-            try:
-                # Without alpha matting
-                img = remove(data, model_name=model)
-                with open(os.path.join(output_folder, f"{base_filename}_{model}.png"), "wb") as f:
-                    f.write(img)
-                print(f"Background removed using {model} without alpha matting. Output saved to {os.path.join(output_folder, f'{base_filename}_{model}.png')}")
-
-                # With alpha matting
-                img_alpha = remove(data, model_name=model,
-                                   alpha_matting=True,
-                                   alpha_matting_foreground_threshold=230,
-                                   alpha_matting_background_threshold=20,
-                                   alpha_matting_erode_structure_size=10)
-                output_path_alpha = os.path.join(output_folder, f"{base_filename}_{model}_alpha.png")
-                with open(output_path_alpha, "wb") as f:
-                    f.write(img_alpha)
-                print(f"Background removed using {model} with alpha matting. Output saved to {output_path_alpha}")
-            except Exception as model_error:
-                print(f"Error processing model {model}: {str(model_error)}")
-                continue  # Skip to the next model if there's an error
-        
-        print(f"All background removal operations completed. Results saved in {output_folder}")
+        sink = StoreSink(base_filename)
+        remove_background_from_data(data, base_filename, sink)
+        print(f"All background removal operations completed. Results saved to {sink.flush()}")
     except Exception as e:
         print(f"An error occurred: {str(e)}")
 
-def remove_background_from_data(data, base_filename):
+def cutout_images(img, model, config):
+    # Both variants share one forward pass; only the compositing differs
+    mask = get_backend().predict_mask(model, img)
+    cutout = naive_cutout(img, mask)
+    cutout_alpha = band_matting_cutout(img, mask, config)
+    return cutout, cutout_alpha
+
+def proxy_cutout_factories(proxy, full_rgb, full_gray, model, config):
+    # Segment and matte on the proxy; only the proxy-sized alphas are kept and
+    # each full-resolution cutout is composited once, when it is first needed
+    mask = get_backend().predict_mask(model, proxy)
+    matted_alpha = band_matting_alpha(proxy, mask, config)
+
+    def factory(alpha):
+        return lambda: compose_cutout(full_rgb, guided_upsample(
+            alpha, proxy, full_gray, config['guided_radius'], config['guided_eps'], config['band_rows']))
+
+    return factory(mask), factory(matted_alpha)
+
+def prepare_segmentation(data, config):
+    # Decodes the upload once for every model: a proxy plus the full-size
+    # raster for large images, otherwise the full image
+    with Image.open(BytesIO(data)) as probe:
+        width, height = probe.size
+    if config['proxy_mode'] and width * height >= config['proxy_min_pixels']:
+        proxy, _ = decode_proxy(data, config['proxy_max_side'])
+        # The full-size raster is decoded once and shared by every composite
+        full_rgb = Image.open(BytesIO(data)).convert("RGB")
+        return {'proxy': proxy, 'full_rgb': full_rgb, 'full_gray': np.asarray(full_rgb.convert("L"))}
+    return {'image': Image.open(BytesIO(data)).convert("RGB")}
+
+def segment_model(source, model, base_filename, config, sink=None, profile='master'):
+    # One model's cutouts with and without alpha matting, from a prepared source
+    extension = get_profile(profile)['extension']
+    if 'proxy' in source:
+        factories = proxy_cutout_factories(source['proxy'], source['full_rgb'], source['full_gray'], model, config)
+        variants = [{'factory': factory} for factory in factories]
+    else:
+        variants = [{'image': image} for image in cutout_images(source['image'], model, config)]
+
+    result = {'model': model}
+    for (alpha_type, suffix), variant in zip((('without_alpha', ''), ('with_alpha', '_alpha')), variants):
+        artifact = Artifact(f"{base_filename}_{model}{suffix}.{extension}", profile=profile, **variant)
+        if sink is not None:
+            # Encoding and writing overlap with the next model's inference
+            sink.persist(artifact)
+        result[alpha_type] = artifact
+    return result
+
+def remove_background_from_data(data, base_filename, sink=None, profile='master', models=None):
     try:
-        model_choices = ["u2net", "u2netp", "u2net_human_seg", "silueta", "isnet-general-use", "sam"]
-        
-        output_folder = f"{base_filename}_output"
-        os.makedirs(output_folder, exist_ok=True)
+        config = load_segmentation_config()
+        if models is None:
+            models = choose_models(data, config, MODEL_CHOICES)[0] if config['routing'] else MODEL_CHOICES
+        source = prepare_segmentation(data, config)
         
         results = []
-        for model in model_choices:
+        for model in models:
             try:
-                # Process image for each model
-                img = remove(data, model_name=model)
-                with open(os.path.join(output_folder, f"{base_filename}_{model}.png"), "wb") as f:
-                    f.write(img)
-                print(f"Background removed using {model} without alpha matting. Output saved to {os.path.join(output_folder, f'{base_filename}_{model}.png')}")
-
-                # With alpha matting
-                img_alpha = remove(data, model_name=model,
-                                   alpha_matting=True,
-                                   alpha_matting_foreground_threshold=230,
-                                   alpha_matting_background_threshold=20,
-                                   alpha_matting_erode_structure_size=10)
-                output_path_alpha = os.path.join(output_folder, f"{base_filename}_{model}_alpha.png")
-                with open(output_path_alpha, "wb") as f:
-                    f.write(img_alpha)
-                print(f"Background removed using {model} with alpha matting. Output saved to {output_path_alpha}")
-
-                results.append({
-                    'model': model,
-                    'without_alpha': {
-                        'filename': f"{base_filename}_{model}.png",
-                        'path': os.path.join(output_folder, f"{base_filename}_{model}.png")
-                    },
-                    'with_alpha': {
-                        'filename': f"{base_filename}_{model}_alpha.png",
-                        'path': os.path.join(output_folder, f"{base_filename}_{model}_alpha.png")
-                    }
-                })
+                results.append(segment_model(source, model, base_filename, config, sink, profile))
+                print(f"Background removed using {model} with and without alpha matting.")
             except Exception as model_error:
                 print(f"Error processing model {model}: {str(model_error)}")
                 continue  # Skip to the next model if there's an error
@@ -89,4 +99,6 @@ if __name__ == "__main__":
     with open(input_image, "rb") as f:
         image_data = f.read()
     base_filename = os.path.splitext(os.path.basename(input_image))[0]
-    remove_background_from_data(image_data, base_filename)
+    sink = StoreSink(base_filename)
+    remove_background_from_data(image_data, base_filename, sink)
+    print(sink.flush())
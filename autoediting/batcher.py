@@ -0,0 +1,77 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Collects segmentation requests from concurrent callers (emails, Flask
+# requests) per model and runs them as one batched forward pass. A batch is
+# dispatched when it is full or when its oldest request has waited for the
+# window, so the window bounds the extra latency any caller can see.
+class MicroBatcher:
+    def __init__(self, backend, input_size, max_batch=8, window_ms=50):
+        self.backend = backend
+        self.name = f"batched-{backend.name}"
+        self.input_size = input_size
+        self.max_batch = max_batch
+        self.window = window_ms / 1000
+        self._queues = {}
+        self._cond = threading.Condition()
+        self._worker = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._worker.start()
+
+    def submit(self, model, img):
+        # Shrink to the model input on the caller's thread: it keeps queued
+        # requests small and takes the resize off the batch's critical path
+        proxy = img.convert("RGB").resize((self.input_size, self.input_size), Image.BILINEAR)
+        future = Future()
+        with self._cond:
+            self._queues.setdefault(model, []).append((proxy, future, time.monotonic()))
+            self._cond.notify()
+        return future
+
+    def predict_mask(self, model, img):
+        return self.submit(model, img).result()
+
+    def predict_masks(self, model, images):
+        futures = [self.submit(model, img) for img in images]
+        return [future.result() for future in futures]
+
+    def _next_batch(self):
+        with self._cond:
+            while not any(self._queues.values()):
+                self._cond.wait()
+
+            # Serve the model whose oldest request has been waiting longest
+            model = min((m for m, q in self._queues.items() if q), key=lambda m: self._queues[m][0][2])
+            queue = self._queues[model]
+            deadline = queue[0][2] + self.window
+            while len(queue) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch = queue[:self.max_batch]
+            del queue[:self.max_batch]
+            return model, batch
+
+    def _run(self):
+        while True:
+            model, batch = self._next_batch()
+            images = [proxy for proxy, _, _ in batch]
+            futures = [future for _, future, _ in batch]
+            start = time.monotonic()
+            try:
+                masks = self.backend.predict_masks(model, images)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+
+            for future, mask in zip(futures, masks):
+                future.set_result(mask)
+            logger.debug(f"Batched {len(batch)} {model} images; oldest waited "
+                         f"{(start - batch[0][2]) * 1000:.0f} ms, inference {(time.monotonic() - start) * 1000:.0f} ms")
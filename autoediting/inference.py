@@ -0,0 +1,242 @@
+import logging
+import os
+import sys
+import threading
+import time
+import numpy as np
+from PIL import Image
+from io import BytesIO
+from config import load_inference_config
+from autoediting.batcher import MicroBatcher
+from autoediting.weights import checkpoint_name, load_net, externalize_onnx, memory_usage
+
+logger = logging.getLogger(__name__)
+
+# ImageNet statistics used by the u2net family (see backgroundremover's ToTensorLab)
+MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+def preprocess_batch(images, input_size):
+    # Same normalisation as backgroundremover: resize to the model input,
+    # scale by the image maximum, then ImageNet mean/std, laid out as NCHW
+    batch = np.empty((len(images), 3, input_size, input_size), dtype=np.float32)
+    for i, img in enumerate(images):
+        resized = np.asarray(img.convert("RGB").resize((input_size, input_size), Image.BILINEAR), dtype=np.float32)
+        resized /= max(float(resized.max()), 1.0)
+        batch[i] = ((resized - MEAN) / STD).transpose(2, 0, 1)
+    return batch
+
+def postprocess_batch(d1):
+    # d1 is (N, 1, H, W); min-max normalise each mask like detect.norm_pred
+    masks = []
+    for pred in d1[:, 0]:
+        mi, ma = float(pred.min()), float(pred.max())
+        scaled = (pred - mi) / (ma - mi) if ma > mi else np.zeros_like(pred)
+        masks.append(Image.fromarray((scaled * 255).astype(np.uint8), mode="L"))
+    return masks
+
+class TorchBackend:
+    # backgroundremover's own fp32 torch models, run a whole batch at a time
+    name = 'torch'
+
+    def __init__(self, config):
+        import torch
+        torch.set_num_threads(config['intra_op_threads'])
+        try:
+            torch.set_num_interop_threads(config['inter_op_threads'])
+        except RuntimeError:
+            pass  # Can only be set once per process, before any parallel work
+        self.config = config
+        self._nets = {}
+        self._lock = threading.Lock()
+
+    def get_net(self, model):
+        from backgroundremover.bg import get_model
+        name = checkpoint_name(model)
+        with self._lock:
+            if name not in self._nets:
+                if self.config['mmap_weights']:
+                    self._nets[name] = load_net(self.config['weights_dir'], model)
+                else:
+                    self._nets[name] = get_model(model)
+                logger.info(f"Loaded {name} weights; memory {memory_usage()}")
+            return self._nets[name]
+
+    def predict_masks(self, model, images):
+        # One forward pass over the stacked batch, with the same pre- and
+        # post-processing as the ONNX backend (and detect.predict)
+        import torch
+        net = self.get_net(model)
+        device = next(net.parameters()).device
+        batch = torch.from_numpy(preprocess_batch(images, self.config['input_size'])).to(device)
+        with torch.no_grad():
+            d1 = net(batch)[0]
+        return postprocess_batch(d1.cpu().numpy())
+
+    def predict_mask(self, model, img):
+        return self.predict_masks(model, [img])[0]
+
+class DetectReference(TorchBackend):
+    # Parity baseline: backgroundremover's own per-image detect.predict, so
+    # the shared pre- and post-processing is checked too, not just the nets
+    name = 'torch-detect'
+
+    def __init__(self, config):
+        # Always backgroundremover's own checkpoint loading as well
+        super().__init__({**config, 'mmap_weights': False})
+
+    def predict_masks(self, model, images):
+        from backgroundremover.u2net import detect
+        net = self.get_net(model)
+        return [detect.predict(net, np.array(img.convert("RGB"))).convert("L") for img in images]
+
+class OnnxBackend:
+    # Runs the same u2net-family weights through ONNX Runtime, optionally int8-quantized
+    name = 'onnx'
+
+    def __init__(self, config):
+        self.config = config
+        self.model_dir = config['onnx_model_dir']
+        self.input_size = config['input_size']
+        self._sessions = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.model_dir, exist_ok=True)
+
+    def model_path(self, model):
+        suffix = '.int8' if self.config['quantize'] else ''
+        return os.path.join(self.model_dir, f"{checkpoint_name(model)}{suffix}.onnx")
+
+    def session_path(self, model):
+        if self.config['mmap_weights']:
+            return self.model_path(model).replace('.onnx', '.mmap.onnx')
+        return self.model_path(model)
+
+    def export_model(self, model):
+        # One-off conversion of backgroundremover's torch checkpoint
+        import torch
+        from backgroundremover.bg import get_model
+        fp32_path = os.path.join(self.model_dir, f"{checkpoint_name(model)}.onnx")
+        if not os.path.exists(fp32_path):
+            net = get_model(model).cpu().eval()
+            dummy = torch.zeros(1, 3, self.input_size, self.input_size)
+            output_names = [f"d{i}" for i in range(1, 8)]
+            torch.onnx.export(
+                net, dummy, fp32_path,
+                input_names=['input'],
+                output_names=output_names,
+                dynamic_axes={name: {0: 'batch'} for name in ['input'] + output_names},
+                opset_version=11,
+            )
+            logger.info(f"Exported {model} to {fp32_path}")
+
+        if self.config['quantize'] and not os.path.exists(self.model_path(model)):
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+            quantize_dynamic(fp32_path, self.model_path(model), weight_type=QuantType.QUInt8)
+            logger.info(f"Quantized {model} to {self.model_path(model)}")
+
+        if self.config['mmap_weights']:
+            externalize_onnx(self.model_path(model), self.session_path(model))
+
+    def get_session(self, model):
+        import onnxruntime as ort
+        name = checkpoint_name(model)
+        with self._lock:
+            if name not in self._sessions:
+                path = self.session_path(model)
+                if not os.path.exists(path):
+                    self.export_model(model)
+
+                options = ort.SessionOptions()
+                options.intra_op_num_threads = self.config['intra_op_threads']
+                options.inter_op_num_threads = self.config['inter_op_threads']
+                options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+                options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+                if self.config['mmap_weights']:
+                    # Keep using the mapped initializers instead of private
+                    # prepacked copies, so workers share the weight pages
+                    options.add_session_config_entry('session.disable_prepacking', '1')
+                self._sessions[name] = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+                logger.info(f"Loaded {name} session; memory {memory_usage()}")
+            return self._sessions[name]
+
+    def predict_masks(self, model, images):
+        session = self.get_session(model)
+        batch = preprocess_batch(images, self.input_size)
+        d1 = session.run(['d1'], {'input': batch})[0]
+        return postprocess_batch(d1)
+
+    def predict_mask(self, model, img):
+        return self.predict_masks(model, [img])[0]
+
+BACKENDS = {
+    'torch': TorchBackend,
+    'onnx': OnnxBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            config = load_inference_config()
+            if config['backend'] not in BACKENDS:
+                raise ValueError(f"Unknown inference backend: {config['backend']}")
+            _backend = BACKENDS[config['backend']](config)
+            if config['batching']:
+                _backend = MicroBatcher(_backend, config['input_size'],
+                                        max_batch=config['batch_max_size'],
+                                        window_ms=config['batch_window_ms'])
+        return _backend
+
+def check_parity(image_data, models, reference=None, candidate=None):
+    # Compare a candidate backend's masks against backgroundremover's detect.predict
+    config = load_inference_config()
+    reference = reference or DetectReference(config)
+    candidate = candidate or get_backend()
+    img = Image.open(BytesIO(image_data)).convert("RGB")
+
+    report = []
+    for model in models:
+        # Warm up both sides so model loading is not counted as inference time
+        reference.predict_mask(model, img)
+        candidate.predict_mask(model, img)
+
+        start = time.perf_counter()
+        expected = np.asarray(reference.predict_mask(model, img), dtype=np.float32)
+        reference_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        actual = candidate.predict_mask(model, img).resize(expected.shape[::-1], Image.BILINEAR)
+        candidate_seconds = time.perf_counter() - start
+        actual = np.asarray(actual, dtype=np.float32)
+
+        expected_fg = expected >= 128
+        actual_fg = actual >= 128
+        union = np.logical_or(expected_fg, actual_fg).sum()
+        mean_diff = float(np.abs(expected - actual).mean())
+        report.append({
+            'model': model,
+            'mean_abs_diff': round(mean_diff, 3),
+            'iou': round(float(np.logical_and(expected_fg, actual_fg).sum() / union) if union else 1.0, 4),
+            'reference_ms': round(reference_seconds * 1000, 1),
+            'candidate_ms': round(candidate_seconds * 1000, 1),
+            'passed': mean_diff <= config['parity_max_mean_diff'],
+        })
+    return report
+
+if __name__ == "__main__":
+    # Usage: python -m autoediting.inference <image> [model ...]
+    from autoediting.backremove import MODEL_CHOICES
+    with open(sys.argv[1], "rb") as f:
+        image_data = f.read()
+    config = load_inference_config()
+    reference = DetectReference(config)
+    # The configured backend, and the batched torch path when that isn't it
+    candidates = [get_backend()]
+    if config['backend'] != 'torch':
+        candidates.append(TorchBackend(config))
+    for candidate in candidates:
+        for row in check_parity(image_data, sys.argv[2:] or MODEL_CHOICES, reference, candidate):
+            print({'backend': candidate.name, **row})
@@ -0,0 +1,65 @@
+import cv2
+import numpy as np
+from PIL import Image
+from io import BytesIO
+
+def decode_proxy(data, max_side):
+    img = Image.open(BytesIO(data))
+    full_size = img.size
+    # For JPEGs this makes libjpeg decode at a reduced DCT scale, so the
+    # full-resolution raster is never materialised just to build the proxy
+    img.draft("RGB", (max_side, max_side))
+    img = img.convert("RGB")
+    img.thumbnail((max_side, max_side), Image.BILINEAR)
+    return img, full_size
+
+def resize_band(src, full_size, y0, y1, interpolation=cv2.INTER_LINEAR):
+    # Rows [y0, y1) of cv2.resize(src, full_size), without building the whole
+    # full-size plane. Uses the same pixel-centre mapping as cv2.resize, so
+    # neighbouring bands line up without seams.
+    full_w, full_h = full_size
+    sx = src.shape[1] / full_w
+    sy = src.shape[0] / full_h
+    matrix = np.array([[sx, 0, 0.5 * sx - 0.5],
+                       [0, sy, (y0 + 0.5) * sy - 0.5]], dtype=np.float64)
+    return cv2.warpAffine(src, matrix, (full_w, y1 - y0),
+                          flags=interpolation | cv2.WARP_INVERSE_MAP,
+                          borderMode=cv2.BORDER_REPLICATE)
+
+def box(img, radius):
+    return cv2.boxFilter(img, cv2.CV_32F, (2 * radius + 1, 2 * radius + 1))
+
+def guided_coefficients(guide, src, radius, eps):
+    # Local linear model q = a * I + b from He et al.'s guided filter, with
+    # both inputs as float32 planes in [0, 1]
+    mean_i = box(guide, radius)
+    mean_p = box(src, radius)
+    cov_ip = box(guide * src, radius) - mean_i * mean_p
+    var_i = box(guide * guide, radius) - mean_i * mean_i
+    a = cov_ip / (var_i + eps)
+    b = mean_p - a * mean_i
+    return box(a, radius), box(b, radius)
+
+def guided_upsample(mask, proxy, full_gray, radius, eps, band_rows=512):
+    # Fast guided filter: fit the coefficients at proxy resolution, then
+    # upsample them band by band and apply them to the full-resolution guide.
+    # Peak extra memory is a few float planes of band_rows x width.
+    guide = np.asarray(proxy.convert("L"), dtype=np.float32) / 255
+    src = np.asarray(mask.resize(proxy.size, Image.BILINEAR), dtype=np.float32) / 255
+    mean_a, mean_b = guided_coefficients(guide, src, radius, eps)
+
+    full_h, full_w = full_gray.shape
+    alpha = np.empty((full_h, full_w), dtype=np.uint8)
+    for y0 in range(0, full_h, band_rows):
+        y1 = min(y0 + band_rows, full_h)
+        a = resize_band(mean_a, (full_w, full_h), y0, y1)
+        b = resize_band(mean_b, (full_w, full_h), y0, y1)
+        q = a * (full_gray[y0:y1].astype(np.float32) / 255) + b
+        alpha[y0:y1] = np.clip(q * 255 + 0.5, 0, 255).astype(np.uint8)
+    return Image.fromarray(alpha, mode="L")
+
+def compose_cutout(full_rgb, alpha):
+    # Single full-resolution composite: straight alpha over the original pixels
+    cutout = full_rgb.copy()
+    cutout.putalpha(alpha)
+    return cutout
@@ -0,0 +1,146 @@
+import logging
+import os
+import threading
+import cv2
+import numpy as np
+from PIL import Image
+from io import BytesIO
+from anal import estimate_ink_colours
+from config import load_segmentation_config
+from autoediting.weights import checkpoint_name
+
+logger = logging.getLogger(__name__)
+
+# Content-aware model routing: instead of running every model on every
+# upload, a few cheap features of a thumbnail pick the model most likely to
+# cut it out cleanly:
+#   people (faces found)            -> u2net_human_seg
+#   flat-colour graphics and logos  -> u2net, with u2netp as the fallback
+#   photos on a plain background    -> u2net
+#   cluttered photos                -> u2net, with u2netp as the fallback
+# Only u2net, u2netp and u2net_human_seg have weights of their own (silueta,
+# isnet-general-use and sam load u2net, see weights.checkpoint_name), so
+# routing only ever chooses between those three.
+# When the rule's confidence is under route_confidence the fallback model
+# runs as well, and pick_best_result keeps whichever mask looks cleaner.
+
+_cascade = None
+_cascade_lock = threading.Lock()
+
+def face_cascade():
+    # Returns None (and routing ignores faces) when OpenCV ships without its
+    # Haar data files
+    global _cascade
+    with _cascade_lock:
+        if _cascade is None:
+            data_dir = getattr(getattr(cv2, 'data', None), 'haarcascades', '')
+            path = os.path.join(data_dir, 'haarcascade_frontalface_default.xml')
+            cascade = cv2.CascadeClassifier(path) if os.path.exists(path) else None
+            if cascade is None or cascade.empty():
+                logger.warning("Haar face cascade not available; routing without face detection")
+                cascade = False
+            _cascade = cascade
+    return _cascade or None
+
+def route_thumbnail(data, max_side):
+    img = Image.open(BytesIO(data))
+    img.draft("RGB", (max_side, max_side))
+    has_alpha = img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info)
+    img = img.convert("RGBA" if has_alpha else "RGB")
+    img.thumbnail((max_side, max_side), Image.BILINEAR)
+    return img
+
+def image_features(thumbnail, config):
+    rgb = np.asarray(thumbnail.convert("RGB"))
+    gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+    height, width = gray.shape
+
+    # Flat background: an opaque border that is nearly one colour, or a
+    # mostly transparent border
+    ring = max(2, round(min(width, height) * 0.04))
+    border = np.ones(gray.shape, dtype=bool)
+    border[ring:-ring, ring:-ring] = False
+    transparent_border = 0.0
+    if thumbnail.mode == 'RGBA':
+        transparent_border = float((np.asarray(thumbnail.getchannel('A'))[border] < 128).mean())
+    border_pixels = rgb[border].astype(np.int16)
+    spread = np.abs(border_pixels - np.median(border_pixels, axis=0)).max(axis=1)
+    flat_border = float((spread <= config['route_flat_tolerance']).mean())
+
+    # Edge density: share of Canny edge pixels inside the border
+    edges = cv2.Canny(gray, 100, 200)
+    edge_density = float((edges[~border] > 0).mean())
+
+    inks = estimate_ink_colours(thumbnail)
+
+    faces = []
+    cascade = face_cascade()
+    if cascade is not None:
+        min_side = max(12, round(min(width, height) * 0.06))
+        faces = cascade.detectMultiScale(cv2.equalizeHist(gray), scaleFactor=1.1, minNeighbors=5,
+                                         minSize=(min_side, min_side))
+    face_fraction = float(sum(w * h for _, _, w, h in faces) / (width * height)) if len(faces) else 0.0
+
+    return {
+        'flat_background': max(flat_border, transparent_border),
+        'edge_density': round(edge_density, 4),
+        'ink_colours': inks['count'],
+        'photographic': inks['photographic'],
+        'faces': len(faces),
+        'face_fraction': round(face_fraction, 4),
+        'faces_checked': cascade is not None,
+    }
+
+def route_model(features, config):
+    # Returns (primary, fallback, confidence, reason)
+    flat = features['flat_background'] >= config['route_flat_share']
+    if features['faces'] and features['face_fraction'] >= config['route_min_face_fraction']:
+        confidence = min(0.95, 0.6 + 20 * features['face_fraction'])
+        return 'u2net_human_seg', 'u2net', confidence, f"{features['faces']} face(s)"
+    if not features['photographic'] and features['ink_colours'] <= config['route_max_graphic_colours']:
+        confidence = 0.9 if flat else 0.6
+        return 'u2net', 'u2netp', confidence, f"graphic, {features['ink_colours']} colour(s)"
+    if flat:
+        return 'u2net', 'u2netp', 0.8, "photo on a plain background"
+    if features['edge_density'] >= config['route_clutter_edges']:
+        return 'u2net', 'u2netp', 0.4, "cluttered photo"
+    # A photo with a busy but soft background; a person facing away lands here too
+    confidence = 0.55 if features['faces_checked'] else 0.5
+    return 'u2net', 'u2net_human_seg', confidence, "photo"
+
+def choose_models(data, config=None, available=None):
+    # Returns (models to run, routing details); the primary model is first
+    config = config or load_segmentation_config()
+    features = image_features(route_thumbnail(data, config['route_thumbnail_side']), config)
+    primary, fallback, confidence, reason = route_model(features, config)
+    models = [primary] if confidence >= config['route_confidence'] else [primary, fallback]
+    if available is not None:
+        models = [model for model in models if model in available] or [available[0]]
+    # Two names for the same weights would only produce the same mask twice
+    distinct = []
+    for model in models:
+        if checkpoint_name(model) not in [checkpoint_name(kept) for kept in distinct]:
+            distinct.append(model)
+    models = distinct
+    logger.info(f"Routed to {', '.join(models)} ({reason}, confidence {confidence:.2f}): {features}")
+    return models, {'features': features, 'reason': reason, 'confidence': confidence}
+
+def mask_quality(result):
+    # Clean cutouts are near-binary with a plausible amount of foreground;
+    # a mask that is mostly grey or keeps (almost) nothing or everything scores low
+    alpha = result['with_alpha'].image.getchannel('A')
+    alpha.thumbnail((256, 256), Image.BILINEAR)
+    values = np.asarray(alpha)
+    decided = float(((values < 16) | (values > 239)).mean())
+    foreground = float((values >= 128).mean())
+    plausible = 1.0 if 0.01 <= foreground <= 0.97 else 0.2
+    return decided * plausible
+
+def pick_best_result(results):
+    # The primary model wins ties; a fallback has to be clearly better
+    best, best_score = None, -1.0
+    for index, result in enumerate(results):
+        score = mask_quality(result) - (0.05 if index else 0.0)
+        if score > best_score:
+            best, best_score = result, score
+    return best
@@ -1,57 +1,23 @@
 import os
 import vtracer
 from io import BytesIO
+from store import get_store
 
 def convert_to_svg(input_path):
     try:
+        with open(input_path, "rb") as f:
+            data = f.read()
         base_filename = os.path.splitext(os.path.basename(input_path))[0]
-        output_folder = f"{base_filename}_svg_output"
-        os.makedirs(output_folder, exist_ok=True)
-
-        # Define different conversion modes
-        modes = [
-            {"name": "default", "params": {}},
-            {"name": "binary", "params": {"colormode": "binary"}},
-            {"name": "detailed", "params": {
-                "colormode": "color",
-                "hierarchical": "stacked",
-                "mode": "spline",
-                "filter_speckle": 4,
-                "color_precision": 6,
-                "layer_difference": 16,
-                "corner_threshold": 60,
-                "length_threshold": 4.0,
-                "max_iterations": 10,
-                "splice_threshold": 45,
-                "path_precision": 3
-            }}
-        ]
-
-        results = []
-        for mode in modes:
-            try:
-                output_path = os.path.join(output_folder, f"{base_filename}_{mode['name']}.svg")
-                vtracer.convert_image_to_svg_py(input_path, output_path, **mode['params'])
-                print(f"Image converted to SVG using {mode['name']} mode. Output saved to {output_path}")
-                results.append({
-                    'mode': mode['name'],
-                    'filename': f"{base_filename}_{mode['name']}.svg",
-                    'path': output_path
-                })
-            except Exception as mode_error:
-                print(f"Error processing {mode['name']} mode: {str(mode_error)}")
-                continue
-
-        print(f"All SVG conversion operations completed. Results saved in {output_folder}")
-        return results
+        return convert_to_svg_from_data(data, base_filename)
     except Exception as e:
         print(f"An error occurred: {str(e)}")
         return None
 
-def convert_to_svg_from_data(data, base_filename):
+def convert_to_svg_from_data(data, base_filename, job_id=None):
     try:
-        output_folder = f"{base_filename}_svg_output"
-        os.makedirs(output_folder, exist_ok=True)
+        # SVGs are filed in the artifact store under the job they belong to
+        store = get_store()
+        job_id = job_id or base_filename
 
         # Define different conversion modes
         modes = [
@@ -76,20 +42,19 @@ def convert_to_svg_from_data(data, base_filename):
         for mode in modes:
             try:
                 svg_str = vtracer.convert_raw_image_to_svg(data, **mode['params'])
-                output_path = os.path.join(output_folder, f"{base_filename}_{mode['name']}.svg")
-                with open(output_path, 'w') as f:
-                    f.write(svg_str)
-                print(f"Image converted to SVG using {mode['name']} mode. Output saved to {output_path}")
+                filename = f"{base_filename}_{mode['name']}.svg"
+                stored = store.put(job_id, filename, svg_str.encode('utf-8'))
+                print(f"Image converted to SVG using {mode['name']} mode. Output saved to {stored['path']}")
                 results.append({
                     'mode': mode['name'],
-                    'filename': f"{base_filename}_{mode['name']}.svg",
-                    'path': output_path
+                    'filename': filename,
+                    'path': stored['path']
                 })
             except Exception as mode_error:
                 print(f"Error processing {mode['name']} mode: {str(mode_error)}")
                 continue
 
-        print(f"All SVG conversion operations completed. Results saved in {output_folder}")
+        print(f"All SVG conversion operations completed. Results saved under job {job_id}")
         return results
     except Exception as e:
         print(f"An error occurred: {str(e)}")
@@ -0,0 +1,126 @@
+import json
+import logging
+import os
+import resource
+import struct
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Read-only weight files that every worker memory-maps instead of unpickling
+# its own copy of the checkpoint. Pages come from the OS page cache, so N
+# forked or spawned workers share one physical copy of each model.
+#
+# Layout: MAGIC, little-endian u64 header length, JSON header mapping tensor
+# name -> {dtype, shape, offset, nbytes}, then raw tensor data with every
+# tensor starting on an ALIGNMENT-byte boundary.
+MAGIC = b'EZWTS001'
+ALIGNMENT = 64
+
+def checkpoint_name(model):
+    # backgroundremover.bg.get_model serves u2net for every name it doesn't
+    # know, so silueta, isnet-general-use and sam all share one set of weights
+    return model if model in ('u2netp', 'u2net_human_seg') else 'u2net'
+
+def weights_path(weights_dir, model):
+    return os.path.join(weights_dir, f"{checkpoint_name(model)}.weights")
+
+def write_weights(path, state_dict):
+    header, offset = {}, 0
+    arrays = {}
+    for name, tensor in state_dict.items():
+        array = tensor.detach().cpu().numpy()
+        array = np.ascontiguousarray(array).reshape(array.shape)  # Keeps 0-d buffers 0-d
+        offset = -(-offset // ALIGNMENT) * ALIGNMENT
+        header[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset, 'nbytes': array.nbytes}
+        arrays[name] = array
+        offset += array.nbytes
+
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_start = -(-(len(MAGIC) + 8 + len(header_bytes)) // ALIGNMENT) * ALIGNMENT
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC + struct.pack('<Q', len(header_bytes)) + header_bytes)
+        for name, array in arrays.items():
+            f.seek(data_start + header[name]['offset'])
+            f.write(array.tobytes())
+    os.replace(tmp_path, path)  # Readers never see a half-written file
+
+def read_weights(path):
+    # Returns name -> numpy views into a copy-on-write mapping of the file.
+    # Nothing is read until a page is touched, and untouched or read-only
+    # pages stay shared with every other process mapping the same file.
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"Not a weights file: {path}")
+        (header_length,) = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(header_length))
+    data_start = -(-(len(MAGIC) + 8 + header_length) // ALIGNMENT) * ALIGNMENT
+    mapped = np.memmap(path, dtype=np.uint8, mode='c')
+    arrays = {}
+    for name, info in header.items():
+        start = data_start + info['offset']
+        arrays[name] = mapped[start:start + info['nbytes']].view(np.dtype(info['dtype'])).reshape(info['shape'])
+    return arrays
+
+def export_weights(weights_dir, model):
+    # One-off conversion of backgroundremover's pickled checkpoint
+    from backgroundremover.bg import get_model
+    os.makedirs(weights_dir, exist_ok=True)
+    path = weights_path(weights_dir, model)
+    write_weights(path, get_model(checkpoint_name(model)).cpu().state_dict())
+    logger.info(f"Exported {checkpoint_name(model)} weights to {path}")
+    return path
+
+def load_net(weights_dir, model):
+    # Build the network without allocating parameters, then point every
+    # parameter and buffer at the mapped file
+    import torch
+    from backgroundremover.u2net import u2net
+    path = weights_path(weights_dir, model)
+    if not os.path.exists(path):
+        export_weights(weights_dir, model)
+
+    net_class = u2net.U2NETP if checkpoint_name(model) == 'u2netp' else u2net.U2NET
+    with torch.device('meta'):
+        net = net_class(3, 1)
+    state_dict = {name: torch.from_numpy(array) for name, array in read_weights(path).items()}
+    net.load_state_dict(state_dict, assign=True)
+    return net.eval()
+
+def externalize_onnx(src_path, dst_path):
+    # Move ONNX initializers into a side file so ONNX Runtime can map them
+    # rather than copying them out of the protobuf into each session
+    import onnx
+    model = onnx.load(src_path)
+    onnx.save_model(model, dst_path, save_as_external_data=True, all_tensors_to_one_file=True,
+                    location=f"{os.path.basename(dst_path)}.data", size_threshold=1024)
+    logger.info(f"Wrote {dst_path} with external weights")
+
+def memory_usage():
+    # Resident and proportional set size of this process in MB. Pss splits
+    # shared pages between the processes mapping them, so summing it across
+    # workers gives real host usage; Shared_Clean is mostly mapped weights.
+    usage = {'pid': os.getpid()}
+    fields = {'Rss': 'rss_mb', 'Pss': 'pss_mb', 'Shared_Clean': 'shared_clean_mb', 'Private_Dirty': 'private_dirty_mb'}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in fields:
+                    usage[fields[key]] = round(int(value.split()[0]) / 1024, 1)
+        return usage
+    except OSError:
+        pass
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    usage['rss_mb'] = round(int(line.split()[1]) / 1024, 1)
+                    return usage
+    except OSError:
+        pass
+    # Peak rather than current RSS; kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    usage['max_rss_mb'] = round(peak / (1024 * 1024 if os.uname().sysname == 'Darwin' else 1024), 1)
+    return usage
@@ -0,0 +1,235 @@
+import argparse
+import asyncio
+import glob
+import json
+import logging
+import mailbox
+import mimetypes
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache
+from config import load_processing_config
+
+logger = logging.getLogger(__name__)
+
+# Offline batch mode: runs the same process_image_data -> generate_reply
+# stages as the email pipeline over a directory, a glob, or a local
+# mbox/Maildir, with a pool of worker processes. Instead of sending mail,
+# each job's reply and attachments are written under the output directory
+# and a line is appended to a JSONL results file. That file is also the
+# checkpoint: re-running the same command skips jobs already recorded.
+#
+#   python batch.py ~/backlog/*.png --workers 4
+#   python batch.py archive.mbox --output reprocessed --results reprocessed.jsonl
+
+def safe_id(text):
+    return re.sub(r'[^A-Za-z0-9._-]+', '_', text).strip('_')[:150]
+
+def is_glob(source):
+    return any(char in source for char in '*?[')
+
+def is_maildir(path):
+    return os.path.isdir(path) and all(os.path.isdir(os.path.join(path, sub)) for sub in ('cur', 'new', 'tmp'))
+
+def image_files(paths):
+    supported = load_processing_config()
+    for path in sorted(paths):
+        mime_type = mimetypes.guess_type(path)[0]
+        if os.path.isfile(path) and mime_type in supported:
+            yield path, mime_type
+
+def file_jobs(paths, root):
+    for path, mime_type in image_files(paths):
+        yield {
+            'job_id': safe_id(os.path.relpath(path, root)),
+            'kind': 'file',
+            'source': path,
+            'sender': None,
+            'subject': os.path.basename(path),
+            'content': '',
+            'attachments': [{'filename': os.path.basename(path), 'mimeType': mime_type, 'ref': path}],
+        }
+
+@lru_cache(maxsize=4)
+def open_mailbox(kind, path):
+    # One parsed mailbox per worker process, not one per job
+    return mailbox.Maildir(path, create=False) if kind == 'maildir' else mailbox.mbox(path, create=False)
+
+def message_text(message):
+    for part in message.walk():
+        if part.get_content_type() == 'text/plain' and not part.get_filename():
+            payload = part.get_payload(decode=True)
+            if payload:
+                return payload.decode(part.get_content_charset() or 'utf-8', errors='replace')
+    return ''
+
+def mailbox_jobs(kind, path):
+    supported = load_processing_config()
+    box = open_mailbox(kind, path)
+    for key, message in box.items():
+        attachments = []
+        for index, part in enumerate(message.walk()):
+            if part.get_filename() and part.get_content_type() in supported:
+                attachments.append({'filename': part.get_filename(), 'mimeType': part.get_content_type(), 'ref': index})
+        if attachments:
+            yield {
+                'job_id': safe_id(f"{os.path.basename(os.path.normpath(path))}-{key}"),
+                'kind': kind,
+                'source': path,
+                'key': key,
+                'sender': message.get('From'),
+                'subject': message.get('Subject') or '',
+                'content': message_text(message),
+                'attachments': attachments,
+            }
+
+def collect_jobs(source):
+    if is_glob(source):
+        return list(file_jobs(glob.glob(source, recursive=True), os.path.dirname(source.split('*')[0]) or '.'))
+    if is_maildir(source):
+        return list(mailbox_jobs('maildir', source))
+    if os.path.isdir(source):
+        paths = [os.path.join(dirpath, name) for dirpath, _, names in os.walk(source) for name in names]
+        return list(file_jobs(paths, source))
+    if os.path.isfile(source) and mimetypes.guess_type(source)[0] in load_processing_config():
+        return list(file_jobs([source], os.path.dirname(source) or '.'))
+    if os.path.isfile(source):
+        return list(mailbox_jobs('mbox', source))
+    raise FileNotFoundError(f"No such file, directory or matching glob: {source}")
+
+def load_attachment(job, attachment):
+    if job['kind'] == 'file':
+        with open(attachment['ref'], 'rb') as f:
+            return f.read()
+    message = open_mailbox(job['kind'], job['source'])[job['key']]
+    return list(message.walk())[attachment['ref']].get_payload(decode=True)
+
+def completed_jobs(results_path, retry_failed=False):
+    done = set()
+    if os.path.exists(results_path):
+        with open(results_path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # A line cut short by an interrupted run
+                if not (retry_failed and record['status'] != 'success'):
+                    done.add(record['job_id'])
+    return done
+
+async def process_job(job, output_dir):
+    from email_processor import process_image_data, generate_reply
+    from anal import metrics_to_dict
+
+    results = []
+    for attachment in job['attachments']:
+        image_data = load_attachment(job, attachment)
+        result = await process_image_data(attachment, image_data, job['job_id'])
+        results.extend(result if isinstance(result, list) else [result])
+
+    job_dir = os.path.join(output_dir, job['job_id'])
+    os.makedirs(job_dir, exist_ok=True)
+    reply_error = None
+    try:
+        reply, attachments_data = await asyncio.to_thread(generate_reply, job['content'], results)
+        with open(os.path.join(job_dir, 'reply.txt'), 'w') as f:
+            f.write(reply)
+        for attachment in attachments_data:
+            with open(os.path.join(job_dir, attachment['filename']), 'wb') as f:
+                f.write(attachment['data'])
+    except Exception as e:
+        reply_error = str(e)
+        logger.error(f"Failed to build reply for {job['job_id']}: {reply_error}")
+
+    outputs = []
+    for result in results:
+        if result.get('sink') is not None:
+            outputs.append(await asyncio.to_thread(result['sink'].flush))
+        else:
+            outputs.append([])
+
+    return {
+        'attachments': [
+            {
+                'filename': result['filename'],
+                'status': result['status'],
+                # Raw metrics plus the verdicts they got; re-assessing under new
+                # thresholds only needs anal.assess_metrics on the stored record
+                'analysis': metrics_to_dict(result['analysis']) if result['analysis'] else None,
+                'assessment': result['assessment'],
+                'image_info': result['image_info'],
+                'outputs': paths,
+            }
+            for result, paths in zip(results, outputs)
+        ],
+        'reply_dir': job_dir,
+        'reply_error': reply_error,
+    }
+
+def run_job(job, output_dir):
+    # Runs in a worker process; every failure comes back as a result line
+    start = time.monotonic()
+    try:
+        record = asyncio.run(process_job(job, output_dir))
+        statuses = [attachment['status'] for attachment in record['attachments']]
+        status = 'success' if statuses and all(s == 'success' for s in statuses) and not record['reply_error'] else 'failed'
+    except Exception as e:
+        record, status = {'error': str(e)}, 'error'
+    return {
+        'job_id': job['job_id'],
+        'source': job['source'],
+        'sender': job['sender'],
+        'subject': job['subject'],
+        'status': status,
+        'images': len(job['attachments']),
+        'seconds': round(time.monotonic() - start, 3),
+        **record,
+    }
+
+def run_batch(sources, output_dir='batch_output', results_path=None, workers=None, retry_failed=False):
+    results_path = results_path or os.path.join(output_dir, 'results.jsonl')
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = [job for source in sources for job in collect_jobs(source)]
+    done = completed_jobs(results_path, retry_failed)
+    pending = [job for job in jobs if job['job_id'] not in done]
+    total_images = sum(len(job['attachments']) for job in pending)
+    logger.info(f"{len(jobs)} jobs found, {len(jobs) - len(pending)} already done, "
+                f"{len(pending)} to run ({total_images} images)")
+    if not pending:
+        return {'jobs': 0, 'images': 0, 'failed': 0, 'seconds': 0.0, 'images_per_second': 0.0}
+
+    start = time.monotonic()
+    images, failed = 0, 0
+    with open(results_path, 'a') as results_file, ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_job, job, output_dir) for job in pending]
+        for count, future in enumerate(as_completed(futures), 1):
+            record = future.result()
+            # One flushed line per job doubles as the resume checkpoint
+            results_file.write(json.dumps(record, default=str) + '\n')
+            results_file.flush()
+            images += record['images']
+            failed += record['status'] != 'success'
+            elapsed = time.monotonic() - start
+            logger.info(f"[{count}/{len(pending)}] {record['job_id']}: {record['status']} in {record['seconds']:.1f}s "
+                        f"({images / elapsed:.2f} images/s)")
+
+    elapsed = time.monotonic() - start
+    summary = {'jobs': len(pending), 'images': images, 'failed': failed,
+               'seconds': round(elapsed, 1), 'images_per_second': round(images / elapsed, 3)}
+    logger.info(f"Batch complete: {summary}")
+    return summary
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Run the proofing pipeline over a directory, glob, mbox or Maildir")
+    parser.add_argument('sources', nargs='+', help="Directories, glob patterns, image files, mbox files or Maildirs")
+    parser.add_argument('--output', default='batch_output', help="Where replies and attachments are written")
+    parser.add_argument('--results', default=None, help="JSONL results/checkpoint file (default: OUTPUT/results.jsonl)")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument('--retry-failed', action='store_true', help="Re-run jobs recorded as failed")
+    args = parser.parse_args()
+    summary = run_batch(args.sources, args.output, args.results, args.workers, args.retry_failed)
+    sys.exit(1 if summary['failed'] else 0)
@@ -0,0 +1,181 @@
+import hashlib
+import logging
+import os
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from PIL import Image, ImageCms
+from config import load_color_config
+
+logger = logging.getLogger(__name__)
+
+# Colour management with everything expensive built once: embedded ICC
+# profiles are parsed once per distinct profile, and LittleCMS transforms are
+# cached per (source profile, target profile, modes, intent, proof profile).
+# Applying a transform is then just pixel work, done in row tiles on a thread
+# pool because LittleCMS runs without the GIL.
+
+INTENTS = {
+    'perceptual': ImageCms.Intent.PERCEPTUAL,
+    'relative_colorimetric': ImageCms.Intent.RELATIVE_COLORIMETRIC,
+    'saturation': ImageCms.Intent.SATURATION,
+    'absolute_colorimetric': ImageCms.Intent.ABSOLUTE_COLORIMETRIC,
+}
+
+# Approximate maximum chroma of a coated CMYK press (SWOP-like) by Lab hue,
+# every 30 degrees; only used when no press profile is configured
+APPROX_CMYK_MAX_CHROMA = np.array([72, 76, 78, 94, 86, 72, 66, 58, 50, 48, 56, 66, 72], dtype=np.float32)
+
+_profiles = {}
+_transforms = {}
+_lock = threading.Lock()
+_executor = None
+
+def _cached(cache, key, build):
+    with _lock:
+        if key in cache:
+            return cache[key]
+    value = build()
+    with _lock:
+        return cache.setdefault(key, value)
+
+def embedded_profile(image):
+    # Returns (key, profile, description) for the image's ICC profile, parsed
+    # once per distinct profile. Images without one are treated as sRGB;
+    # unreadable profiles come back with profile=None and the error text.
+    icc = image.info.get('icc_profile')
+    if not icc:
+        return 'builtin:sRGB', builtin_profile('sRGB'), None
+    key = hashlib.sha1(icc).hexdigest()
+
+    def parse():
+        try:
+            profile = ImageCms.ImageCmsProfile(BytesIO(icc))
+            return key, profile, profile.profile.profile_description
+        except Exception as e:
+            return key, None, f"Present but unreadable: {str(e)}"
+    return _cached(_profiles, key, parse)
+
+def builtin_profile(name):
+    return _cached(_profiles, f"builtin:{name}", lambda: ImageCms.ImageCmsProfile(ImageCms.createProfile(name)))
+
+def file_profile(path):
+    # Keyed by mtime too, so replacing the file on disk picks up the new one
+    key = f"file:{os.path.abspath(path)}:{os.path.getmtime(path)}"
+    return key, _cached(_profiles, key, lambda: ImageCms.ImageCmsProfile(path))
+
+def get_transform(source, target, in_mode, out_mode, intent='perceptual', proof=None, proof_intent='relative_colorimetric'):
+    # source/target/proof are (key, profile) pairs
+    key = (source[0], target[0], in_mode, out_mode, intent, proof[0] if proof else None, proof_intent)
+
+    def build():
+        logger.info(f"Building colour transform {key}")
+        if proof is None:
+            return ImageCms.buildTransform(source[1], target[1], in_mode, out_mode, INTENTS[intent])
+        return ImageCms.buildProofTransform(source[1], target[1], proof[1], in_mode, out_mode,
+                                            INTENTS[intent], INTENTS[proof_intent],
+                                            ImageCms.Flags.SOFTPROOFING)
+    return _cached(_transforms, key, build)
+
+def get_color_executor(workers):
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='color')
+    return _executor
+
+def apply_transform(image, transform, out_mode, tile_rows=256, workers=4):
+    # Row tiles converted in parallel and pasted into the output image
+    output = Image.new(out_mode, image.size)
+    bands = range(0, image.height, tile_rows)
+
+    def convert(y0):
+        return y0, transform.apply(image.crop((0, y0, image.width, min(y0 + tile_rows, image.height))))
+
+    for y0, band in get_color_executor(workers).map(convert, bands):
+        output.paste(band, (0, y0))
+    return output
+
+def prepare_source(image):
+    # Returns ((key, profile), image) in a mode LittleCMS accepts for that
+    # profile. Untagged or unreadable images are taken as sRGB.
+    key, profile, _ = embedded_profile(image)
+    if profile is None or key == 'builtin:sRGB':
+        return ('builtin:sRGB', builtin_profile('sRGB')), image if image.mode == 'RGB' else image.convert('RGB')
+    if image.mode in ('RGB', 'CMYK', 'L'):
+        return (key, profile), image
+    return (key, profile), image.convert('L' if image.mode == 'LA' else 'RGB')
+
+def convert_to_profile(image, target_profile_path, intent=None, config=None):
+    config = config or load_color_config()
+    source, image = prepare_source(image)
+    target = file_profile(target_profile_path)
+    out_mode = 'CMYK' if target[1].profile.xcolor_space.strip() == 'CMYK' else 'RGB'
+    transform = get_transform(source, target, image.mode, out_mode, intent or config['intent'])
+    return apply_transform(image, transform, out_mode, config['tile_rows'], config['workers'])
+
+def cmyk_soft_proof(image, config=None):
+    # Soft proof against the press profile on a reduced copy: returns the
+    # proofed RGB preview and the share of pixels the press can't reproduce
+    # (CIE76 delta E above gamut_delta_e after an sRGB -> CMYK -> Lab round
+    # trip). Without a press profile, falls back to a Lab chroma estimate.
+    config = config or load_color_config()
+    scale = min(1.0, config['proof_max_side'] / max(image.size))
+    if scale < 1.0:
+        image = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))), Image.BILINEAR)
+    # Transparent pixels are never printed, so they don't count against the gamut
+    opaque = None
+    if image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info):
+        opaque = np.asarray(image.convert('RGBA').getchannel('A')) > 0
+    source, image = prepare_source(image)
+    lab = ('builtin:LAB', builtin_profile('LAB'))
+    srgb = ('builtin:sRGB', builtin_profile('sRGB'))
+    tile_rows, workers = config['tile_rows'], config['workers']
+
+    expected = lab_array(apply_transform(image, get_transform(source, lab, image.mode, 'LAB'), 'LAB', tile_rows, workers))
+    path = config['cmyk_profile_path']
+    if path and os.path.exists(path):
+        press = file_profile(path)
+        cmyk = apply_transform(image, get_transform(source, press, image.mode, 'CMYK', config['intent']), 'CMYK', tile_rows, workers)
+        proofed = lab_array(apply_transform(cmyk, get_transform(press, lab, 'CMYK', 'LAB', 'relative_colorimetric'), 'LAB', tile_rows, workers))
+        delta_e = np.sqrt(((expected - proofed) ** 2).sum(axis=-1))
+        out_of_gamut = delta_e > config['gamut_delta_e']
+        preview = apply_transform(cmyk, get_transform(press, srgb, 'CMYK', 'RGB', 'relative_colorimetric'), 'RGB', tile_rows, workers)
+        approximate = False
+    else:
+        chroma = np.hypot(expected[..., 1], expected[..., 2])
+        hue = np.degrees(np.arctan2(expected[..., 2], expected[..., 1])) % 360
+        limit = np.interp(hue, np.arange(0, 361, 30), APPROX_CMYK_MAX_CHROMA)
+        out_of_gamut = chroma > limit + config['gamut_delta_e']
+        preview = image.convert('RGB')
+        approximate = True
+
+    if opaque is not None:
+        out_of_gamut = out_of_gamut[opaque]
+    percent = float(out_of_gamut.mean() * 100) if out_of_gamut.size else 0.0
+    return preview, percent, approximate
+
+def lab_array(image):
+    # PIL stores L scaled to 0-255 and a/b as signed bytes
+    raw = np.asarray(image)
+    lab = np.empty(raw.shape, dtype=np.float32)
+    lab[..., 0] = raw[..., 0] * (100 / 255)
+    lab[..., 1:] = raw[..., 1:].view(np.int8)
+    return lab
+
+def lab_colors(image):
+    # Lab values (N, 3) for every pixel, via the image's own profile
+    source, image = prepare_source(image)
+    lab = ('builtin:LAB', builtin_profile('LAB'))
+    return lab_array(get_transform(source, lab, image.mode, 'LAB').apply(image)).reshape(-1, 3)
+
+def srgb_from_lab(lab):
+    # Inverse of lab_array for a handful of colours: (N, 3) Lab -> (N, 3) sRGB bytes
+    lab = np.asarray(lab, dtype=np.float32).reshape(-1, 3)
+    raw = np.empty(lab.shape, dtype=np.uint8)
+    raw[:, 0] = np.clip(np.round(lab[:, 0] * (255 / 100)), 0, 255)
+    raw[:, 1:] = np.clip(np.round(lab[:, 1:]), -128, 127).astype(np.int8).view(np.uint8)
+    image = Image.frombytes('LAB', (len(raw), 1), raw.tobytes())
+    transform = get_transform(('builtin:LAB', builtin_profile('LAB')), ('builtin:sRGB', builtin_profile('sRGB')),
+                              'LAB', 'RGB', 'relative_colorimetric')
+    return np.asarray(transform.apply(image)).reshape(-1, 3)
@@ -1,8 +1,13 @@
+import os
+
 def load_processing_config():
     return {
         'image/jpeg': 'process_image',
         'image/png': 'process_image',
         'image/jpg': 'process_image',
+        'image/gif': 'process_image',
+        'image/webp': 'process_image',
+        'image/tiff': 'process_image',
         # Add more image types as needed
     }
 
@@ -12,5 +17,274 @@ def load_print_config():
         'desired_width_inch': 8.5,
         'desired_height_inch': 11,
         'bleed_inch': 0.125,
+        # Halftone preview: screen ruling and per-ink angles ('am'), or a
+        # stochastic screen ('fm'); screen printing on garments runs ~45-65 LPI
+        'halftone_mode': 'am',
+        'halftone_lpi': 55,
+        'halftone_angles': {'C': 15, 'M': 75, 'Y': 0, 'K': 45},
+        'halftone_band_rows': 512,
+        # Spot-colour count for screen-print quotes: k-means in Lab on a
+        # fixed-size stratified sample, so the cost doesn't grow with the image
+        'ink_sample_size': 16384,
+        'ink_max_colours': 12,
+        'ink_merge_delta_e': 12.0,  # Clusters closer than this are one ink
+        'ink_min_coverage': 0.5,  # Percent; smaller clusters are edge blends
+        'ink_tone_delta_e': 15.0,  # Pixels this far from every ink are off-palette
+        'ink_photo_percent': 20.0,  # Off-palette share that means continuous tone
+        # Thresholds assess_metrics applies to the stored metrics; changing
+        # them only needs a re-assessment, not a re-analysis
+        'sharpness_threshold': 100.0,  # Laplacian variance below this looks blurry
+        'dark_percent_limit': 5.0,  # Percent of very dark pixels
+        'bright_percent_limit': 5.0,  # Percent of very bright pixels
+        'artifact_level_limit': 0.1,  # Mean of blockiness, detail loss and ringing
+        'aspect_tolerance': 0.01,
+        'halftone_min_levels': 17,  # Fewer tone levels per ink than this may band
+    }
+
+def load_adjust_config():
+    return {
+        # Print-master resampling to the exact bleed-box size at print_dpi
+        'band_rows': 256,
+        'workers': os.cpu_count() or 1,
+        'sharpen_factor': 1.5,  # Same scale as ImageEnhance.Sharpness
+        'brighten_factor': 1.2,
+        'darken_factor': 0.8,
+    }
+
+def load_mockup_config():
+    return {
+        'tshirt_path': "/Users/ryan/Desktop/ezproof/mockupgen/materials/redtshirt.jpg",
+        'default_position': 'MIDDLE',  # DesignPosition name
+        'default_size_ratio': 0.5,
+        # "bigger"/"smaller" scale by size_step; "a bit" by its square root,
+        # "much" by its square
+        'size_step': 1.25,
+        'min_size_ratio': 0.15,
+        'max_size_ratio': 1.0,
+    }
+
+def load_color_config():
+    return {
+        # Press profile for soft-proofing; without it the gamut check falls
+        # back to an approximate coated-CMYK chroma limit
+        'cmyk_profile_path': os.environ.get('CMYK_PROFILE_PATH', os.path.join('profiles', 'press_cmyk.icc')),
+        'intent': 'perceptual',
+        'proof_max_side': 1024,  # Soft proof and gamut check run on a reduced copy
+        'gamut_delta_e': 5.0,
+        'gamut_warning_percent': 2.0,  # Warn when more of the design than this is out of gamut
+        'tile_rows': 256,
+        'workers': os.cpu_count() or 1,
+    }
+
+def load_encoding_config():
+    return {
+        'profiles': {
+            # Print masters: lossless, but favour encode speed over file size
+            'master': {'format': 'PNG', 'extension': 'png', 'params': {'compress_level': 1}},
+            # Email previews: small lossy files, WebP keeps the cutout's alpha
+            'preview': {'format': 'WEBP', 'extension': 'webp', 'params': {'quality': 80, 'method': 2}, 'max_side': 1600},
+            'preview_jpeg': {'format': 'JPEG', 'extension': 'jpg', 'params': {'quality': 85}, 'max_side': 1600},
+        },
+        'reply_profiles': {
+            'cutout': 'preview',
+            'mockup': 'preview_jpeg',
+        },
+        'workers': 2,
+    }
+
+def load_output_config():
+    return {
+        # Write stage outputs to disk in the background; replies never wait on it
+        'persist_outputs': True,
+        # Attach a print-ready PDF proof sheet alongside the preview images
+        'attach_pdf_proof': True,
+        'attach_svg': True,
+        # Send the print checks right away and the cutouts/mockup as a
+        # threaded follow-up, instead of one reply after everything finishes
+        'staged_replies': True,
+    }
+
+def artifact_root():
+    # Everything the service writes (artifacts, pHash index, leases) lives
+    # under one directory; the load test points it at a scratch one
+    return os.environ.get('ARTIFACT_STORE_ROOT', 'artifact_store')
+
+def load_store_config():
+    return {
+        'root': artifact_root(),
+        'max_bytes': 5 * 1024 * 1024 * 1024,  # 5 GB across all jobs
+        'max_age_seconds': 7 * 24 * 60 * 60,  # Drop job outputs after a week
+        'gc_interval_seconds': 10 * 60,
+    }
+
+def load_inference_config():
+    return {
+        'backend': 'onnx',  # 'torch' runs backgroundremover's models as-is
+        'onnx_model_dir': os.path.expanduser(os.path.join('~', '.u2net', 'onnx')),
+        'quantize': True,  # int8 dynamic quantization of the exported models
+        # Memory-map read-only weights so every worker process shares one copy
+        'mmap_weights': True,
+        'weights_dir': os.path.expanduser(os.path.join('~', '.u2net', 'mmap')),
+        # Per-worker thread budget; keep intra * workers <= physical cores
+        'intra_op_threads': 2,
+        'inter_op_threads': 1,
+        'input_size': 320,
+        # Micro-batching across requests: a batch closes after this many images
+        # or once its oldest image has waited batch_window_ms
+        'batching': True,
+        'batch_max_size': 8,
+        'batch_window_ms': 50,
+        # Maximum mean absolute mask difference (0-255) accepted by the parity check
+        'parity_max_mean_diff': 4.0,
     }
 
+def load_segmentation_config():
+    return {
+        # Segment a reduced proxy of large uploads and upsample the mask with
+        # an edge-aware guided filter; smaller images go through at full size
+        'proxy_mode': True,
+        'proxy_min_pixels': 4_000_000,
+        'proxy_max_side': 1024,
+        'guided_radius': 2,  # In proxy pixels
+        'guided_eps': 1e-4,
+        'band_rows': 512,  # Full-resolution rows produced per step
+        # Alpha matting: only the unknown band between eroded foreground and
+        # background is solved, tile by tile
+        'matting_foreground_threshold': 230,
+        'matting_background_threshold': 20,
+        'matting_erode_size': 10,
+        'matting_tile_size': 256,
+        'matting_radius': 8,
+        'matting_eps': 1e-3,
+        'matting_workers': os.cpu_count() or 1,
+        # Route each upload to one model from cheap thumbnail features; below
+        # route_confidence a fallback model runs too and the cleaner mask wins
+        'routing': True,
+        'route_confidence': 0.65,
+        'route_thumbnail_side': 384,
+        'route_flat_tolerance': 12,  # Max channel difference from the border median
+        'route_flat_share': 0.85,  # Share of the border that must match for a flat background
+        'route_max_graphic_colours': 8,
+        'route_min_face_fraction': 0.003,  # Face area / image area
+        'route_clutter_edges': 0.12,  # Canny edge share above which a photo counts as cluttered
+    }
+
+def load_gmail_quota_config():
+    return {
+        # Gmail allows 250 quota units per user per second (moving average).
+        # The sustained rate stays under that, but a full bucket can spend
+        # rate + burst (300) in its first second; the 429s that overshoot
+        # draws are retried, and a throttle empties the bucket
+        'units_per_second': 200,
+        'burst_units': 100,  # Must cover the most expensive call (send)
+        'method_costs': {
+            'messages.list': 5,
+            'messages.get': 5,
+            'messages.attachments.get': 5,
+            'messages.send': 100,
+            'messages.modify': 5,
+            'history.list': 2,
+            'threads.get': 10,
+            'getProfile': 1,
+        },
+        # Lower runs first, so finished work (send, modify) drains before new intake
+        'method_priorities': {
+            'messages.send': 0,
+            'messages.modify': 0,
+            'messages.attachments.get': 1,
+            'messages.get': 2,
+            'threads.get': 2,
+            'messages.list': 3,
+            'history.list': 3,
+        },
+        'initial_concurrency': 4,
+        'min_concurrency': 1,
+        'max_concurrency': 16,
+        'max_retries': 6,
+        'backoff_base_seconds': 1.0,
+        'backoff_max_seconds': 32.0,
+    }
+
+def load_job_scheduler_config():
+    return {
+        # Heavy per-attachment work (analysis, segmentation, mockups) running at once
+        'max_concurrent_jobs': 2,
+        # Relative share per sender address; everyone else gets default_weight
+        'sender_weights': {},
+        'default_weight': 1.0,
+        # Job cost model, estimated from headers before any pixels are decoded
+        'base_cost': 0.5,
+        'megapixel_cost': 1.0,
+        'megabyte_cost': 0.25,
+        'latency_window': 500,  # Recent jobs kept for time-to-proof percentiles
+    }
+
+def load_phash_config():
+    return {
+        # Reuse masks and analysis for designs within max_distance bits (of 64)
+        # of one we've already processed
+        'enabled': True,
+        'max_distance': 6,
+        'chunks': 4,  # Multi-index hashing: 4 x 16-bit lookup tables
+        'db_path': os.path.join(artifact_root(), 'phash.sqlite3'),
+    }
+
+def load_loadtest_config():
+    return {
+        # Offered load and how long to keep injecting it
+        'emails_per_hour': 1000,
+        'duration_seconds': 600,
+        'drain_timeout_seconds': 600,  # Wait for replies after injection stops
+        'poll_interval': 5,  # Seconds between inbox checks (production uses 60)
+        # Simulated Gmail behaviour
+        'latency_seconds': {'messages.send': 0.4, 'messages.attachments.get': 0.15, 'default': 0.08},
+        'error_rate': 0.01,
+        'units_per_second': 250,
+        'daily_units': None,
+        # Attachment mix: (weight, format, mode, (width, height)); a
+        # multi_attachment_rate share of emails carries two designs
+        'attachment_mix': [
+            (0.30, 'PNG', 'RGB', (1200, 1200)),
+            (0.20, 'PNG', 'RGBA', (1600, 1600)),
+            (0.20, 'PNG', 'RGB', (3000, 3600)),
+            (0.20, 'JPEG', 'RGB', (2400, 3000)),
+            (0.10, 'JPEG', 'RGB', (800, 600)),
+        ],
+        'multi_attachment_rate': 0.1,
+        # Share of emails that are placement replies in an answered thread
+        'reply_rate': 0.1,
+        'sample_interval': 1.0,  # Seconds between CPU/memory samples
+        'seed': 1,
+    }
+
+def load_pipeline_config():
+    return {
+        # Per-stage executor overrides ('io', 'thread' or 'process'), e.g.
+        # {'checks': 'thread'} where spawning worker processes is unwelcome
+        'stage_executors': {},
+        'process_workers': max(1, (os.cpu_count() or 2) // 2),
+    }
+
+def load_frames_config():
+    return {
+        # Animated and multi-page uploads get one proof per distinct frame
+        'multi_frame': True,
+        'max_frames': 24,
+        'frame_workers': 2,  # Frames decoded and in flight at once; bounds memory
+    }
+
+def load_cluster_config():
+    return {
+        # Monitor processes on one host (or sharing this volume) split the
+        # inbox by claiming messages in a shared SQLite lease table
+        'leases_enabled': True,
+        'lease_db_path': os.path.join(artifact_root(), 'leases.sqlite3'),
+        'lease_seconds': 120,  # A dead node's claims are taken over after this
+        'heartbeat_seconds': 30,
+        'claim_batch': 8,  # Messages claimed per poll; the rest are left for other nodes
+        'done_retention_seconds': 14 * 24 * 3600,
+        # Every node watches every account; claims are kept per account
+        'accounts': [
+            {'name': 'default', 'credentials_path': 'credentials.json', 'token_path': 'token.json'},
+        ],
+    }
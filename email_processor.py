@@ -2,122 +2,592 @@ import asyncio
 import random
 import logging
 import os
+import time
+from dataclasses import replace
+from functools import partial
 from gmail_service import get_attachment_type, get_attachment_data, send_reply_email, mark_email_as_read
-from autoediting.backremove import remove_background_from_data
-from config import load_processing_config, load_print_config
-from anal import run_checks, print_image_info
+from autoediting.backremove import MODEL_CHOICES, prepare_segmentation, segment_model
+from autoediting.router import choose_models, pick_best_result
+from autoediting.tosvg import convert_to_svg_from_data
+from config import load_processing_config, load_print_config, load_encoding_config, load_output_config, load_phash_config, load_mockup_config, load_segmentation_config, load_frames_config
+from encoding import encode_image, report_encoding
+from artifacts import Artifact, StoreSink
+from anal import check_print_readiness, estimate_ink_colours, assess_metrics, metrics_to_dict, print_image_info
+from phash_index import perceptual_hash, get_index, reuse_cutouts
+from job_scheduler import get_job_scheduler, estimate_cost
 from mockupgen.mockgen import create_tshirt_mockup, DesignPosition
+from pdfgen import build_proof_pdf
+from metrics import get_metrics
+from proof_threads import parse_placement_intent, load_thread_state, save_thread_state, rerender_mockup
+from pipeline import StageGraph
+from frames import frame_count, iter_frames
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-async def process_email(service, email_data):
-    sender, subject, message_id, content, attachments = email_data
+async def process_email(service, email_data, on_reply_sent=None):
+    # on_reply_sent is awaited after every reply that goes out, so the caller
+    # can make sure a message that has been answered is never retried
+    sender, subject, message_id, content, attachments, thread_id, rfc_message_id = email_data
     config = load_processing_config()
-    
+
+    # A reply in a thread we've already proofed only needs a new mockup
+    if not attachments:
+        state = await asyncio.to_thread(load_thread_state, thread_id)
+        if state is not None:
+            await process_placement_reply(service, email_data, state, on_reply_sent)
+            return
+
     logger.info(f"Processing email with subject: {subject}")
     logger.info(f"Number of attachments: {len(attachments)}")
+    start = time.monotonic()
+    output_config = load_output_config()
     
-    processing_results = []
+    # Attachments are queued together so the fair scheduler can order them
+    # against everyone else's work. Each one resolves its analysis_ready
+    # future as soon as its checks are done, before the heavy models run.
+    loop = asyncio.get_running_loop()
+    tasks, analyses = [], []
     for attachment in attachments:
         attachment_type = get_attachment_type(attachment)
         logger.info(f"Attachment type: {attachment_type}")
         if attachment_type in config:
-            result = await process_attachment(service, attachment, content, message_id, config[attachment_type])
-            processing_results.append(result)
+            analysis_ready = loop.create_future()
+            analyses.append(analysis_ready)
+            tasks.append(asyncio.create_task(process_attachment(
+                service, attachment, content, message_id, config[attachment_type], sender, analysis_ready)))
         else:
             logger.warning(f"No processor found for attachment type: {attachment_type}")
+
+    # Staged replies: the print checks go out within seconds, and the
+    # cutouts, mockup and SVG follow in the same thread once they're ready
+    staged = output_config['staged_replies'] and bool(tasks)
+    if staged:
+        try:
+            acknowledgement = generate_acknowledgement(content, list(await asyncio.gather(*analyses)))
+            await send_reply_email(service, sender, subject, acknowledgement, thread_id, [], rfc_message_id)
+        except BaseException:
+            # The message is released and retried from scratch, so stop the
+            # attachment work instead of leaving it running unowned
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        if on_reply_sent is not None:
+            await on_reply_sent()
+        get_metrics().observe('reply.acknowledgement.time_to_send', time.monotonic() - start)
+
+    processing_results = []
+    for result in await asyncio.gather(*tasks):
+        processing_results.extend(result if isinstance(result, list) else [result])
     
-    reply_content, attachments_data = generate_reply(content, processing_results)
+    # Composing the mockup, encoding previews and building the PDF all block;
+    # keep them off the loop so other emails and lease heartbeats carry on
+    reply_content, attachments_data = await asyncio.to_thread(
+        generate_reply, content, processing_results, include_analysis=not staged)
+
+    proof_result, cutout = find_proof_result(processing_results)
+    if cutout is not None and output_config['attach_svg']:
+        # Traced by the pipeline alongside the other models when it could be
+        svg = proof_result.get('svg') or await asyncio.to_thread(cutout_svg, cutout, message_id)
+        if svg is not None:
+            attachments_data.append(svg)
+            reply_content += "\nA vector (SVG) trace of the cutout is attached as well."
     
-    await send_reply_email(service, sender, subject, reply_content, message_id, attachments_data)
+    await send_reply_email(service, sender, subject, reply_content, thread_id, attachments_data, rfc_message_id)
+    if on_reply_sent is not None:
+        await on_reply_sent()
+    get_metrics().observe('reply.artifacts.time_to_send' if staged else 'reply.time_to_send', time.monotonic() - start)
+    await mark_email_as_read(service, message_id)
+
+    # Disk persistence ran in the background; surface any write failures now
+    for result in processing_results:
+        if result is not None and result.get('sink') is not None:
+            await asyncio.to_thread(result['sink'].flush)
+
+    # Remember the cutout and placement so follow-up replies can re-render
+    if cutout is not None:
+        mockup_config = load_mockup_config()
+        await asyncio.to_thread(save_thread_state, thread_id, cutout.data, {
+            'job_id': message_id,
+            'filename': cutout.filename,
+            'tshirt_path': mockup_config['tshirt_path'],
+            'position': mockup_config['default_position'],
+            'size_ratio': mockup_config['default_size_ratio'],
+        })
+
+async def process_placement_reply(service, email_data, state, on_reply_sent=None):
+    sender, subject, message_id, content, attachments, thread_id, rfc_message_id = email_data
+    intent = parse_placement_intent(content, state['size_ratio'])
+    attachments_data = []
+    if intent is None:
+        reply = ("Thanks for your reply. To adjust the mockup, tell us where to place the design "
+                 "(middle, top left or top right) or whether to make it bigger or smaller.")
+    else:
+        rendered = await asyncio.to_thread(rerender_mockup, thread_id, state, intent)
+        if rendered is None:
+            reply = ("Thanks for your reply. Your original proof has expired from our system; "
+                     "please send the artwork again and we'll prepare a new proof.")
+        else:
+            mockup, state = rendered
+            profile = load_encoding_config()['reply_profiles']['mockup']
+            preview = await asyncio.to_thread(encode_image, mockup, profile)
+            mockup_basename = os.path.splitext(state['filename'])[0]
+            attachments_data.append({
+                'filename': f"mockup_{mockup_basename}.{preview['extension']}",
+                'data': preview['data']
+            })
+            placement = state['position'].replace('_', ' ').lower()
+            reply = (f"Here's your updated mockup: design placed {placement} at "
+                     f"{state['size_ratio'] * 100:.0f}% of the print area.")
+    reply += "\nIf you have any questions or need further assistance with printing, please don't hesitate to ask."
+
+    await send_reply_email(service, sender, subject, reply, thread_id, attachments_data, rfc_message_id)
+    if on_reply_sent is not None:
+        await on_reply_sent()
     await mark_email_as_read(service, message_id)
 
-async def process_attachment(service, attachment, email_content, message_id, processor_name):
+async def process_attachment(service, attachment, email_content, message_id, processor_name, sender, analysis_ready=None):
     logger.info(f"Processing attachment with processor: {processor_name}")
-    if processor_name == 'process_image':
-        return await process_image(service, attachment, email_content, message_id)
-    # Add more processors here if needed in the future
-    logger.warning(f"Unknown processor: {processor_name}")
-    return None
+    try:
+        if processor_name == 'process_image':
+            return await process_image(service, attachment, email_content, message_id, sender, analysis_ready)
+        # Add more processors here if needed in the future
+        logger.warning(f"Unknown processor: {processor_name}")
+        return None
+    finally:
+        # A staged reply waits on every attachment's analysis; never leave it hanging
+        if analysis_ready is not None and not analysis_ready.done():
+            analysis_ready.set_result(None)
 
-async def process_image(service, attachment, email_content, message_id):
+PROOF_MODEL = 'u2netp'
+
+async def process_image(service, attachment, email_content, message_id, sender, analysis_ready=None):
     logger.info(f"Processing image: {attachment['filename']}")
     image_data = await get_attachment_data(service, 'me', message_id, attachment['id'])
-    if image_data:
-        base_filename = f"email_{message_id}_{attachment['filename']}"
-        try:
-            # Load print configuration
-            print_config = load_print_config()
-
-            # Run image analysis
-            analysis_results, halftone_image = run_checks(
-                image_data,
-                print_config['print_dpi'],
-                print_config['desired_width_inch'],
-                print_config['desired_height_inch'],
-                print_config['bleed_inch']
-            )
-            
-            # Get detailed image info
-            image_info = {}
-            print_image_info(image_data, image_info)
+    if not image_data:
+        logger.error(f"Error processing image {attachment['filename']}: failed to get attachment data")
+        return failed_result(attachment)
+    # Animated and multi-page uploads come back as one result per distinct frame
+    if load_frames_config()['multi_frame'] and frame_count(image_data) > 1:
+        return await process_frames(attachment, image_data, message_id, sender, analysis_ready)
+    return await run_image_graph(attachment, message_id, sender, analysis_ready, inputs={'image_data': image_data})
 
-            # Process the image (background removal)
-            results = await asyncio.to_thread(remove_background_from_data, image_data, base_filename)
-            
-            if results:
-                processed_images = []
-                for result in results:
-                    for alpha_type in ['without_alpha', 'with_alpha']:
-                        processed_images.append({
-                            'model': result['model'],
-                            'alpha': alpha_type == 'with_alpha',
-                            'filename': result[alpha_type]['filename'],
-                            'path': result[alpha_type]['path']
-                        })
-                
-                logger.info(f"Successfully processed image: {attachment['filename']}")
-                return {
-                    'filename': attachment['filename'],
-                    'status': 'success',
-                    'processed_images': processed_images,
-                    'analysis': analysis_results,
-                    'image_info': image_info
-                }
-            else:
-                logger.warning(f"No results from background removal for: {attachment['filename']}")
-        except Exception as e:
-            logger.error(f"Error processing image {attachment['filename']}: {str(e)}")
+async def process_image_data(attachment, image_data, message_id, analyzed=None, sender=None):
+    # Like process_image, a multi-frame upload returns a list of per-frame results
+    if analyzed is None and load_frames_config()['multi_frame'] and frame_count(image_data) > 1:
+        return await process_frames(attachment, image_data, message_id, sender)
+    inputs = {'image_data': image_data}
+    if analyzed is not None and analyzed['status'] != 'failed':
+        inputs.update(analyzed=analyzed, phash={'phash': analyzed['phash'], 'match': analyzed['match']})
+    return await run_image_graph(attachment, message_id, sender, inputs=inputs)
+
+def lookup_phash(image_data):
+    # Near-duplicates of a design we've already proofed reuse its
+    # pixel-level analysis and masks
+    if not load_phash_config()['enabled']:
+        return {'phash': None, 'match': None}
+    phash = perceptual_hash(image_data)
+    return {'phash': phash, 'match': get_index().lookup(phash)}
+
+def image_info(image_data):
+    info = {}
+    print_image_info(image_data, info)
+    return info
+
+def compose_mockup(cutout, sink=None):
+    mockup_config = load_mockup_config()
+    mockup_basename = os.path.splitext(os.path.basename(cutout.filename))[0]
+    mockup = Artifact(
+        f"mockup_{mockup_basename}.png",
+        image=create_tshirt_mockup(cutout.image, mockup_config['tshirt_path'], None,
+                                   position=DesignPosition[mockup_config['default_position']],
+                                   size_ratio=mockup_config['default_size_ratio']),
+    )
+    if sink is not None:
+        sink.persist(mockup)
+    return mockup
+
+def build_image_graph(attachment, message_id, sender=None, analysis_ready=None, sink=None):
+    # process_image as a stage graph. Analysis and info need only the upload;
+    # the route stage picks the segmentation model(s) from a thumbnail, and
+    # the mockup and SVG are built from the best routed cutout.
+    print_config = load_print_config()
+    segmentation_config = load_segmentation_config()
+    scheduler = get_job_scheduler()
+    base_filename = f"email_{message_id}_{attachment['filename']}"
+    models = sorted(MODEL_CHOICES, key=lambda model: model != PROOF_MODEL)
+    graph = StageGraph(attachment['filename'])
+
+    graph.add('phash', lookup_phash, ('image_data',))
+    graph.add('previous_analysis', lambda lookup: lookup['match']['analysis'] if lookup['match'] else None,
+              ('phash',), 'io')
+    graph.add('checks', partial(check_print_readiness,
+                                print_dpi=print_config['print_dpi'],
+                                desired_width_inch=print_config['desired_width_inch'],
+                                desired_height_inch=print_config['desired_height_inch'],
+                                bleed_inch=print_config['bleed_inch']),
+              ('image_data', 'previous_analysis'), 'process')
+    graph.add('info', image_info, ('image_data',))
+
+    def analyzed(lookup, metrics, info):
+        result = {
+            'filename': attachment['filename'],
+            'status': 'analyzed',
+            'analysis': metrics,
+            'assessment': assess(metrics),
+            'image_info': info,
+            'phash': lookup['phash'],
+            'match': lookup['match']
+        }
+        # The staged reply's print checks go out as soon as this resolves
+        if analysis_ready is not None and not analysis_ready.done():
+            analysis_ready.set_result(result)
+        return result
+    graph.add('analyzed', analyzed, ('phash', 'checks', 'info'), 'io')
+
+    def reused(image_data, lookup):
+        if not lookup['match']:
+            return None
+        results = reuse_cutouts(lookup['match'], image_data, base_filename, sink)
+        if not results:
+            return None
+        logger.info(f"Reusing results from job {lookup['match']['job_id']} (distance {lookup['match']['distance']}) "
+                    f"for {attachment['filename']}")
+        return {result['model']: result for result in results}
+    graph.add('reused', reused, ('image_data', 'phash'))
+    graph.add('segment_source', lambda image_data, reused: None if reused else prepare_segmentation(image_data, segmentation_config),
+              ('image_data', 'reused'))
+
+    def route(image_data, reused):
+        # Only the routed models run; the rest resolve to None at once
+        if reused:
+            return {'models': [model for model in models if model in reused], 'reason': 'reused'}
+        if not segmentation_config['routing']:
+            return {'models': models, 'reason': 'routing disabled'}
+        routed, details = choose_models(image_data, segmentation_config, models)
+        return {'models': routed, **details}
+    graph.add('route', route, ('image_data', 'reused'))
+
+    def segment_stage(model):
+        async def segment(image_data, reused, source, route):
+            if model not in route['models']:
+                return None
+            if reused:
+                return reused.get(model)
+            # Each model holds a job slot only while it runs, so cheap jobs
+            # from other senders can slot in between one upload's models
+            cost = estimate_cost(image_data, scheduler.config) / len(route['models'])
+            async with scheduler.slot(sender or '', cost):
+                try:
+                    result = await asyncio.to_thread(segment_model, source, model, base_filename, segmentation_config, sink)
+                except Exception as e:
+                    logger.error(f"Error processing model {model} for {attachment['filename']}: {str(e)}")
+                    return None  # The other models still count
+            logger.info(f"Background removed using {model} with and without alpha matting.")
+            return result
+        return segment
+    for model in models:
+        graph.add(f"segment:{model}", segment_stage(model), ('image_data', 'reused', 'segment_source', 'route'), 'io')
+
+    def proof(route, *results):
+        # The cutout the mockup, SVG and ink estimate are built from
+        results = {result['model']: result for result in results if result}
+        return pick_best_result([results[model] for model in route['models'] if model in results])
+    if segmentation_config['routing']:
+        graph.add('proof', proof, ('route', *[f"segment:{model}" for model in models]))
     else:
-        logger.error(f"Failed to get attachment data for: {attachment['filename']}")
+        # Every model runs, but the mockup only needs the proof model's
+        # cutout; the others feed just the index and the persisted outputs
+        graph.add('proof', lambda result: result, (f"segment:{PROOF_MODEL}",), 'io')
+    graph.add('mockup', lambda result: compose_mockup(result['with_alpha'], sink) if result else None, ('proof',))
+    graph.add('svg', lambda result: cutout_svg(result['with_alpha'], message_id) if result else None, ('proof',))
+    # The upload's ink count includes its background; the cutout's alpha
+    # restricts it to what actually gets printed
+    graph.add('ink_colours', lambda result: {'inks': estimate_ink_colours(result['with_alpha'].image),
+                                             'basis': f"{result['model']} cutout"} if result else None, ('proof',))
+
+    def indexed(lookup, analyzed, reused, *results):
+        results = [result for result in results if result]
+        if reused or lookup['phash'] is None or sink is None or not results:
+            return False
+        get_index().add(lookup['phash'], message_id, [
+            {'model': result['model'],
+             'without_alpha': result['without_alpha'].filename,
+             'with_alpha': result['with_alpha'].filename}
+            for result in results
+        ], metrics_to_dict(analyzed['analysis']))
+        return True
+    graph.add('indexed', indexed, ('phash', 'analyzed', 'reused', *[f"segment:{model}" for model in models]))
+    return graph, models
+
+async def run_image_graph(attachment, message_id, sender=None, analysis_ready=None, inputs=None):
+    # Outputs stay in memory and are optionally written to the artifact store
+    # in the background. Only what the reply consumes is requested, so the
+    # SVG trace and index update are skipped when nothing needs them.
+    output_config = load_output_config()
+    sink = StoreSink(message_id) if output_config['persist_outputs'] else None
+    graph, models = build_image_graph(attachment, message_id, sender, analysis_ready, sink)
+
+    segments = [f"segment:{model}" for model in models]
+    wanted = ['analyzed', 'proof', 'mockup', 'ink_colours', *segments]
+    if output_config['attach_svg']:
+        wanted.append('svg')
+    if sink is not None:
+        wanted.append('indexed')
+    outputs = await graph.run(wanted, inputs)
+
+    try:
+        if 'analyzed' not in outputs:
+            raise ValueError(f"image analysis failed ({graph.errors.get('analyzed')})")
+        results = [outputs[segment] for segment in segments if outputs.get(segment)]
+        analysis, assessment = outputs['analyzed']['analysis'], outputs['analyzed']['assessment']
+        if outputs.get('ink_colours'):
+            cutout_inks = outputs['ink_colours']
+            analysis = replace(analysis, inks=cutout_inks['inks'], ink_basis=cutout_inks['basis'])
+            assessment = assess(analysis)
+        if results:
+            processed_images = []
+            for result in results:
+                for alpha_type in ['without_alpha', 'with_alpha']:
+                    processed_images.append({
+                        'model': result['model'],
+                        'alpha': alpha_type == 'with_alpha',
+                        'filename': result[alpha_type].filename,
+                        'artifact': result[alpha_type]
+                    })
+            
+            logger.info(f"Successfully processed image: {attachment['filename']}")
+            return {
+                'filename': attachment['filename'],
+                'status': 'success',
+                'processed_images': processed_images,
+                'analysis': analysis,
+                'assessment': assessment,
+                'image_info': outputs['analyzed']['image_info'],
+                'proof_model': outputs['proof']['model'] if outputs.get('proof') else PROOF_MODEL,
+                'mockup': outputs.get('mockup'),
+                'svg': outputs.get('svg'),
+                'source_data': graph.outputs['image_data'],
+                'sink': sink
+            }
+        else:
+            logger.warning(f"No results from background removal for: {attachment['filename']}")
+    except Exception as e:
+        logger.error(f"Error processing image {attachment['filename']}: {str(e)}")
     
+    return failed_result(attachment)
+
+def failed_result(attachment):
     return {
         'filename': attachment['filename'],
         'status': 'failed',
         'processed_images': None,
         'analysis': None,
+        'assessment': None,
         'image_info': None
     }
 
-def generate_reply(original_content, processing_results):
+def assess(metrics):
+    print_config = load_print_config()
+    return assess_metrics(metrics, print_config['print_dpi'], print_config['desired_width_inch'],
+                          print_config['desired_height_inch'], print_config['bleed_inch'], print_config)
+
+async def process_frames(attachment, image_data, message_id, sender=None, analysis_ready=None):
+    # Frames are pulled from the decoder only as workers free up, so at most
+    # frame_workers decoded frames exist at a time; each frame then runs the
+    # normal image graph, whose models share the job scheduler with
+    # everyone else's work. The first frame answers the staged acknowledgement.
+    config = load_frames_config()
+    frames = iter_frames(image_data, config)
+    stem = os.path.splitext(attachment['filename'])[0]
+    workers = asyncio.Semaphore(config['frame_workers'])
+    tasks = []
+
+    async def process_frame(frame, ready):
+        try:
+            frame_attachment = {**attachment, 'filename': f"{stem}_frame{frame['index'] + 1:03d}.{frame['extension']}"}
+            result = await run_image_graph(frame_attachment, message_id, sender, ready,
+                                           inputs={'image_data': frame.pop('data')})
+            await asyncio.to_thread(release_result_images, result)
+            result['frame'] = frame
+            return result
+        finally:
+            workers.release()
+
+    while True:
+        await workers.acquire()
+        try:
+            frame = await asyncio.to_thread(next, frames, None)
+        except Exception as e:
+            workers.release()
+            logger.error(f"Error decoding frames of {attachment['filename']}: {str(e)}")
+            break
+        if frame is None:
+            workers.release()
+            break
+        tasks.append(asyncio.create_task(process_frame(frame, analysis_ready if not tasks else None)))
+
+    results = list(await asyncio.gather(*tasks))
+    logger.info(f"Processed {len(results)} distinct frame(s) of {attachment['filename']}")
+    return results or [failed_result(attachment)]
+
+def release_result_images(result):
+    # Encoded bytes stay (or are on disk already); the decoded rasters are
+    # rebuilt only when the reply or PDF asks for them
+    if result['status'] != 'success':
+        return
+    artifacts = [img['artifact'] for img in result['processed_images']]
+    if result.get('mockup') is not None:
+        artifacts.append(result['mockup'])
+    for artifact in artifacts:
+        artifact.encoded(artifact.profile)
+        artifact.release_image()
+
+def cutout_svg(cutout, job_id):
+    # Traced from the in-memory cutout; every mode is kept in the store and
+    # the first one is attached
+    svgs = convert_to_svg_from_data(cutout.data, os.path.splitext(cutout.filename)[0], job_id)
+    if not svgs:
+        return None
+    with open(svgs[0]['path'], 'rb') as f:
+        return {'filename': svgs[0]['filename'], 'data': f.read()}
+
+COLOR_DEPTHS = {
+    'RGB': "Color depth: 24-bit (8 bits per channel), adequate for high-quality printing.",
+    'RGBA': "Color depth: 32-bit (8 bits per channel with alpha), adequate for high-quality printing.",
+    'L': "Color depth: 8-bit grayscale, may be adequate depending on print requirements.",
+    'CMYK': "Color depth: 32-bit CMYK, suitable for professional printing.",
+}
+
+def describe_analysis(metrics, assessment):
+    # The only place metrics and verdicts become text: {check: message}
+    m, v = metrics, assessment
+    text = {
+        'resolution': f"Image resolution: {m.width}x{m.height} pixels",
+        'color_depth': COLOR_DEPTHS.get(m.mode, f"Color depth: {m.mode}, may not be optimal for high-quality printing."),
+        'file_size': f"File size: {m.file_size / (1024 * 1024):.2f} MB",
+    }
+    required = v['bleed_and_margins']['required']
+    text['bleed_and_margins'] = ("Image dimensions are sufficient for bleed." if v['bleed_and_margins']['ok'] else
+                                 f"Image is too small. Required: {required[0]}x{required[1]}px, Actual: {m.width}x{m.height}px")
+    text['color_profile'] = f"Color mode: {m.mode}, ICC Profile: {m.icc_profile}"
+
+    if 'sharpness' in v:
+        text['sharpness'] = (f"Image sharpness is adequate for printing (sharpness: {m.sharpness:.2f})." if v['sharpness']['ok'] else
+                             f"Image appears blurry (sharpness: {m.sharpness:.2f}). Consider sharpening or using a different image.")
+
+    ratios = f"Image: {v['aspect_ratio']['image']:.2f}, Desired: {v['aspect_ratio']['desired']:.2f}"
+    text['aspect_ratio'] = (f"Aspect ratio matches the print dimensions. {ratios}" if v['aspect_ratio']['ok'] else
+                            f"Aspect ratio mismatch. {ratios}. Cropping or distortion may occur.")
+
+    if 'compression_artifacts' in v:
+        details = (f"(level: {v['compression_artifacts']['level']:.2f}). Blockiness: {m.blockiness:.2f}, "
+                   f"Detail loss: {m.detail_loss:.2f}, Ringing: {m.ringing:.2f}.")
+        text['compression_artifacts'] = (f"No significant compression artifacts detected {details} The image should print well on physical media."
+                                         if v['compression_artifacts']['ok'] else
+                                         f"Significant compression artifacts detected {details} This may affect print quality on physical media.")
+
+    if 'exposure' in v:
+        exposure = v['exposure']
+        if exposure['underexposed']:
+            text['exposure'] = f"Image may be underexposed. {m.dark_percent:.2f}% of pixels are very dark (threshold: {exposure['dark_limit']:g}%)."
+        elif exposure['overexposed']:
+            text['exposure'] = f"Image may be overexposed. {m.bright_percent:.2f}% of pixels are very bright (threshold: {exposure['bright_limit']:g}%)."
+        else:
+            text['exposure'] = f"Exposure is within acceptable limits. Dark pixels: {m.dark_percent:.2f}%, Bright pixels: {m.bright_percent:.2f}%."
+
+    if 'cmyk_gamut' in v:
+        basis = "estimated without a press profile" if m.gamut_approximate else "soft-proofed against the press profile"
+        text['cmyk_gamut'] = (f"Colours are within the CMYK print gamut ({m.gamut_percent:.1f}% out of gamut, {basis})."
+                              if v['cmyk_gamut']['ok'] else
+                              f"{m.gamut_percent:.1f}% of the design is outside the CMYK print gamut ({basis}). "
+                              f"Vivid colours there will print duller; consider adjusting them or approving the soft proof.")
+    elif 'cmyk_gamut' in m.errors:
+        text['cmyk_gamut'] = f"CMYK gamut check failed: {m.errors['cmyk_gamut']}"
+
+    if 'ink_colours' in v:
+        palette = ", ".join(f"{ink['hex']} ({ink['coverage']:.1f}%)" for ink in m.inks['palette'])
+        if not v['ink_colours']['ok']:
+            text['ink_colours'] = f"No opaque area to print ({m.ink_basis})."
+        elif v['ink_colours']['photographic']:
+            text['ink_colours'] = (f"Design looks continuous-tone ({m.inks['off_palette']:.0f}% of it is off any flat colour, "
+                                   f"{m.ink_basis}); quote as simulated process or CMYK. Dominant colours: {palette}.")
+        else:
+            text['ink_colours'] = f"Estimated {m.inks['count']} ink colour(s) for screen printing ({m.ink_basis}): {palette}."
+    elif 'ink_colours' in m.errors:
+        text['ink_colours'] = f"Ink colour estimate failed: {m.errors['ink_colours']}"
+
+    if m.halftone is not None:
+        halftone = m.halftone
+        if halftone['mode'] == 'fm':
+            description = f"FM (stochastic) screen at {halftone['print_dpi']} DPI"
+        else:
+            description = ", ".join(f"{ink} {lpi:.0f} LPI @ {angle:.1f}°" for ink, lpi, angle in halftone['screens'])
+            description += f" at {halftone['print_dpi']} DPI, about {halftone['levels']} tone levels per ink"
+            if not v['halftone']['ok']:
+                description += " (coarse: tonal steps may band; lower the LPI or raise the DPI)"
+        text['halftone'] = f"Halftone screening simulation: {description}, {halftone['width']}x{halftone['height']} px preview."
+    return text
+
+def generate_acknowledgement(original_content, analyses):
+    reply = "Thank you for your email. We've received your attachments and checked them for print:\n\n"
+    for result in analyses:
+        if result is None:
+            reply += "- An attachment could not be processed\n"
+            continue
+        reply += f"- {result['filename']}:\n"
+        if result['status'] == 'failed':
+            reply += "  The attachment could not be analyzed.\n"
+            continue
+        reply += "  Image Analysis:\n"
+        for check, analysis_result in describe_analysis(result['analysis'], result['assessment']).items():
+            reply += f"    {check.capitalize()}: {analysis_result}\n"
+        if result['image_info']:
+            reply += "  Image Information:\n"
+            for key, value in result['image_info'].items():
+                reply += f"    {key}: {value}\n"
+    reply += "\nYour cutouts and t-shirt mockup are being prepared and will follow in this thread shortly."
+    return reply
+
+def is_proof_image(result, img):
+    # The routed model's alpha-matted cutout is the one proofs and mockups are
+    # built from
+    return img['alpha'] and img['model'] == result.get('proof_model', PROOF_MODEL)
+
+def find_proof_result(processing_results):
+    # Returns (result, cutout) for the last attachment that has a proof cutout
+    found = (None, None)
+    for result in processing_results:
+        if result is not None and result['status'] == 'success' and result['processed_images']:
+            for img in result['processed_images']:
+                if is_proof_image(result, img):
+                    found = (result, img['artifact'])
+    return found
+
+def generate_reply(original_content, processing_results, include_analysis=True):
     reply = "Thank you for your email. We've processed and analyzed your attachments:\n\n"
     attachments_data = []
-    u2netp_alpha_image = None
+    proof_image = None
+    proof_mockup = None
+    proof_sink = None
 
     for result in processing_results:
         if result is not None:
             reply += f"- {result['filename']}:\n"
             reply += f"  Processing status: {result['status']}\n"
+            if result.get('frame') and result['frame']['duplicates']:
+                frames = ', '.join(str(index + 1) for index in result['frame']['duplicates'])
+                reply += f"  Identical frame(s) {frames} share this proof\n"
             
             if result['status'] == 'success':
-                if result['analysis']:
+                if result['analysis'] and include_analysis:
                     reply += "  Image Analysis:\n"
-                    for check, analysis_result in result['analysis'].items():
+                    for check, analysis_result in describe_analysis(result['analysis'], result['assessment']).items():
                         reply += f"    {check.capitalize()}: {analysis_result}\n"
                 
-                if result['image_info']:
+                if result['image_info'] and include_analysis:
                     reply += "  Image Information:\n"
                     for key, value in result['image_info'].items():
                         reply += f"    {key}: {value}\n"
@@ -126,8 +596,10 @@ def generate_reply(original_content, processing_results):
                     reply += "  Processed images:\n"
                     for img in result['processed_images']:
                         reply += f"    - {img['model']} ({'with' if img['alpha'] else 'without'} alpha matting)\n"
-                        if img['model'] == 'u2netp' and img['alpha']:
-                            u2netp_alpha_image = img
+                        if is_proof_image(result, img):
+                            proof_image = img
+                            proof_mockup = result.get('mockup')
+                            proof_sink = result.get('sink')
             else:
                 reply += "  The attachment could not be processed or analyzed.\n"
         else:
@@ -136,35 +608,67 @@ def generate_reply(original_content, processing_results):
     if not processing_results:
         reply += "No attachments were processed.\n"
     
-    if u2netp_alpha_image:
-        reply += "\nWe've attached the processed image using u2netp model with alpha matting for your reference."
-        with open(u2netp_alpha_image['path'], 'rb') as f:
-            image_data = f.read()
+    if proof_image:
+        reply += f"\nWe've attached the processed image using {proof_image['model']} model with alpha matting for your reference."
+        reply_profiles = load_encoding_config()['reply_profiles']
+        cutout = proof_image['artifact']
+
+        # Encode the cutout preview while the mockup is being composed
+        cutout_future = cutout.encoded_async(reply_profiles['cutout'])
+
+        # The pipeline composes the mockup as soon as the proof cutout is
+        # ready; otherwise build it straight from the in-memory cutout
+        mockup_basename = os.path.splitext(os.path.basename(cutout.filename))[0]
+        mockup = proof_mockup or compose_mockup(cutout, proof_sink)
+        mockup_future = mockup.encoded_async(reply_profiles['mockup'])
+
+        cutout_preview = cutout_future.result()
+        report_encoding(cutout.filename, cutout_preview, cutout.encoded_size())
         attachments_data.append({
-            'filename': u2netp_alpha_image['filename'],
-            'data': image_data
+            'filename': f"{os.path.splitext(cutout.filename)[0]}.{cutout_preview['extension']}",
+            'data': cutout_preview['data']
         })
 
-        # Create mockup
-        tshirt_path = "/Users/ryan/Desktop/ezproof/mockupgen/materials/redtshirt.jpg"
-        mockup = create_tshirt_mockup(u2netp_alpha_image['path'], tshirt_path, os.path.dirname(u2netp_alpha_image['path']))
-        
-        # Save mockup
-        mockup_filename = f"mockup_{os.path.basename(u2netp_alpha_image['filename'])}"
-        mockup_path = os.path.join(os.path.dirname(u2netp_alpha_image['path']), mockup_filename)
-        mockup.save(mockup_path)
-
-        # Add mockup to attachments
-        with open(mockup_path, 'rb') as f:
-            mockup_data = f.read()
+        mockup_preview = mockup_future.result()
+        report_encoding(mockup.filename, mockup_preview, mockup.encoded_size())
         attachments_data.append({
-            'filename': mockup_filename,
-            'data': mockup_data
+            'filename': f"mockup_{mockup_basename}.{mockup_preview['extension']}",
+            'data': mockup_preview['data']
         })
 
         reply += "\nWe've also included a mockup of your design on a t-shirt for visualization."
+
+        if load_output_config()['attach_pdf_proof']:
+            # JPEG mockup previews go into the PDF as-is, without re-encoding
+            mockups = {id(cutout): mockup_preview['data'] if mockup_preview['format'] == 'JPEG' else mockup.image}
+            designs = []
+            for result in processing_results:
+                if result is None or result['status'] != 'success':
+                    continue
+                design = next((img['artifact'] for img in result['processed_images']
+                               if is_proof_image(result, img)), None)
+                if design is not None:
+                    designs.append((result, design))
+
+            def proofs():
+                # Pages are written as they are generated, so only one
+                # design (e.g. one frame of an animation) is decoded at a time
+                for result, design in designs:
+                    yield {
+                        'filename': result['filename'],
+                        'design': design.image,
+                        'source_data': result.get('source_data'),
+                        'mockups': [mockups[id(design)]] if id(design) in mockups else [],
+                        'analysis': describe_analysis(result['analysis'], result['assessment']),
+                        'image_info': result['image_info'],
+                    }
+                    design.release_image()
+            proof_pdf = build_proof_pdf(proofs())
+            logger.info(f"Built PDF proof: {len(designs)} design(s), {len(proof_pdf) / 1024:.1f} KB")
+            attachments_data.append({'filename': f"proof_{mockup_basename}.pdf", 'data': proof_pdf})
+            reply += "\nA print-ready PDF proof with bleed, crop marks and the analysis summary is attached."
     else:
-        reply += "\nUnfortunately, we couldn't process any of the attachments successfully with the u2netp model and alpha matting."
+        reply += "\nUnfortunately, we couldn't process any of the attachments successfully with alpha matting."
 
     reply += "\nIf you have any questions or need further assistance with printing, please don't hesitate to ask."
 
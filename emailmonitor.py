@@ -1,28 +1,101 @@
 import asyncio
 import logging
+from functools import partial
 from email_processor import process_email
 from gmail_service import get_gmail_service, check_for_new_emails
+from job_scheduler import get_job_scheduler
+from autoediting.weights import memory_usage
+from proof_threads import has_thread_state
+from metrics import get_metrics
+from leases import open_lease_table
+from config import load_cluster_config
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-async def monitor_emails():
-    logging.info("Starting OAuth flow...")
-    service = await get_gmail_service()
-    logging.info("OAuth flow completed. Successfully logged in.")
-    logging.info("Starting email monitoring...")
+async def process_claimed(service, email_data, leases, account):
+    # Done is recorded once the message is finished, and replied as soon as
+    # any reply goes out. A failure before that hands the message straight
+    # back instead of waiting for the lease to expire; after it, retrying
+    # would send the customer a duplicate, so the message is left alone.
+    message_id = email_data[2]
+    sent = []
+
+    async def on_reply_sent():
+        if not sent:
+            await asyncio.to_thread(leases.replied, account, message_id)
+        sent.append(True)
+
+    try:
+        await process_email(service, email_data, on_reply_sent)
+    except BaseException:
+        if sent:
+            logging.error(f"Processing {message_id} failed after a reply was sent; not retrying it")
+        else:
+            await asyncio.to_thread(leases.release, account, message_id)
+        raise
+    await asyncio.to_thread(leases.complete, account, message_id)
+
+async def keep_leases(leases, config):
+    while True:
+        await asyncio.sleep(config['heartbeat_seconds'])
+        await asyncio.to_thread(leases.heartbeat)
+        await asyncio.to_thread(leases.prune, config['done_retention_seconds'])
+
+async def monitor_account(service, account, leases, poll_interval, claim_batch):
+    logging.info(f"Starting email monitoring for {account}...")
     
     while True:
-        new_emails = await check_for_new_emails(service)
+        claim = partial(leases.claim, account, limit=claim_batch) if leases is not None else None
+        new_emails = await check_for_new_emails(service, is_known_thread=has_thread_state, claim=claim)
         tasks = []
         for email_data in new_emails:
-            task = asyncio.create_task(process_email(service, email_data))
+            if leases is not None:
+                task = asyncio.create_task(process_claimed(service, email_data, leases, account))
+            else:
+                task = asyncio.create_task(process_email(service, email_data))
             tasks.append(task)
         
         if tasks:
-            await asyncio.gather(*tasks)
+            # A failed email stays unread (its lease released) and is picked
+            # up again on a later poll; it must not stop the monitor
+            for email_data, result in zip(new_emails, await asyncio.gather(*tasks, return_exceptions=True)):
+                if isinstance(result, Exception):
+                    logging.error(f"Failed to process email {email_data[2]}: {result}")
+            logging.info(f"Proof jobs: {get_job_scheduler().stats()}")
+            logging.info(f"Memory: {memory_usage()}")
+            logging.info(f"Reply latency: {get_metrics().summary()}")
+            if leases is not None:
+                logging.info(f"Leases: {await asyncio.to_thread(leases.stats)}")
         
-        await asyncio.sleep(60)  # Check every minute
+        # A full batch means more mail is waiting; otherwise check every minute by default
+        if leases is None or len(new_emails) < claim_batch:
+            await asyncio.sleep(poll_interval)
+
+async def monitor_emails(service=None, poll_interval=60, account='default'):
+    # service is injected by loadtest.py (a FakeGmail); otherwise log in to
+    # every configured account
+    config = load_cluster_config()
+    if service is not None:
+        services = [(account, service)]
+    else:
+        services = []
+        for account_config in config['accounts']:
+            logging.info(f"Starting OAuth flow for {account_config['name']}...")
+            services.append((account_config['name'], await get_gmail_service(
+                account_config['credentials_path'], account_config['token_path'])))
+            logging.info("OAuth flow completed. Successfully logged in.")
+
+    leases = await asyncio.to_thread(open_lease_table, config) if config['leases_enabled'] else None
+    monitors = [monitor_account(service, name, leases, poll_interval, config['claim_batch']) for name, service in services]
+    if leases is not None:
+        logging.info(f"Node {leases.node_id} joined; live nodes: {leases.live_nodes()}")
+        monitors.append(keep_leases(leases, config))
+    try:
+        await asyncio.gather(*monitors)
+    finally:
+        if leases is not None:
+            leases.close()
 
 if __name__ == "__main__":
     asyncio.run(monitor_emails())
@@ -0,0 +1,75 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from PIL import Image
+from config import load_encoding_config
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+def get_encode_executor():
+    # Shared pool so encoding overlaps with whichever stage runs next
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=load_encoding_config()['workers'], thread_name_prefix='encode')
+    return _executor
+
+def get_profile(profile_name):
+    profiles = load_encoding_config()['profiles']
+    if profile_name not in profiles:
+        raise ValueError(f"Unknown encoding profile: {profile_name}")
+    return profiles[profile_name]
+
+def prepare_for_profile(image, profile):
+    max_side = profile.get('max_side')
+    if max_side and max(image.size) > max_side:
+        image = image.copy()
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    if profile['format'] == 'JPEG' and image.mode != 'RGB':
+        if image.mode in ('RGBA', 'LA', 'P'):
+            # JPEG has no alpha channel, so flatten transparent cutouts onto white
+            rgba = image.convert('RGBA')
+            flattened = Image.new('RGB', image.size, (255, 255, 255))
+            flattened.paste(rgba, mask=rgba.split()[3])
+            image = flattened
+        else:
+            image = image.convert('RGB')
+    return image
+
+def encode_image(image, profile_name='master'):
+    profile = get_profile(profile_name)
+    start = time.perf_counter()
+
+    image = prepare_for_profile(image, profile)
+    buffered = BytesIO()
+    image.save(buffered, format=profile['format'], **profile['params'])
+    data = buffered.getvalue()
+
+    return {
+        'data': data,
+        'profile': profile_name,
+        'format': profile['format'],
+        'extension': profile['extension'],
+        'size': len(data),
+        'seconds': time.perf_counter() - start,
+    }
+
+def report_encoding(name, encoded, baseline_size=None):
+    report = {
+        'name': name,
+        'profile': encoded['profile'],
+        'size': encoded['size'],
+        'baseline_size': baseline_size,
+        'saved_percent': None,
+        'encode_ms': round(encoded['seconds'] * 1000, 1),
+    }
+    if baseline_size:
+        report['saved_percent'] = round((baseline_size - encoded['size']) / baseline_size * 100, 1)
+        logger.info(f"Encoded {name} with '{encoded['profile']}' profile: {encoded['size'] / 1024:.1f} KB "
+                    f"vs {baseline_size / 1024:.1f} KB ({report['saved_percent']}% saved) in {report['encode_ms']} ms")
+    else:
+        logger.info(f"Encoded {name} with '{encoded['profile']}' profile: {encoded['size'] / 1024:.1f} KB in {report['encode_ms']} ms")
+    return report
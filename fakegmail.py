@@ -0,0 +1,294 @@
+import base64
+import itertools
+import json
+import random
+import threading
+import time
+from collections import deque
+import httplib2
+from googleapiclient.errors import HttpError
+from config import load_gmail_quota_config
+
+# Local stand-in for the subset of the Gmail API that gmail_service.py uses.
+# It keeps messages in memory and enforces the per-user quota with a sliding
+# one-second window, answering 429 rateLimitExceeded like the real service,
+# so scheduling changes can be exercised without touching a real mailbox.
+# For load tests it can also add per-call latency, fail a share of calls
+# with 500/503 and cap total units like the daily quota (loadtest.py).
+
+def http_error(status, reason, message):
+    resp = httplib2.Response({'status': status})
+    resp.reason = reason
+    content = json.dumps({'error': {'code': status, 'message': message,
+                                    'errors': [{'reason': reason, 'message': message}]}}).encode('utf-8')
+    return HttpError(resp, content)
+
+class FakeRequest:
+    def __init__(self, gmail, method, handler):
+        self.gmail = gmail
+        self.method = method
+        self.handler = handler
+
+    def execute(self, http=None, num_retries=0):
+        self.gmail.charge(self.method)
+        # Called from the scheduler's worker threads, so sleeping here
+        # behaves like waiting on the network
+        self.gmail.wait(self.method)
+        self.gmail.maybe_fail(self.method)
+        return self.handler()
+
+class FakeGmail:
+    def __init__(self, units_per_second=None, method_costs=None, latency=0.0, error_rate=0.0,
+                 daily_units=None, seed=None, history_size=10000):
+        quota_config = load_gmail_quota_config()
+        # The real per-user limit, not the scheduler's more conservative budget
+        self.units_per_second = units_per_second or 250
+        self.method_costs = method_costs or quota_config['method_costs']
+        # Seconds per call, either one value or per method (with 'default');
+        # each call takes between half and one and a half times that
+        self.latency = latency
+        self.error_rate = error_rate
+        self.daily_units = daily_units
+        self.units_used = 0
+        self.messages = {}
+        self.attachments = {}
+        self.sent = []
+        # Arrival and mark-as-read times per message, for time-to-reply
+        self.received = {}
+        self.read_at = {}
+        self.calls = {}
+        self.rejected = {}
+        self.errors = {}
+        self.history = deque(maxlen=history_size)
+        self.history_id = 1000
+        self._window = deque()
+        self._ids = itertools.count(1)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def charge(self, method):
+        units = self.method_costs.get(method, 5)
+        with self._lock:
+            if self.daily_units is not None and self.units_used + units > self.daily_units:
+                self.rejected[method] = self.rejected.get(method, 0) + 1
+                raise http_error(403, 'dailyLimitExceeded', 'Daily Limit Exceeded')
+            now = time.monotonic()
+            while self._window and now - self._window[0][0] >= 1:
+                self._window.popleft()
+            used = sum(spent for _, spent in self._window)
+            if used + units > self.units_per_second:
+                self.rejected[method] = self.rejected.get(method, 0) + 1
+                raise http_error(429, 'rateLimitExceeded', 'User-rate limit exceeded')
+            self._window.append((now, units))
+            self.units_used += units
+            self.calls[method] = self.calls.get(method, 0) + 1
+
+    def wait(self, method):
+        latency = self.latency
+        if isinstance(latency, dict):
+            latency = latency.get(method, latency.get('default', 0.0))
+        if latency:
+            with self._lock:
+                factor = self._random.uniform(0.5, 1.5)
+            time.sleep(latency * factor)
+
+    def maybe_fail(self, method):
+        # Transient server errors, charged like real ones
+        with self._lock:
+            failed = self.error_rate and self._random.random() < self.error_rate
+            if failed:
+                self.errors[method] = self.errors.get(method, 0) + 1
+                status = self._random.choice((500, 503))
+        if failed:
+            raise http_error(status, 'backendError', 'Backend Error')
+
+    def record_history(self, message_id, **change):
+        # Caller holds the lock
+        self.history_id += 1
+        self.history.append({'id': str(self.history_id), 'messages': [{'id': message_id}], **change})
+        self.messages[message_id]['historyId'] = str(self.history_id)
+
+    def new_id(self):
+        return f"{next(self._ids):016x}"
+
+    def add_message(self, sender, subject, body='', attachments=(), thread_id=None, labels=('INBOX', 'UNREAD')):
+        message_id = self.new_id()
+        parts = [{'mimeType': 'text/plain', 'filename': '',
+                  'body': {'data': base64.urlsafe_b64encode(body.encode('utf-8')).decode('ascii')}}]
+        for filename, mime_type, data in attachments:
+            attachment_id = f"att-{self.new_id()}"
+            self.attachments[(message_id, attachment_id)] = data
+            parts.append({'mimeType': mime_type, 'filename': filename,
+                          'body': {'attachmentId': attachment_id, 'size': len(data)}})
+        with self._lock:
+            self.messages[message_id] = {
+                'id': message_id,
+                'threadId': thread_id or message_id,
+                'labelIds': list(labels),
+                'internalDate': str(int(time.time() * 1000)),
+                'payload': {
+                    'headers': [{'name': 'From', 'value': sender}, {'name': 'Subject', 'value': subject},
+                                {'name': 'Message-ID', 'value': f"<{message_id}@fakegmail.local>"}],
+                    'parts': parts,
+                },
+            }
+            self.received[message_id] = time.monotonic()
+            self.record_history(message_id, messagesAdded=[{'message': {
+                'id': message_id, 'threadId': thread_id or message_id, 'labelIds': list(labels)}}])
+        return message_id
+
+    def has_attachment(self, message):
+        return any(part.get('filename') for part in message['payload']['parts'])
+
+    def users(self):
+        return FakeUsers(self)
+
+class FakeUsers:
+    def __init__(self, gmail):
+        self.gmail = gmail
+
+    def messages(self):
+        return FakeMessages(self.gmail)
+
+    def history(self):
+        return FakeHistory(self.gmail)
+
+    def getProfile(self, userId):
+        def handler():
+            with self.gmail._lock:
+                return {'emailAddress': 'proofs@example.com', 'messagesTotal': len(self.gmail.messages),
+                        'historyId': str(self.gmail.history_id)}
+        return FakeRequest(self.gmail, 'getProfile', handler)
+
+class FakeHistory:
+    def __init__(self, gmail):
+        self.gmail = gmail
+
+    def list(self, userId, startHistoryId, historyTypes=None, labelId=None, maxResults=100, pageToken=None):
+        # Changes after startHistoryId, oldest first; a start older than the
+        # retained history is a 404, as Gmail answers once it expires
+        def handler():
+            start = int(pageToken or startHistoryId)
+            with self.gmail._lock:
+                records = list(self.gmail.history)
+                current = str(self.gmail.history_id)
+                messages = self.gmail.messages
+                if records and start < int(records[0]['id']) - 1:
+                    raise http_error(404, 'notFound', 'Requested entity was not found.')
+                found = []
+                for record in records:
+                    if int(record['id']) <= start:
+                        continue
+                    if historyTypes and not any(kind in record for kind in historyTypes):
+                        continue
+                    if labelId and not all(labelId in messages[m['id']]['labelIds'] for m in record['messages']):
+                        continue
+                    found.append(json.loads(json.dumps(record)))
+            response = {'history': found[:maxResults], 'historyId': current}
+            if len(found) > maxResults:
+                response['nextPageToken'] = found[maxResults - 1]['id']
+            return response
+        return FakeRequest(self.gmail, 'history.list', handler)
+
+class FakeMessages:
+    def __init__(self, gmail):
+        self.gmail = gmail
+
+    def list(self, userId, labelIds=None, q=''):
+        def handler():
+            terms = q.split()
+            with self.gmail._lock:
+                found = []
+                for message in self.gmail.messages.values():
+                    if labelIds and not set(labelIds) <= set(message['labelIds']):
+                        continue
+                    if 'is:unread' in terms and 'UNREAD' not in message['labelIds']:
+                        continue
+                    if 'has:attachment' in terms and not self.gmail.has_attachment(message):
+                        continue
+                    if '-has:attachment' in terms and self.gmail.has_attachment(message):
+                        continue
+                    found.append({'id': message['id'], 'threadId': message['threadId']})
+            # Newest first, like Gmail
+            found.reverse()
+            return {'messages': found, 'resultSizeEstimate': len(found)}
+        return FakeRequest(self.gmail, 'messages.list', handler)
+
+    def get(self, userId, id):
+        def handler():
+            if id not in self.gmail.messages:
+                raise http_error(404, 'notFound', 'Requested entity was not found.')
+            return json.loads(json.dumps(self.gmail.messages[id]))
+        return FakeRequest(self.gmail, 'messages.get', handler)
+
+    def attachments(self):
+        return FakeAttachments(self.gmail)
+
+    def send(self, userId, body):
+        def handler():
+            message_id = self.gmail.new_id()
+            with self.gmail._lock:
+                self.gmail.sent.append({'id': message_id, 'threadId': body.get('threadId'),
+                                        'raw': body['raw'], 'time': time.monotonic()})
+            return {'id': message_id, 'threadId': body.get('threadId') or message_id}
+        return FakeRequest(self.gmail, 'messages.send', handler)
+
+    def modify(self, userId, id, body):
+        def handler():
+            with self.gmail._lock:
+                message = self.gmail.messages[id]
+                removed = [label for label in body.get('removeLabelIds', []) if label in message['labelIds']]
+                added = [label for label in body.get('addLabelIds', []) if label not in message['labelIds']]
+                labels = [label for label in message['labelIds'] if label not in removed] + added
+                message['labelIds'] = labels
+                change = {}
+                if added:
+                    change['labelsAdded'] = [{'message': {'id': id, 'labelIds': labels}, 'labelIds': added}]
+                if 'UNREAD' in removed:
+                    self.gmail.read_at[id] = time.monotonic()
+                if removed:
+                    change['labelsRemoved'] = [{'message': {'id': id, 'labelIds': labels}, 'labelIds': removed}]
+                if change:
+                    self.gmail.record_history(id, **change)
+            return {'id': id, 'labelIds': labels}
+        return FakeRequest(self.gmail, 'messages.modify', handler)
+
+class FakeAttachments:
+    def __init__(self, gmail):
+        self.gmail = gmail
+
+    def get(self, userId, messageId, id):
+        def handler():
+            data = self.gmail.attachments[(messageId, id)]
+            return {'size': len(data), 'data': base64.urlsafe_b64encode(data).decode('ascii')}
+        return FakeRequest(self.gmail, 'messages.attachments.get', handler)
+
+if __name__ == "__main__":
+    # Burst of emails against the simulated quota: every one should be fetched,
+    # answered and marked read, with 429s absorbed by the scheduler's retries
+    import asyncio
+    from gmail_quota import get_scheduler
+    from gmail_service import check_for_new_emails, get_attachment_data, send_reply_email, mark_email_as_read
+
+    async def burst(count=60):
+        gmail = FakeGmail()
+        for i in range(count):
+            gmail.add_message(f"customer{i}@example.com", f"Proof {i}", "Please print this",
+                              [(f"design{i}.png", 'image/png', b'\x89PNG' + bytes(2048))])
+        start = time.monotonic()
+        emails = await check_for_new_emails(gmail)
+
+        async def answer(email_data):
+            sender, subject, message_id, content, attachments, thread_id, rfc_message_id = email_data
+            await get_attachment_data(gmail, 'me', message_id, attachments[0]['id'])
+            await send_reply_email(gmail, sender, subject, "Proof attached", thread_id, [], rfc_message_id)
+            await mark_email_as_read(gmail, message_id)
+
+        await asyncio.gather(*[answer(email_data) for email_data in emails])
+        print(f"{len(emails)} emails, {len(gmail.sent)} replies in {time.monotonic() - start:.1f}s")
+        print(f"Server calls: {gmail.calls}")
+        print(f"Server rejections: {gmail.rejected}")
+        scheduler = get_scheduler(gmail)
+        print(f"Scheduler: {scheduler.stats}, final concurrency {int(scheduler.limit)}")
+
+    asyncio.run(burst())
@@ -0,0 +1,66 @@
+import hashlib
+import logging
+from io import BytesIO
+from PIL import Image, ImageSequence
+from config import load_frames_config
+
+logger = logging.getLogger(__name__)
+
+# Animated GIF/WebP and multi-page TIFF uploads. Frames are decoded one at a
+# time as the caller asks for them (ImageSequence seeks lazily) and hashed;
+# only distinct frames are re-encoded losslessly as a standalone upload and
+# proofed. The decoded frame is dropped before the next one is read.
+
+def frame_count(data):
+    # Reads headers only; a corrupt or unknown file counts as a single frame
+    try:
+        with Image.open(BytesIO(data)) as img:
+            return getattr(img, 'n_frames', 1)
+    except Exception:
+        return 1
+
+def convert_frame(frame, info):
+    # PNG keeps transparency; CMYK pages stay CMYK in a TIFF so the colour
+    # checks see what the printer will. Returns (image, format, extension).
+    if frame.mode == 'CMYK':
+        return frame, 'TIFF', 'tif'
+    if frame.mode in ('RGBA', 'LA', 'PA') or 'transparency' in info:
+        return frame.convert('RGBA'), 'PNG', 'png'
+    return frame.convert('RGB'), 'PNG', 'png'
+
+def frame_digest(image):
+    # Taken after conversion: GIF decoders hand back the first frame as P
+    # and later ones as RGB, so the raw frames of a repeat don't match
+    digest = hashlib.blake2b(f"{image.mode}{image.size}".encode(), digest_size=16)
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+def encode_frame(image, fmt, info):
+    params = {'compress_level': 1} if fmt == 'PNG' else {'compression': 'tiff_deflate'}
+    if 'dpi' in info:
+        params['dpi'] = info['dpi']
+    if 'icc_profile' in info:
+        params['icc_profile'] = info['icc_profile']
+    output = BytesIO()
+    image.save(output, format=fmt, **params)
+    return output.getvalue()
+
+def iter_frames(data, config=None):
+    # Yields {'index', 'digest', 'data', 'extension', 'duplicates'} for each
+    # distinct frame, in order. 'duplicates' is a list the generator keeps
+    # appending later repeats of that frame to; repeats are never encoded.
+    config = config or load_frames_config()
+    seen = {}
+    with Image.open(BytesIO(data)) as img:
+        for index, frame in enumerate(ImageSequence.Iterator(img)):
+            if index >= config['max_frames']:
+                logger.warning(f"Only the first {config['max_frames']} of {getattr(img, 'n_frames', '?')} frames are proofed")
+                break
+            image, fmt, extension = convert_frame(frame, frame.info)
+            digest = frame_digest(image)
+            if digest in seen:
+                seen[digest].append(index)
+                continue
+            seen[digest] = []
+            yield {'index': index, 'digest': digest, 'data': encode_frame(image, fmt, frame.info), 'extension': extension,
+                   'duplicates': seen[digest]}
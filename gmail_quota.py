@@ -0,0 +1,169 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+import weakref
+from config import load_gmail_quota_config
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+def error_status(error):
+    resp = getattr(error, 'resp', None)
+    return getattr(resp, 'status', None) or getattr(error, 'status_code', None)
+
+def is_retryable(error):
+    status = error_status(error)
+    if status in RETRYABLE_STATUSES:
+        return True
+    # Gmail reports per-user rate limiting as 403 rateLimitExceeded / userRateLimitExceeded
+    return status == 403 and 'ratelimitexceeded' in str(error).lower()
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, units):
+        while True:
+            self._refill()
+            if self.tokens >= units:
+                self.tokens -= units
+                return
+            await asyncio.sleep((units - self.tokens) / self.rate)
+
+# Client-side scheduler for Gmail API calls. Every call is charged its quota
+# units against a token bucket, waits for a concurrency slot (handed out by
+# method priority), and is retried with jittered exponential backoff on
+# 429/5xx. Concurrency follows AIMD: +1 after a window of clean successes,
+# halved whenever Gmail pushes back.
+class GmailScheduler:
+    def __init__(self, config=None):
+        self.config = config or load_gmail_quota_config()
+        self.bucket = TokenBucket(self.config['units_per_second'], self.config['burst_units'])
+        self.limit = float(self.config['initial_concurrency'])
+        self.in_flight = 0
+        self._waiters = []
+        self._seq = itertools.count()
+        self._local = threading.local()
+        self.stats = {'calls': 0, 'retries': 0, 'throttled': 0, 'failures': 0, 'units': 0}
+
+    def cost(self, method):
+        return self.config['method_costs'].get(method, 5)
+
+    def priority(self, method):
+        return self.config['method_priorities'].get(method, 2)
+
+    async def _acquire_slot(self, priority):
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release_slot()
+            raise
+
+    def _release_slot(self):
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.in_flight < int(self.limit):
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self.in_flight += 1
+                future.set_result(None)
+
+    def _on_success(self):
+        self.limit = min(self.config['max_concurrency'], self.limit + 1 / max(self.limit, 1))
+        self._wake()
+
+    def _on_throttled(self):
+        self.limit = max(self.config['min_concurrency'], self.limit / 2)
+        # Gmail is already over quota for this user; stop spending saved-up burst
+        self.bucket.tokens = min(self.bucket.tokens, 0)
+        self.stats['throttled'] += 1
+
+    def _backoff(self, attempt):
+        # Full jitter keeps retries from a burst from landing together
+        ceiling = min(self.config['backoff_max_seconds'], self.config['backoff_base_seconds'] * 2 ** attempt)
+        return random.uniform(0, ceiling)
+
+    def _thread_http(self, service):
+        # httplib2 is not thread-safe, so each worker thread gets its own
+        # authorised connection per set of credentials, so services for
+        # different accounts sharing this scheduler never borrow each other's
+        credentials = getattr(getattr(service, '_http', None), 'credentials', None)
+        if credentials is None:
+            return None
+        connections = getattr(self._local, 'https', None)
+        if connections is None:
+            connections = self._local.https = {}
+        # Holding the credentials alongside keeps their id from being reused
+        cached = connections.get(id(credentials))
+        if cached is None:
+            import google_auth_httplib2
+            import httplib2
+            cached = (credentials, google_auth_httplib2.AuthorizedHttp(credentials, http=httplib2.Http()))
+            connections[id(credentials)] = cached
+        return cached[1]
+
+    def _execute_request(self, service, request):
+        http = self._thread_http(service)
+        return request.execute(http=http) if http is not None else request.execute()
+
+    async def execute(self, service, method, request):
+        units = self.cost(method)
+        priority = self.priority(method)
+        attempt = 0
+        while True:
+            await self._acquire_slot(priority)
+            try:
+                await self.bucket.acquire(units)
+                self.stats['calls'] += 1
+                self.stats['units'] += units
+                result = await asyncio.to_thread(self._execute_request, service, request)
+            except Exception as error:
+                self._release_slot()
+                if not is_retryable(error) or attempt >= self.config['max_retries']:
+                    self.stats['failures'] += 1
+                    raise
+                self._on_throttled()
+                delay = self._backoff(attempt)
+                attempt += 1
+                self.stats['retries'] += 1
+                logger.warning(f"Gmail {method} returned {error_status(error)}; retry {attempt} in {delay:.1f}s "
+                               f"(concurrency now {int(self.limit)})")
+                await asyncio.sleep(delay)
+                continue
+            self._release_slot()
+            self._on_success()
+            return result
+
+_schedulers = weakref.WeakKeyDictionary()
+
+def get_scheduler(service):
+    # Gmail's quota is per user, so each account (its credentials, or the
+    # service itself when it has none) gets its own bucket and AIMD window.
+    # asyncio primitives are bound to a loop, so they are kept per loop too.
+    loop = asyncio.get_running_loop()
+    account = getattr(getattr(service, '_http', None), 'credentials', None) or service
+    schedulers = _schedulers.setdefault(loop, weakref.WeakKeyDictionary())
+    if account not in schedulers:
+        schedulers[account] = GmailScheduler()
+    return schedulers[account]
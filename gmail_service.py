@@ -5,49 +5,84 @@ from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+import asyncio
 import base64
+import os
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.image import MIMEImage
 from email.mime.base import MIMEBase  # Add this line
 import email.encoders as encoders  # Add this line if not already present
+from gmail_quota import get_scheduler
 
 SCOPES = ['https://www.googleapis.com/auth/gmail.modify']
 
 # Add this line near the top of the file, after the imports
 logger = logging.getLogger(__name__)
 
-async def get_gmail_service():
+async def get_gmail_service(credentials_path='credentials.json', token_path='token.json'):
+    # A saved token lets headless nodes start without the browser flow
     creds = None
+    if os.path.exists(token_path):
+        creds = Credentials.from_authorized_user_file(token_path, SCOPES)
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
             creds.refresh(Request())
         else:
-            flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
+            flow = InstalledAppFlow.from_client_secrets_file(credentials_path, SCOPES)
             creds = flow.run_local_server(port=0)
-        with open('token.json', 'w') as token:
+        with open(token_path, 'w') as token:
             token.write(creds.to_json())
     return build('gmail', 'v1', credentials=creds)
 
-async def check_for_new_emails(service):
+async def check_for_new_emails(service, is_known_thread=None, claim=None):
+    # New artwork arrives with attachments; replies without attachments are
+    # picked up only in threads that already have a proof (is_known_thread).
+    # With several nodes, claim(message_ids) returns the ids this node may
+    # process, and only those are fetched.
+    scheduler = get_scheduler(service)
+    queries = ['is:unread has:attachment']
+    if is_known_thread is not None:
+        queries.append('is:unread -has:attachment')
     try:
-        results = service.users().messages().list(userId='me', labelIds=['INBOX'], q='is:unread has:attachment').execute()
-        messages = results.get('messages', [])
-        
-        new_emails = []
-        for message in messages:
-            msg = service.users().messages().get(userId='me', id=message['id']).execute()
-            email_data = msg['payload']['headers']
-            subject = next(header['value'] for header in email_data if header['name'] == 'Subject')
-            sender = next(header['value'] for header in email_data if header['name'] == 'From')
-            content = get_email_content(msg)
-            attachments = get_attachments(msg)
-            new_emails.append((sender, subject, message['id'], content, attachments))
-        
-        return new_emails
+        listed = await asyncio.gather(*[
+            scheduler.execute(service, 'messages.list', service.users().messages().list(
+                userId='me', labelIds=['INBOX'], q=query))
+            for query in queries
+        ])
     except HttpError as error:
-        print(f'An error occurred: {error}')
+        logger.error(f'An error occurred while listing messages: {error}')
         return []
+    messages = listed[0].get('messages', [])
+    if is_known_thread is not None:
+        messages += [message for message in listed[1].get('messages', []) if is_known_thread(message['threadId'])]
+    if claim is not None and messages:
+        claimed = set(await asyncio.to_thread(claim, [message['id'] for message in messages]))
+        messages = [message for message in messages if message['id'] in claimed]
+
+    # Fetch messages concurrently; the scheduler keeps us inside the quota
+    fetched = await asyncio.gather(*[
+        scheduler.execute(service, 'messages.get', service.users().messages().get(userId='me', id=message['id']))
+        for message in messages
+    ], return_exceptions=True)
+
+    new_emails = []
+    for message, msg in zip(messages, fetched):
+        if isinstance(msg, Exception):
+            # Left unread, so it is picked up again on the next poll
+            logger.error(f"An error occurred while fetching message {message['id']}: {msg}")
+            continue
+        email_data = msg['payload']['headers']
+        subject = next(header['value'] for header in email_data if header['name'] == 'Subject')
+        sender = next(header['value'] for header in email_data if header['name'] == 'From')
+        # The RFC 822 Message-ID (Gmail spells it either way), for threading replies
+        rfc_message_id = next((header['value'] for header in email_data if header['name'].lower() == 'message-id'), None)
+        content = get_email_content(msg)
+        attachments = get_attachments(msg)
+        new_emails.append((sender, subject, message['id'], content, attachments, msg.get('threadId', message['id']),
+                           rfc_message_id))
+    
+    return new_emails
 
 def get_email_content(msg):
     parts = msg['payload'].get('parts', [])
@@ -77,18 +112,23 @@ def get_attachment_type(attachment):
 
 async def get_attachment_data(service, user_id, message_id, attachment_id):
     try:
-        attachment = service.users().messages().attachments().get(
-            userId=user_id, messageId=message_id, id=attachment_id).execute()
+        attachment = await get_scheduler(service).execute(service, 'messages.attachments.get', service.users().messages().attachments().get(
+            userId=user_id, messageId=message_id, id=attachment_id))
         data = attachment['data']
         return base64.urlsafe_b64decode(data)
     except HttpError as error:
-        print(f'An error occurred: {error}')
+        logger.error(f'An error occurred while fetching attachment {attachment_id}: {error}')
         return None
 
-async def send_reply_email(service, to, subject, body, thread_id, attachments_data):
+async def send_reply_email(service, to, subject, body, thread_id, attachments_data, in_reply_to=None):
+    # threadId only files the reply in our own mailbox; recipients' clients
+    # thread on In-Reply-To/References and a matching "Re:" subject
     message = MIMEMultipart()
     message['to'] = to
-    message['subject'] = f"Re: {subject}"
+    message['subject'] = subject if subject.lower().startswith('re:') else f"Re: {subject}"
+    if in_reply_to:
+        message['In-Reply-To'] = in_reply_to
+        message['References'] = in_reply_to
     message.attach(MIMEText(body))
 
     for attachment in attachments_data:
@@ -102,19 +142,24 @@ async def send_reply_email(service, to, subject, body, thread_id, attachments_da
 
     raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
     try:
-        sent_message = service.users().messages().send(userId='me', body={'raw': raw_message, 'threadId': thread_id}).execute()
+        sent_message = await get_scheduler(service).execute(service, 'messages.send', service.users().messages().send(
+            userId='me', body={'raw': raw_message, 'threadId': thread_id}))
         logger.info(f"Message sent. Message ID: {sent_message['id']}")
     except Exception as e:
+        # Retries are exhausted; the caller leaves the message unread (and
+        # releases its lease) so it is tried again later
         logger.error(f"An error occurred while sending the email: {e}")
+        raise
 
 async def mark_email_as_read(service, message_id):
     try:
-        service.users().messages().modify(
+        await get_scheduler(service).execute(service, 'messages.modify', service.users().messages().modify(
             userId="me",
             id=message_id,
             body={'removeLabelIds': ['UNREAD']}
-        ).execute()
+        ))
     except Exception as error:
-        print(f"An error occurred: {error}")
+        logger.error(f"An error occurred while marking {message_id} as read: {error}")
+        raise
 
 
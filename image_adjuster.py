@@ -1,31 +1,57 @@
-from PIL import Image, ImageEnhance
+import cv2
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
 from io import BytesIO
+from config import load_print_config, load_adjust_config
+from encoding import encode_image
+from anal import assess_metrics
+from autoediting.refine import resize_band
 
-def adjust_image(image_data, analysis_results, desired_width_inch, desired_height_inch):
+# ImageEnhance.Sharpness blends the image with PIL's SMOOTH filter;
+# enhance(f) == f * image + (1 - f) * smooth, which is a single 3x3 kernel
+SMOOTH_KERNEL = np.array([[1, 1, 1], [1, 5, 1], [1, 1, 1]], dtype=np.float32) / 13
+IDENTITY_KERNEL = np.array([[0, 0, 0], [0, 1, 0], [0, 0, 0]], dtype=np.float32)
+
+def adjust_image(image_data, metrics, desired_width_inch, desired_height_inch):
+    # metrics is the ImageMetrics record from anal.run_checks; the same
+    # thresholds the reply reports decide the adjustments
+    print_config = load_print_config()
+    config = load_adjust_config()
     img = Image.open(BytesIO(image_data))
-    
-    # Aspect ratio adjustment
-    img = adjust_aspect_ratio(img, desired_width_inch, desired_height_inch)
-    
-    if "sharpness" in analysis_results and "Image appears blurry" in analysis_results["sharpness"]:
-        img = sharpen_image(img)
-    
-    if "exposure" in analysis_results:
-        if "underexposed" in analysis_results["exposure"].lower():
-            img = brighten_image(img)
-        elif "overexposed" in analysis_results["exposure"].lower():
-            img = darken_image(img)
-    
-    if "resolution" in analysis_results:
-        width, height = map(int, analysis_results["resolution"].split(":")[1].strip().split("x"))
-        if width < 2000 or height < 2000:  # Example threshold
-            img = upscale_image(img)
-    
+    if img.mode not in ('L', 'RGB', 'RGBA'):
+        img = img.convert('RGBA' if 'A' in img.getbands() else 'RGB')
+
+    # Exact pixel size of the bleed box at the print DPI
+    size = target_size(print_config['print_dpi'], desired_width_inch, desired_height_inch, print_config['bleed_inch'])
+
+    # Crop to the target aspect ratio first, so only kept pixels are resampled
+    bleed = 2 * print_config['bleed_inch']
+    img = adjust_aspect_ratio(img, desired_width_inch + bleed, desired_height_inch + bleed)
+
+    verdicts = assess_metrics(metrics, print_config['print_dpi'], desired_width_inch, desired_height_inch,
+                              print_config['bleed_inch'], print_config)
+
+    sharpen = None
+    if "sharpness" in verdicts and not verdicts["sharpness"]['ok']:
+        sharpen = config['sharpen_factor']
+
+    brightness = None
+    if "exposure" in verdicts:
+        if verdicts["exposure"]['underexposed']:
+            brightness = config['brighten_factor']
+        elif verdicts["exposure"]['overexposed']:
+            brightness = config['darken_factor']
+
     # Add more adjustments based on other analysis results
-    
-    buffered = BytesIO()
-    img.save(buffered, format="PNG")
-    return buffered.getvalue()
+
+    img = resample(img, size, sharpen=sharpen, brightness=brightness,
+                   band_rows=config['band_rows'], workers=config['workers'])
+    return encode_image(img, 'master')['data']
+
+def target_size(print_dpi, width_inch, height_inch, bleed_inch):
+    return (round((width_inch + 2 * bleed_inch) * print_dpi),
+            round((height_inch + 2 * bleed_inch) * print_dpi))
 
 def adjust_aspect_ratio(img, desired_width_inch, desired_height_inch):
     current_ratio = img.width / img.height
@@ -45,18 +71,59 @@ def adjust_aspect_ratio(img, desired_width_inch, desired_height_inch):
         top = (img.height - new_height) // 2
         return img.crop((0, top, img.width, top + new_height))
 
+def sharpen_kernel(factor):
+    return factor * IDENTITY_KERNEL + (1 - factor) * SMOOTH_KERNEL
+
+def brightness_lut(factor, channels):
+    # ImageEnhance.Brightness scales every colour channel; alpha is left alone
+    table = np.clip(np.arange(256) * factor, 0, 255).astype(np.uint8)
+    luts = [table] * min(channels, 3) + [np.arange(256, dtype=np.uint8)] * (channels - 3)
+    return np.stack(luts, axis=-1).reshape(1, 256, channels)
+
+_executor = None
+
+def get_resample_executor(workers):
+    # OpenCV releases the GIL, so bands resample and filter in parallel on threads
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='resample')
+    return _executor
+
+def resample(img, size, sharpen=None, brightness=None, band_rows=256, workers=4):
+    # One Lanczos pass to the exact output size, produced band by band.
+    # Sharpening and brightness run on each band while it is still in cache:
+    # the sharpen kernel needs one row of context, so bands are resampled
+    # with a one-row halo that is dropped afterwards.
+    if img.width >= 2 * size[0] and img.height >= 2 * size[1]:
+        # Lanczos taps don't widen when shrinking; box-reduce the integer part
+        # first so large downscales don't alias
+        img = img.reduce(min(img.width // size[0], img.height // size[1]))
+    src = np.asarray(img)
+    channels = 1 if src.ndim == 2 else src.shape[2]
+    kernel = sharpen_kernel(sharpen) if sharpen is not None else None
+    lut = brightness_lut(brightness, channels) if brightness is not None else None
+    out = np.empty((size[1], size[0]) + src.shape[2:], dtype=np.uint8)
+
+    def render(y0):
+        y1 = min(y0 + band_rows, size[1])
+        top, bottom = max(y0 - 1, 0), min(y1 + 1, size[1])
+        band = resize_band(src, size, top, bottom, cv2.INTER_LANCZOS4)
+        if kernel is not None:
+            colour = band[..., :3] if channels == 4 else band
+            colour[...] = cv2.filter2D(colour, -1, kernel, borderType=cv2.BORDER_REPLICATE)
+        band = band[y0 - top:band.shape[0] - (bottom - y1)]
+        if lut is not None:
+            band = cv2.LUT(band, lut) if channels > 1 else lut[0, band, 0]
+        out[y0:y1] = band
+
+    list(get_resample_executor(workers).map(render, range(0, size[1], band_rows)))
+    return Image.fromarray(out, mode=img.mode)
+
 def sharpen_image(img):
-    enhancer = ImageEnhance.Sharpness(img)
-    return enhancer.enhance(1.5)  # Increase sharpness by 50%
+    return resample(img, img.size, sharpen=load_adjust_config()['sharpen_factor'])
 
 def brighten_image(img):
-    enhancer = ImageEnhance.Brightness(img)
-    return enhancer.enhance(1.2)  # Increase brightness by 20%
+    return resample(img, img.size, brightness=load_adjust_config()['brighten_factor'])
 
 def darken_image(img):
-    enhancer = ImageEnhance.Brightness(img)
-    return enhancer.enhance(0.8)  # Decrease brightness by 20%
-
-def upscale_image(img):
-    width, height = img.size
-    return img.resize((width*2, height*2), Image.LANCZOS)
\ No newline at end of file
+    return resample(img, img.size, brightness=load_adjust_config()['darken_factor'])
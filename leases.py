@@ -0,0 +1,145 @@
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from config import load_cluster_config
+
+logger = logging.getLogger(__name__)
+
+# Coordination between monitor processes reading the same mailboxes. Every
+# node lists unread mail, then claims individual messages in a shared SQLite
+# (WAL) lease table before fetching them; only the node holding a claim
+# processes the message. Claims are leases: a node's heartbeat keeps its own
+# alive, and a claim whose lease ran out (its node died or hung) can be taken
+# over by any other node. Finished messages stay recorded as done, and a
+# message that has had any reply is recorded as replied, so a message that
+# is still unread in Gmail is never answered a second time.
+# Nodes claim a bounded batch per poll, so a backlog spreads across nodes.
+class LeaseTable:
+    def __init__(self, db_path, node_id=None, lease_seconds=120):
+        self.node_id = node_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        # Autocommit mode; claims open their own BEGIN IMMEDIATE transactions
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS nodes (
+                node_id TEXT PRIMARY KEY,
+                host TEXT NOT NULL,
+                pid INTEGER NOT NULL,
+                started REAL NOT NULL,
+                heartbeat REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS claims (
+                account TEXT NOT NULL,
+                message_id TEXT NOT NULL,
+                node_id TEXT NOT NULL,
+                status TEXT NOT NULL,
+                expires REAL NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 1,
+                updated REAL NOT NULL,
+                PRIMARY KEY (account, message_id)
+            );
+            CREATE INDEX IF NOT EXISTS claims_node ON claims(node_id, status);
+            CREATE INDEX IF NOT EXISTS claims_updated ON claims(status, updated);
+        ''')
+        now = time.time()
+        self._db.execute('INSERT OR REPLACE INTO nodes (node_id, host, pid, started, heartbeat) VALUES (?, ?, ?, ?, ?)',
+                         (self.node_id, socket.gethostname(), os.getpid(), now, now))
+
+    def claim(self, account, message_ids, limit=None):
+        # Returns the ids this node now holds, in the order given: unclaimed
+        # ones, ones it already held, and expired leases of other nodes
+        now = time.time()
+        claimed, taken_over = [], 0
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                for message_id in message_ids:
+                    if limit is not None and len(claimed) >= limit:
+                        break
+                    row = self._db.execute('SELECT node_id, status, expires FROM claims WHERE account = ? AND message_id = ?',
+                                           (account, message_id)).fetchone()
+                    if row is None:
+                        self._db.execute('INSERT INTO claims (account, message_id, node_id, status, expires, updated) '
+                                         'VALUES (?, ?, ?, ?, ?, ?)',
+                                         (account, message_id, self.node_id, 'claimed', now + self.lease_seconds, now))
+                    elif row[1] in ('done', 'replied') or (row[0] != self.node_id and row[2] > now):
+                        continue
+                    else:
+                        taken_over += row[0] != self.node_id
+                        self._db.execute('UPDATE claims SET node_id = ?, status = ?, expires = ?, attempts = attempts + 1, '
+                                         'updated = ? WHERE account = ? AND message_id = ?',
+                                         (self.node_id, 'claimed', now + self.lease_seconds, now, account, message_id))
+                    claimed.append(message_id)
+                self._db.execute('COMMIT')
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+        if taken_over:
+            logger.warning(f"Took over {taken_over} expired claim(s) in {account}")
+        return claimed
+
+    def _finish(self, account, message_id, status):
+        with self._lock:
+            self._db.execute('UPDATE claims SET status = ?, expires = 0, updated = ? '
+                             'WHERE account = ? AND message_id = ? AND node_id = ?',
+                             (status, time.time(), account, message_id, self.node_id))
+
+    def complete(self, account, message_id):
+        self._finish(account, message_id, 'done')
+
+    def replied(self, account, message_id):
+        # A reply has gone out, so the message must never be retried, even
+        # if the rest of its processing fails
+        self._finish(account, message_id, 'replied')
+
+    def release(self, account, message_id):
+        # Gives the message back straight away, e.g. after a failed attempt
+        self._finish(account, message_id, 'released')
+
+    def heartbeat(self):
+        # Extends every lease this node holds; returns how many
+        now = time.time()
+        with self._lock:
+            self._db.execute('UPDATE nodes SET heartbeat = ? WHERE node_id = ?', (now, self.node_id))
+            cursor = self._db.execute('UPDATE claims SET expires = ? WHERE node_id = ? AND status = ?',
+                                      (now + self.lease_seconds, self.node_id, 'claimed'))
+        return cursor.rowcount
+
+    def live_nodes(self):
+        cutoff = time.time() - self.lease_seconds
+        with self._lock:
+            return [row[0] for row in self._db.execute('SELECT node_id FROM nodes WHERE heartbeat >= ? ORDER BY started',
+                                                       (cutoff,))]
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._db.execute('SELECT status, COUNT(*) FROM claims GROUP BY status').fetchall())
+            mine = self._db.execute('SELECT COUNT(*) FROM claims WHERE node_id = ? AND status = ?',
+                                    (self.node_id, 'claimed')).fetchone()[0]
+        return {'node': self.node_id, 'live_nodes': len(self.live_nodes()), 'held': mine, **counts}
+
+    def prune(self, retention_seconds):
+        # Done claims only need to outlive the message staying unread in Gmail
+        cutoff = time.time() - retention_seconds
+        with self._lock:
+            self._db.execute('DELETE FROM claims WHERE status != ? AND updated < ?', ('claimed', cutoff))
+            self._db.execute('DELETE FROM nodes WHERE heartbeat < ?', (cutoff,))
+
+    def close(self):
+        with self._lock:
+            self._db.execute('DELETE FROM nodes WHERE node_id = ?', (self.node_id,))
+            # Unfinished claims go back to the pool instead of waiting to expire
+            self._db.execute('UPDATE claims SET status = ?, expires = 0 WHERE node_id = ? AND status = ?',
+                             ('released', self.node_id, 'claimed'))
+            self._db.close()
+
+def open_lease_table(config=None):
+    config = config or load_cluster_config()
+    return LeaseTable(config['lease_db_path'], lease_seconds=config['lease_seconds'])
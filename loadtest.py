@@ -0,0 +1,239 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import shutil
+import tempfile
+import time
+from io import BytesIO
+from PIL import Image, ImageDraw
+from config import load_loadtest_config, load_output_config
+from fakegmail import FakeGmail
+from emailmonitor import monitor_emails
+from proof_threads import has_thread_state
+from job_scheduler import get_job_scheduler, percentile
+from gmail_quota import get_scheduler
+from autoediting.weights import memory_usage
+
+logger = logging.getLogger(__name__)
+
+# End-to-end load test: the real monitor loop and proofing pipeline run
+# against a FakeGmail with network latency, transient errors and quota,
+# while a generator injects emails as a Poisson process at a configured rate
+# with a realistic mix of attachments and placement replies. Reports
+# throughput, time-to-reply percentiles (first reply and final reply, which
+# differ with staged replies) and writes CPU/memory samples as JSONL.
+# Every email carries a design of its own, so pHash reuse and the store's
+# deduplication don't turn the run into a cache benchmark, and the run writes
+# into a scratch artifact root that is deleted afterwards.
+#
+#   python loadtest.py --rate 1000 --duration 600 --samples loadtest_samples.jsonl
+
+REPLY_TEXTS = [
+    "Looks great, can you make it a bit bigger?",
+    "Could you move it to the top left?",
+    "Please make it smaller and centered.",
+    "Thanks! Can we see it much larger?",
+]
+
+def render_design(rng, mode, size):
+    # Flat-colour artwork with a few shapes, on white or on transparency
+    background = (0, 0, 0, 0) if mode == 'RGBA' else (255, 255, 255)
+    image = Image.new(mode, size, background)
+    draw = ImageDraw.Draw(image)
+    width, height = size
+    for _ in range(rng.randint(3, 8)):
+        x0, y0 = rng.randint(0, width // 2), rng.randint(0, height // 2)
+        x1, y1 = rng.randint(x0 + width // 8, width), rng.randint(y0 + height // 8, height)
+        colour = tuple(rng.randint(0, 255) for _ in range(3)) + ((255,) if mode == 'RGBA' else ())
+        shape = rng.choice((draw.ellipse, draw.rectangle))
+        shape((x0, y0, x1, y1), fill=colour)
+    return image
+
+def build_attachment(config, seed):
+    # A fresh design per attachment from its own seed; rendering takes well
+    # under a second even for the largest mix entry
+    rng = random.Random(seed)
+    weights = [entry[0] for entry in config['attachment_mix']]
+    _, image_format, mode, size = rng.choices(config['attachment_mix'], weights=weights)[0]
+    buffer = BytesIO()
+    render_design(rng, mode, size).save(buffer, format=image_format)
+    extension = 'jpg' if image_format == 'JPEG' else image_format.lower()
+    return f"design{seed}.{extension}", f"image/{image_format.lower()}", buffer.getvalue()
+
+class LoadGenerator:
+    def __init__(self, gmail, config, rng):
+        self.gmail = gmail
+        self.config = config
+        self.rng = rng
+        self.injected = {}  # message id -> 'new' or 'reply'
+        self.count = 0
+
+    def answered_threads(self):
+        # Threads whose first proof is done; the monitor only reads replies there
+        return [self.gmail.messages[message_id]['threadId'] for message_id, kind in self.injected.items()
+                if kind == 'new' and message_id in self.gmail.read_at]
+
+    async def inject(self):
+        self.count += 1
+        sender = f"customer{self.rng.randint(1, 200)}@example.com"
+        threads = self.answered_threads()
+        if threads and self.rng.random() < self.config['reply_rate']:
+            thread_id = self.rng.choice(threads)
+            if has_thread_state(thread_id):
+                message_id = self.gmail.add_message(sender, f"Proof {thread_id}", self.rng.choice(REPLY_TEXTS),
+                                                    thread_id=thread_id)
+                self.injected[message_id] = 'reply'
+                return
+        count = 2 if self.rng.random() < self.config['multi_attachment_rate'] else 1
+        seeds = [self.rng.getrandbits(32) for _ in range(count)]
+        attachments = await asyncio.to_thread(lambda: [build_attachment(self.config, seed) for seed in seeds])
+        message_id = self.gmail.add_message(sender, f"Proof request {self.count}", "Please print this on a shirt",
+                                            attachments)
+        self.injected[message_id] = 'new'
+
+    async def run(self, duration):
+        # Poisson arrivals at emails_per_hour
+        rate = self.config['emails_per_hour'] / 3600
+        deadline = time.monotonic() + duration
+        while True:
+            await asyncio.sleep(self.rng.expovariate(rate))
+            if time.monotonic() >= deadline:
+                return
+            await self.inject()
+
+    def pending(self):
+        return [message_id for message_id in self.injected if message_id not in self.gmail.read_at]
+
+async def sample_resources(gmail, generator, path, interval, start):
+    # One JSONL line per interval: CPU use of this process (all threads and
+    # reaped children), memory, backlog and progress
+    last_wall, last_cpu = time.monotonic(), sum(os.times()[:4])
+    with open(path, 'w') as f:
+        while True:
+            await asyncio.sleep(interval)
+            wall, cpu = time.monotonic(), sum(os.times()[:4])
+            memory = memory_usage()
+            sample = {
+                't': round(wall - start, 2),
+                'cpu_percent': round(100 * (cpu - last_cpu) / (wall - last_wall), 1),
+                'rss_mb': memory.get('rss_mb', memory.get('max_rss_mb')),
+                'pss_mb': memory.get('pss_mb'),
+                'injected': len(generator.injected),
+                'unanswered': len(generator.pending()),
+                'sent': len(gmail.sent),
+                'jobs': get_job_scheduler().stats(),
+            }
+            f.write(json.dumps(sample) + '\n')
+            f.flush()
+            last_wall, last_cpu = wall, cpu
+
+def reply_latencies(gmail, generator):
+    # First and last reply in the message's thread between its arrival and
+    # being marked read; with staged replies the first is the print checks
+    sent_by_thread = {}
+    for sent in gmail.sent:
+        sent_by_thread.setdefault(sent['threadId'], []).append(sent['time'])
+    first, final = [], []
+    for message_id in generator.injected:
+        if message_id not in gmail.read_at:
+            continue
+        received, read = gmail.received[message_id], gmail.read_at[message_id]
+        times = [t for t in sent_by_thread.get(gmail.messages[message_id]['threadId'], []) if received <= t <= read]
+        if times:
+            first.append(times[0] - received)
+            final.append(times[-1] - received)
+    return first, final
+
+def summarise(values):
+    if not values:
+        return None
+    return {pct: round(percentile(values, value), 2) for pct, value in (('p50', 50), ('p95', 95), ('p99', 99))}
+
+async def run_load_test(config=None, samples_path='loadtest_samples.jsonl'):
+    # The store, pHash index and lease table are opened on first use, so the
+    # scratch root must be in place before anything in this process touches
+    # them (the spawned check workers inherit it too)
+    root = tempfile.mkdtemp(prefix='loadtest-store-')
+    previous = os.environ.get('ARTIFACT_STORE_ROOT')
+    os.environ['ARTIFACT_STORE_ROOT'] = root
+    try:
+        return await measure_load(config, samples_path)
+    finally:
+        if previous is None:
+            os.environ.pop('ARTIFACT_STORE_ROOT', None)
+        else:
+            os.environ['ARTIFACT_STORE_ROOT'] = previous
+        shutil.rmtree(root, ignore_errors=True)
+
+async def measure_load(config, samples_path):
+    config = config or load_loadtest_config()
+    rng = random.Random(config['seed'])
+    gmail = FakeGmail(units_per_second=config['units_per_second'], latency=config['latency_seconds'],
+                      error_rate=config['error_rate'], daily_units=config['daily_units'], seed=config['seed'])
+    generator = LoadGenerator(gmail, config, rng)
+    logger.info(f"Load test: {config['emails_per_hour']} emails/hour for {config['duration_seconds']}s, "
+                f"staged replies {'on' if load_output_config()['staged_replies'] else 'off'}")
+
+    start = time.monotonic()
+    monitor = asyncio.create_task(monitor_emails(gmail, config['poll_interval'], account='loadtest'))
+    sampler = asyncio.create_task(sample_resources(gmail, generator, samples_path, config['sample_interval'], start))
+    try:
+        await generator.run(config['duration_seconds'])
+        injected_until = time.monotonic()
+        drain_deadline = injected_until + config['drain_timeout_seconds']
+        while generator.pending() and time.monotonic() < drain_deadline:
+            if monitor.done():
+                break  # Surfaces the monitor's exception below
+            await asyncio.sleep(0.5)
+    finally:
+        for task in (monitor, sampler):
+            task.cancel()
+        results = await asyncio.gather(monitor, sampler, return_exceptions=True)
+    if isinstance(results[0], Exception):
+        raise results[0]
+
+    elapsed = time.monotonic() - start
+    first, final = reply_latencies(gmail, generator)
+    answered = len(generator.injected) - len(generator.pending())
+    kinds = list(generator.injected.values())
+    report = {
+        'offered_emails_per_hour': config['emails_per_hour'],
+        'injected': len(kinds),
+        'new_emails': kinds.count('new'),
+        'placement_replies': kinds.count('reply'),
+        'answered': answered,
+        'unanswered': len(generator.pending()),
+        'seconds': round(elapsed, 1),
+        'throughput_emails_per_hour': round(answered / elapsed * 3600, 1),
+        'first_reply_seconds': summarise(first),
+        'final_reply_seconds': summarise(final),
+        'gmail_calls': gmail.calls,
+        'gmail_rejected': gmail.rejected,
+        'gmail_errors': gmail.errors,
+        'gmail_units': gmail.units_used,
+        'scheduler': get_scheduler(gmail).stats,
+        'samples': samples_path,
+    }
+    logger.info(f"Load test report: {json.dumps(report)}")
+    return report
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    config = load_loadtest_config()
+    parser = argparse.ArgumentParser(description="Load-test the email pipeline against a local Gmail stand-in")
+    parser.add_argument('--rate', type=float, default=config['emails_per_hour'], help="Emails per hour")
+    parser.add_argument('--duration', type=float, default=config['duration_seconds'], help="Seconds of injection")
+    parser.add_argument('--poll-interval', type=float, default=config['poll_interval'])
+    parser.add_argument('--error-rate', type=float, default=config['error_rate'])
+    parser.add_argument('--samples', default='loadtest_samples.jsonl', help="CPU/memory samples (JSONL)")
+    parser.add_argument('--report', default=None, help="Also write the report to this JSON file")
+    args = parser.parse_args()
+    config.update(emails_per_hour=args.rate, duration_seconds=args.duration,
+                  poll_interval=args.poll_interval, error_rate=args.error_rate)
+    report = asyncio.run(run_load_test(config, args.samples))
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
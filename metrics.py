@@ -0,0 +1,36 @@
+import threading
+from collections import deque
+from job_scheduler import percentile
+
+# In-process latency metrics: a rolling window of observations per name,
+# summarised as count and percentiles for the periodic log lines.
+class Metrics:
+    def __init__(self, window=500):
+        self.window = window
+        self._series = {}
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, value):
+        with self._lock:
+            self._series.setdefault(name, deque(maxlen=self.window)).append(value)
+            self._counts[name] = self._counts.get(name, 0) + 1
+
+    def summary(self):
+        with self._lock:
+            series = {name: list(values) for name, values in self._series.items()}
+            counts = dict(self._counts)
+        return {
+            name: {
+                'count': counts[name],
+                'p50': round(percentile(values, 50), 3),
+                'p95': round(percentile(values, 95), 3),
+                'max': round(max(values), 3),
+            }
+            for name, values in series.items()
+        }
+
+_metrics = Metrics()
+
+def get_metrics():
+    return _metrics
@@ -6,7 +6,9 @@ def detect_tshirt_dimensions(image_path):
     # Read the image
     img = cv2.imread(image_path)
     h, w = img.shape[:2]
-    
+    return tshirt_dimensions_for_size(w, h)
+
+def tshirt_dimensions_for_size(w, h):
     # Define standard t-shirt proportions
     tshirt_width_ratio = 0.8  # T-shirt width is about 80% of image width
     tshirt_height_ratio = 0.6  # T-shirt height is about 60% of image height
@@ -3,7 +3,10 @@ import os
 import numpy as np
 import cv2
 from enum import Enum
-from .detectdim import detect_tshirt_dimensions
+from functools import lru_cache
+from .detectdim import tshirt_dimensions_for_size
+from encoding import encode_image
+from store import get_store
 
 class DesignPosition(Enum):
     MIDDLE = 1
@@ -63,11 +66,20 @@ def calculate_optimal_size(max_size, aspect_ratio):
     else:
         # Height is the limiting factor
         return int(max_height * aspect_ratio), max_height
-def create_tshirt_mockup(design_path, tshirt_path, output_folder, position=DesignPosition.MIDDLE, size_ratio=0.5):
-    design = Image.open(design_path).convert("RGBA")
+
+@lru_cache(maxsize=8)
+def load_tshirt_template(tshirt_path):
+    # Garment templates are shared by every mockup, so decode each one once
     tshirt = Image.open(tshirt_path).convert("RGBA")
+    return tshirt, tshirt_dimensions_for_size(tshirt.width, tshirt.height)
 
-    (tshirt_width, tshirt_height), corners, safe_area = detect_tshirt_dimensions(tshirt_path)
+def create_tshirt_mockup(design, tshirt_path, output_folder, position=DesignPosition.MIDDLE, size_ratio=0.5):
+    # The design can be an in-memory image handed over from the previous stage or a file path
+    if isinstance(design, Image.Image):
+        design = design.convert("RGBA")
+    else:
+        design = Image.open(design).convert("RGBA")
+    tshirt, ((tshirt_width, tshirt_height), corners, safe_area) = load_tshirt_template(tshirt_path)
 
     # Adjust safe_area to be relative to the t-shirt corners
     tshirt_left, tshirt_top = corners[0]
@@ -116,14 +128,17 @@ def create_tshirt_mockup(design_path, tshirt_path, output_folder, position=Desig
 
     return mockup
 
+def save_mockup(mockup, job_id, filename, profile='master'):
+    # Mockups are filed in the artifact store under the job they belong to
+    stored = get_store().put(job_id, filename, encode_image(mockup, profile)['data'])
+    return stored['path']
+
 # Usage example:
 if __name__ == "__main__":
     design_path = "/Users/ryan/Desktop/ezproof/email_191a54041fb5f7a5_IMG_3599.jpg_output/email_191a54041fb5f7a5_IMG_3599.jpg_isnet-general-use_alpha.png"
     tshirt_path = "/Users/ryan/Desktop/ezproof/mockupgen/materials/redtshirt.jpg"
     output_folder = "/Users/ryan/Desktop/ezproof/mockupgen/output"
-    
-    # Ensure output folder exists
-    os.makedirs(output_folder, exist_ok=True)
+    job_id = "mockupgen_example"
     
     # Generate mockup with design in the middle, 50% of max size (default)
     mockup_middle = create_tshirt_mockup(design_path, tshirt_path, output_folder, size_ratio=1)
@@ -135,7 +150,7 @@ if __name__ == "__main__":
     mockup_top_right = create_tshirt_mockup(design_path, tshirt_path, output_folder, DesignPosition.TOP_RIGHT, size_ratio=.7)
 
     # Save the results
-    mockup_middle.save(os.path.join(output_folder, "mockup_middle.png"))
-    mockup_top_left.save(os.path.join(output_folder, "mockup_top_left.png"))
-    mockup_top_right.save(os.path.join(output_folder, "mockup_top_right.png"))
+    print(save_mockup(mockup_middle, job_id, "mockup_middle.png"))
+    print(save_mockup(mockup_top_left, job_id, "mockup_top_left.png"))
+    print(save_mockup(mockup_top_right, job_id, "mockup_top_right.png"))
 
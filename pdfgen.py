@@ -1 +1,250 @@
-//TODO generate and attach pdf report of Image
\ No newline at end of file
+import hashlib
+import tempfile
+import textwrap
+import zlib
+from io import BytesIO
+from PIL import Image
+from config import load_print_config
+
+POINTS_PER_INCH = 72
+
+def pdf_string(text):
+    # Literal string for the standard Helvetica encoding
+    text = text.encode('latin-1', 'replace').decode('latin-1')
+    return '(' + text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)') + ')'
+
+# Minimal PDF writer that streams straight to a file handle. Objects are
+# written as soon as they are complete and only their byte offsets are kept,
+# so memory stays bounded no matter how many pages or images a proof has.
+# Image streams use an indirect /Length written after the data, which lets
+# pixel data be compressed and written band by band.
+class StreamingPDF:
+    def __init__(self, fh, band_rows=256):
+        self.fh = fh
+        self.band_rows = band_rows
+        self.offsets = {}
+        self.page_ids = []
+        self._next_id = 3  # 1 = catalog, 2 = page tree, both written on close
+        self._images = {}
+        self._font_id = None
+        self._position = 0
+        self._write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    def _write(self, data):
+        self.fh.write(data)
+        self._position += len(data)
+
+    def _new_id(self):
+        obj_id = self._next_id
+        self._next_id += 1
+        return obj_id
+
+    def _begin_object(self, obj_id):
+        self.offsets[obj_id] = self._position
+        self._write(f"{obj_id} 0 obj\n".encode('ascii'))
+
+    def _object(self, obj_id, body):
+        self._begin_object(obj_id)
+        self._write(body.encode('latin-1') + b'\nendobj\n')
+
+    def _stream(self, obj_id, dictionary, chunks):
+        # chunks is an iterable of already-encoded bytes
+        length_id = self._new_id()
+        self._begin_object(obj_id)
+        self._write(f"<< {dictionary} /Length {length_id} 0 R >>\nstream\n".encode('latin-1'))
+        length = 0
+        for chunk in chunks:
+            self._write(chunk)
+            length += len(chunk)
+        self._write(b'\nendstream\nendobj\n')
+        self._object(length_id, str(length))
+
+    def _deflate_bands(self, image):
+        compressor = zlib.compressobj(6)
+        for y in range(0, image.height, self.band_rows):
+            band = image.crop((0, y, image.width, min(y + self.band_rows, image.height)))
+            chunk = compressor.compress(band.tobytes())
+            if chunk:
+                yield chunk
+        yield compressor.flush()
+
+    def font(self):
+        if self._font_id is None:
+            self._font_id = self._new_id()
+            self._object(self._font_id, '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>')
+        return self._font_id
+
+    def add_jpeg(self, data):
+        # DCT passthrough: the JPEG bytes are embedded as-is, never re-encoded
+        key = hashlib.sha1(data).hexdigest()
+        if key in self._images:
+            return self._images[key]
+        with Image.open(BytesIO(data)) as img:
+            width, height, mode = img.width, img.height, img.mode
+            adobe = 'adobe' in img.info
+        colorspace = {'L': '/DeviceGray', 'CMYK': '/DeviceCMYK'}.get(mode, '/DeviceRGB')
+        decode = ' /Decode [1 0 1 0 1 0 1 0]' if mode == 'CMYK' and adobe else ''
+        obj_id = self._new_id()
+        self._stream(obj_id, f"/Type /XObject /Subtype /Image /Width {width} /Height {height} "
+                             f"/ColorSpace {colorspace} /BitsPerComponent 8 /Filter /DCTDecode{decode}", [data])
+        self._images[key] = (f"Im{obj_id}", obj_id, width, height)
+        return self._images[key]
+
+    def add_image(self, image):
+        # Raster images are Flate-compressed band by band; alpha becomes an SMask
+        key = hashlib.sha1(image.tobytes()).hexdigest() + f"{image.mode}{image.size}"
+        if key in self._images:
+            return self._images[key]
+        smask = ''
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            mask_id = self._new_id()
+            self._stream(mask_id, f"/Type /XObject /Subtype /Image /Width {image.width} /Height {image.height} "
+                                  f"/ColorSpace /DeviceGray /BitsPerComponent 8 /Filter /FlateDecode",
+                         self._deflate_bands(image.getchannel('A')))
+            smask = f" /SMask {mask_id} 0 R"
+        if image.mode == 'L':
+            colorspace = '/DeviceGray'
+        else:
+            image = image.convert('RGB')
+            colorspace = '/DeviceRGB'
+        obj_id = self._new_id()
+        self._stream(obj_id, f"/Type /XObject /Subtype /Image /Width {image.width} /Height {image.height} "
+                             f"/ColorSpace {colorspace} /BitsPerComponent 8 /Filter /FlateDecode{smask}",
+                     self._deflate_bands(image))
+        self._images[key] = (f"Im{obj_id}", obj_id, image.width, image.height)
+        return self._images[key]
+
+    def add_page(self, width, height, content, images=(), trim_box=None, bleed_box=None):
+        # content is a list of PDF operators; images are handles from add_image/add_jpeg
+        content_id = self._new_id()
+        self._stream(content_id, '/Filter /FlateDecode', [zlib.compress('\n'.join(content).encode('latin-1'))])
+        xobjects = ' '.join(f"/{name} {obj_id} 0 R" for name, obj_id, _, _ in images)
+        boxes = ''
+        if trim_box:
+            boxes += ' /TrimBox [{:.2f} {:.2f} {:.2f} {:.2f}]'.format(*trim_box)
+        if bleed_box:
+            boxes += ' /BleedBox [{:.2f} {:.2f} {:.2f} {:.2f}]'.format(*bleed_box)
+        page_id = self._new_id()
+        self._object(page_id, f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width:.2f} {height:.2f}]{boxes} "
+                              f"/Resources << /Font << /F1 {self.font()} 0 R >> /XObject << {xobjects} >> >> "
+                              f"/Contents {content_id} 0 R >>")
+        self.page_ids.append(page_id)
+
+    def close(self):
+        kids = ' '.join(f"{page_id} 0 R" for page_id in self.page_ids)
+        self._object(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(self.page_ids)} >>")
+        self._object(1, '<< /Type /Catalog /Pages 2 0 R >>')
+        xref_offset = self._position
+        self._write(f"xref\n0 {self._next_id}\n".encode('ascii'))
+        self._write(b'0000000000 65535 f \n')
+        for obj_id in range(1, self._next_id):
+            self._write(f"{self.offsets[obj_id]:010d} 00000 n \n".encode('ascii'))
+        self._write(f"trailer\n<< /Size {self._next_id} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode('ascii'))
+
+def draw_image(handle, x, y, box_width, box_height):
+    # Fit inside the box, preserving aspect ratio, centred
+    name, _, width, height = handle
+    scale = min(box_width / width, box_height / height)
+    draw_width, draw_height = width * scale, height * scale
+    left = x + (box_width - draw_width) / 2
+    bottom = y + (box_height - draw_height) / 2
+    return f"q {draw_width:.2f} 0 0 {draw_height:.2f} {left:.2f} {bottom:.2f} cm /{name} Do Q"
+
+def crop_marks(left, bottom, right, top, offset, length):
+    # Hairline marks at each trim corner, kept clear of the bleed
+    ops = ['q 0.25 w 0 G']
+    for x, dx in ((left, -1), (right, 1)):
+        for y, dy in ((bottom, -1), (top, 1)):
+            ops.append(f"{x + dx * offset:.2f} {y:.2f} m {x + dx * (offset + length):.2f} {y:.2f} l S")
+            ops.append(f"{x:.2f} {y + dy * offset:.2f} m {x:.2f} {y + dy * (offset + length):.2f} l S")
+    ops.append('Q')
+    return ops
+
+def text_lines(lines, x, top, size=9, leading=12, width_chars=95):
+    ops = [f"BT /F1 {size} Tf {leading} TL {x:.2f} {top:.2f} Td"]
+    for line in lines:
+        for wrapped in textwrap.wrap(line, width_chars, subsequent_indent='    ') or ['']:
+            ops.append(f"{pdf_string(wrapped)} Tj T*")
+    ops.append('ET')
+    return ops
+
+def trim_to_content(image):
+    # Drop fully transparent margins around a cutout
+    if image.mode == 'RGBA':
+        bbox = image.getchannel('A').getbbox()
+        if bbox:
+            return image.crop(bbox)
+    return image
+
+def write_proof_pdf(fh, proofs, print_config=None):
+    # proofs: iterable of dicts with 'filename', 'design' (PIL image, usually the
+    # cutout), optional 'source_data' (original upload bytes), 'mockups' (list
+    # of encoded JPEG bytes or PIL images) and 'analysis' / 'image_info' dicts
+    print_config = print_config or load_print_config()
+    trim_width = print_config['desired_width_inch'] * POINTS_PER_INCH
+    trim_height = print_config['desired_height_inch'] * POINTS_PER_INCH
+    bleed = print_config['bleed_inch'] * POINTS_PER_INCH
+    slug = 0.5 * POINTS_PER_INCH  # Room outside the bleed for crop marks and labels
+    page_width = trim_width + 2 * (bleed + slug)
+    page_height = trim_height + 2 * (bleed + slug)
+    letter_width, letter_height = 8.5 * POINTS_PER_INCH, 11 * POINTS_PER_INCH
+
+    pdf = StreamingPDF(fh)
+    for proof in proofs:
+        # Print page: trimmed design across the bleed box, crop marks at the trim
+        design = pdf.add_image(trim_to_content(proof['design']))
+        trim_left, trim_bottom = slug + bleed, slug + bleed
+        trim_right, trim_top = trim_left + trim_width, trim_bottom + trim_height
+        content = [draw_image(design, slug, slug, trim_width + 2 * bleed, trim_height + 2 * bleed)]
+        content += crop_marks(trim_left, trim_bottom, trim_right, trim_top, offset=bleed + 2, length=slug - 8)
+        content += text_lines([f"{proof['filename']} - {print_config['desired_width_inch']} x "
+                               f"{print_config['desired_height_inch']} in, {print_config['bleed_inch']} in bleed, "
+                               f"{print_config['print_dpi']} DPI"], slug, slug / 2, size=7)
+        pdf.add_page(page_width, page_height, content, [design],
+                     trim_box=(trim_left, trim_bottom, trim_right, trim_top),
+                     bleed_box=(slug, slug, page_width - slug, page_height - slug))
+
+        # Mockup page(s)
+        for mockup in proof.get('mockups', []):
+            handle = pdf.add_jpeg(mockup) if isinstance(mockup, bytes) else pdf.add_image(mockup)
+            margin = 0.5 * POINTS_PER_INCH
+            pdf.add_page(letter_width, letter_height,
+                         [draw_image(handle, margin, margin, letter_width - 2 * margin, letter_height - 2 * margin)],
+                         [handle])
+
+        # Summary page: original upload and the run_checks results
+        margin = 0.75 * POINTS_PER_INCH
+        images = []
+        content = text_lines([f"Proof summary: {proof['filename']}"], margin, letter_height - margin, size=14)
+        source = proof.get('source_data')
+        if source:
+            if source[:2] == b'\xff\xd8':
+                original = pdf.add_jpeg(source)
+            else:
+                original = pdf.add_image(Image.open(BytesIO(source)))
+            images.append(original)
+            content.append(draw_image(original, margin, letter_height - margin - 3.3 * POINTS_PER_INCH,
+                                      letter_width - 2 * margin, 3 * POINTS_PER_INCH))
+        lines = ['Image Analysis:']
+        lines += [f"  {check.capitalize()}: {result}" for check, result in (proof.get('analysis') or {}).items()]
+        lines += ['', 'Image Information:']
+        lines += [f"  {key}: {value}" for key, value in (proof.get('image_info') or {}).items() if key != 'EXIF']
+        content += text_lines(lines, margin, letter_height - margin - 3.6 * POINTS_PER_INCH)
+        pdf.add_page(letter_width, letter_height, content, images)
+
+    pdf.close()
+
+def build_proof_pdf(proofs, print_config=None):
+    # Pages are spooled to a temporary file as they are written; only the
+    # finished document is read back for the email attachment
+    with tempfile.TemporaryFile() as fh:
+        write_proof_pdf(fh, proofs, print_config)
+        fh.seek(0)
+        return fh.read()
+
+if __name__ == "__main__":
+    design = Image.open("output/for_exceptional_patron_u2netp_alpha.png")
+    with open("proof.pdf", "wb") as f:
+        write_proof_pdf(f, [{'filename': 'for_exceptional_patron.png', 'design': design,
+                             'analysis': {'resolution': f"Image resolution: {design.width}x{design.height} pixels"}}])
@@ -0,0 +1,173 @@
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import cv2
+import numpy as np
+from io import BytesIO
+from PIL import Image
+from config import load_phash_config
+from store import get_store
+from artifacts import Artifact
+from autoediting.refine import compose_cutout
+
+logger = logging.getLogger(__name__)
+
+def perceptual_hash(image_data):
+    # 64-bit DCT hash: survives re-exports, resizing, recompression and
+    # PNG <-> JPEG round trips that defeat byte-level hashing
+    img = Image.open(BytesIO(image_data))
+    img.draft("RGB", (64, 64))
+    if img.mode in ('RGBA', 'LA', 'P'):
+        # Transparent PNGs and the same design flattened to JPEG should agree
+        rgba = img.convert('RGBA')
+        flattened = Image.new('RGB', img.size, (255, 255, 255))
+        flattened.paste(rgba, mask=rgba.split()[3])
+        img = flattened
+    small = np.asarray(img.convert('L').resize((32, 32), Image.LANCZOS), dtype=np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    bits = low > np.median(low[1:])
+    return int(''.join('1' if bit else '0' for bit in bits), 2)
+
+# Multi-index hash over 64-bit perceptual hashes. The hash is split into
+# `chunks` substrings with one lookup table each; by the pigeonhole principle
+# any hash within distance r differs from the query by at most r // chunks
+# bits in at least one substring, so only those few buckets are probed.
+class PerceptualIndex:
+    def __init__(self, db_path, chunks=4, max_distance=6):
+        self.chunks = chunks
+        self.chunk_bits = 64 // chunks
+        self.max_distance = max_distance
+        self.entries = {}
+        self.tables = [{} for _ in range(chunks)]
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('''
+            CREATE TABLE IF NOT EXISTS designs (
+                id INTEGER PRIMARY KEY,
+                phash TEXT NOT NULL,
+                job_id TEXT NOT NULL,
+                cutouts TEXT NOT NULL,
+                analysis TEXT NOT NULL,
+                created REAL NOT NULL
+            )
+        ''')
+        self._db.commit()
+        for row in self._db.execute('SELECT id, phash, job_id, cutouts, analysis FROM designs'):
+            self._insert(row[0], int(row[1], 16), row[2], row[3], row[4])
+
+    def _chunk_values(self, phash):
+        mask = (1 << self.chunk_bits) - 1
+        return [(phash >> (i * self.chunk_bits)) & mask for i in range(self.chunks)]
+
+    def _neighbours(self, value, radius):
+        # Every chunk value within `radius` bit flips of value
+        yield value
+        for r in range(1, radius + 1):
+            for bits in itertools.combinations(range(self.chunk_bits), r):
+                flipped = value
+                for bit in bits:
+                    flipped ^= 1 << bit
+                yield flipped
+
+    def _insert(self, entry_id, phash, job_id, cutouts, analysis):
+        self.entries[entry_id] = (phash, job_id, cutouts, analysis)
+        for table, value in zip(self.tables, self._chunk_values(phash)):
+            table.setdefault(value, []).append(entry_id)
+
+    def add(self, phash, job_id, cutouts, analysis):
+        cutouts_json, analysis_json = json.dumps(cutouts), json.dumps(analysis)
+        with self._lock:
+            cursor = self._db.execute(
+                'INSERT INTO designs (phash, job_id, cutouts, analysis, created) VALUES (?, ?, ?, ?, ?)',
+                (f"{phash:016x}", job_id, cutouts_json, analysis_json, time.time()))
+            self._db.commit()
+            self._insert(cursor.lastrowid, phash, job_id, cutouts_json, analysis_json)
+
+    def candidates(self, phash):
+        # (distance, entry_id) for every entry within max_distance, closest first
+        radius = self.max_distance // self.chunks
+        found = {}
+        with self._lock:
+            for table, value in zip(self.tables, self._chunk_values(phash)):
+                for probe in self._neighbours(value, radius):
+                    for entry_id in table.get(probe, ()):
+                        if entry_id in found:
+                            continue
+                        distance = (self.entries[entry_id][0] ^ phash).bit_count()
+                        found[entry_id] = distance
+        return sorted((distance, entry_id) for entry_id, distance in found.items() if distance <= self.max_distance)
+
+    def remove(self, entry_id):
+        with self._lock:
+            entry = self.entries.pop(entry_id, None)
+            if entry is None:
+                return
+            for table, value in zip(self.tables, self._chunk_values(entry[0])):
+                bucket = table.get(value, [])
+                if entry_id in bucket:
+                    bucket.remove(entry_id)
+                if not bucket:
+                    table.pop(value, None)
+            self._db.execute('DELETE FROM designs WHERE id = ?', (entry_id,))
+            self._db.commit()
+
+    def lookup(self, phash):
+        # The closest entry whose cutouts are all still in the store. Entries
+        # whose cutouts were garbage-collected are dropped on the way, so a
+        # stale close match never hides a live one a little further away.
+        store = get_store()
+        for distance, entry_id in self.candidates(phash):
+            with self._lock:
+                entry = self.entries.get(entry_id)
+            if entry is None:
+                continue
+            _, job_id, cutouts, analysis = entry
+            cutouts = json.loads(cutouts)
+            stored = store.lookup(job_id)
+            if all(cutout[alpha_type] in stored for cutout in cutouts for alpha_type in ('without_alpha', 'with_alpha')):
+                return {'distance': distance, 'job_id': job_id, 'cutouts': cutouts, 'analysis': json.loads(analysis)}
+            logger.info(f"Dropping pHash index entry for job {job_id}: its cutouts were garbage-collected")
+            self.remove(entry_id)
+        return None
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_index():
+    global _index
+    with _index_lock:
+        if _index is None:
+            config = load_phash_config()
+            _index = PerceptualIndex(config['db_path'], chunks=config['chunks'], max_distance=config['max_distance'])
+        return _index
+
+def reuse_cutouts(match, image_data, base_filename, sink=None):
+    # Rebuild every model's cutouts from the matched design's stored alphas,
+    # rescaled to this image. Returns None if any stored cutout has been
+    # garbage-collected, so the caller falls back to full inference.
+    store = get_store()
+    full_rgb = Image.open(BytesIO(image_data)).convert("RGB")
+    results = []
+    for stored in match['cutouts']:
+        result = {'model': stored['model']}
+        for alpha_type, suffix in (('without_alpha', ''), ('with_alpha', '_alpha')):
+            path = store.get(match['job_id'], stored[alpha_type])
+            if path is None:
+                return None
+            with Image.open(path) as previous:
+                alpha = previous.getchannel('A').resize(full_rgb.size, Image.BILINEAR)
+            extension = os.path.splitext(stored[alpha_type])[1]
+            artifact = Artifact(f"{base_filename}_{stored['model']}{suffix}{extension}",
+                                image=compose_cutout(full_rgb, alpha))
+            if sink is not None:
+                sink.persist(artifact)
+            result[alpha_type] = artifact
+        results.append(result)
+    return results
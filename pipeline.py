@@ -0,0 +1,141 @@
+import asyncio
+import inspect
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from config import load_pipeline_config
+
+logger = logging.getLogger(__name__)
+
+# Dependency-aware stage scheduler. A job is a graph of named stages, each
+# with the stages it consumes and the executor it belongs on:
+#   'io'      coroutines and cheap callables, run on the event loop
+#   'thread'  blocking work that releases the GIL (PIL, numpy, inference)
+#   'process' CPU-bound Python; the function must be picklable (top level)
+# Every stage starts the moment its inputs are ready and its output is handed
+# straight to its dependents, so the job takes as long as its longest chain.
+# Only stages some requested output depends on are run at all.
+
+class StageError(Exception):
+    pass
+
+class Stage:
+    def __init__(self, name, func, deps=(), executor='thread'):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.executor = executor
+
+_process_executor = None
+
+def get_process_executor(config=None):
+    global _process_executor
+    if _process_executor is None:
+        config = config or load_pipeline_config()
+        # spawn, not fork: the parent has inference and encoder threads running
+        _process_executor = ProcessPoolExecutor(max_workers=config['process_workers'],
+                                                mp_context=multiprocessing.get_context('spawn'))
+    return _process_executor
+
+class StageGraph:
+    def __init__(self, name='job', config=None):
+        self.name = name
+        self.config = config or load_pipeline_config()
+        self.stages = {}
+        self.outputs = {}
+        self.errors = {}
+        self.timings = {}
+
+    def add(self, name, func, deps=(), executor='thread'):
+        # Stages run in the order they were added when several become ready
+        # together, so add critical-path stages first
+        executor = self.config['stage_executors'].get(name, executor)
+        if executor not in ('io', 'thread', 'process'):
+            raise ValueError(f"Unknown executor {executor!r} for stage {name}")
+        self.stages[name] = Stage(name, func, deps, executor)
+
+    def required(self, wanted, inputs=()):
+        # Every stage the wanted outputs transitively depend on
+        needed, pending = set(), list(wanted)
+        while pending:
+            name = pending.pop()
+            if name in needed or name in inputs:
+                continue
+            if name not in self.stages:
+                raise KeyError(f"No stage or input named {name}")
+            needed.add(name)
+            pending.extend(self.stages[name].deps)
+        return needed
+
+    async def execute(self, stage, args):
+        # Inside a worker process (batch mode) process stages run on a thread:
+        # a nested pool would only add spawn cost, and its live children keep
+        # the worker from exiting when its own pool shuts down
+        if stage.executor == 'process' and multiprocessing.parent_process() is None:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(get_process_executor(self.config), stage.func, *args)
+        if stage.executor in ('thread', 'process'):
+            return await asyncio.to_thread(stage.func, *args)
+        value = stage.func(*args)
+        return await value if inspect.isawaitable(value) else value
+
+    async def run(self, wanted, inputs=None):
+        # Returns {name: output} for the wanted stages that finished; failures
+        # are in self.errors, and anything depending on a failed stage is
+        # recorded there as a StageError without running
+        inputs = dict(inputs or {})
+        needed = self.required(wanted, inputs)
+        loop = asyncio.get_running_loop()
+        futures = {name: loop.create_future() for name in needed}
+        for name, value in inputs.items():
+            futures[name] = loop.create_future()
+            futures[name].set_result(value)
+        self.outputs.update(inputs)
+        start = time.monotonic()
+
+        async def run_stage(stage):
+            try:
+                args = []
+                for dep in stage.deps:
+                    try:
+                        args.append(await futures[dep])
+                    except Exception:
+                        raise StageError(f"{stage.name} skipped: {dep} failed")
+                began = time.monotonic()
+                value = await self.execute(stage, args)
+                self.timings[stage.name] = (began - start, time.monotonic() - start)
+                self.outputs[stage.name] = value
+                futures[stage.name].set_result(value)
+            except Exception as e:
+                if not isinstance(e, StageError):
+                    logger.error(f"Stage {stage.name} of {self.name} failed: {str(e)}")
+                self.errors[stage.name] = e
+                futures[stage.name].set_exception(e)
+                futures[stage.name].exception()  # Mark retrieved; dependents re-raise it
+
+        await asyncio.gather(*[run_stage(stage) for name, stage in self.stages.items() if name in needed])
+        self.report(time.monotonic() - start)
+        return {name: self.outputs[name] for name in wanted if name in self.outputs}
+
+    def critical_path(self):
+        # Walk back from the last stage to finish through whichever input
+        # arrived last
+        if not self.timings:
+            return []
+        name = max(self.timings, key=lambda stage: self.timings[stage][1])
+        path = [name]
+        while True:
+            deps = [dep for dep in self.stages[name].deps if dep in self.timings]
+            if not deps:
+                return path[::-1]
+            name = max(deps, key=lambda dep: self.timings[dep][1])
+            path.append(name)
+
+    def report(self, wall):
+        work = sum(end - began for began, end in self.timings.values())
+        skipped = [name for name in self.stages if name not in self.timings and name not in self.errors
+                   and name not in self.outputs]
+        logger.info(f"Stages for {self.name}: {wall:.2f}s wall, {work:.2f}s of stage work, "
+                    f"critical path {' -> '.join(self.critical_path())}"
+                    + (f", skipped {', '.join(skipped)}" if skipped else ""))
@@ -0,0 +1,100 @@
+import json
+import logging
+import re
+import time
+from PIL import Image
+from config import load_mockup_config
+from store import get_store
+from mockupgen.mockgen import create_tshirt_mockup, DesignPosition
+
+logger = logging.getLogger(__name__)
+
+# Proofs are iterative: once a thread has had a proof, the customer's
+# follow-ups ("make it bigger", "move it top left") only need a new mockup.
+# Each thread keeps the proof cutout and the last placement in the artifact
+# store, so a reply re-runs create_tshirt_mockup and nothing else.
+
+POSITION_PATTERNS = [
+    (DesignPosition.TOP_LEFT, re.compile(r'\b(?:top|upper)[\s-]*left\b|\bleft[\s-]*(?:chest|corner)\b')),
+    (DesignPosition.TOP_RIGHT, re.compile(r'\b(?:top|upper)[\s-]*right\b|\bright[\s-]*(?:chest|corner)\b')),
+    (DesignPosition.MIDDLE, re.compile(r'\b(?:middle|cent(?:er|re)d?)\b')),
+]
+GROW_PATTERN = re.compile(r'\b(?:bigger|larger|enlarge|increase|scale[\s-]*up|grow)\b')
+SHRINK_PATTERN = re.compile(r'\b(?:smaller|reduce|decrease|shrink|scale[\s-]*down)\b')
+STRONG_PATTERN = re.compile(r'\b(?:much|lot|way|significantly)\b')
+SLIGHT_PATTERN = re.compile(r'\b(?:bit|slightly|little|touch|tad)\b')
+QUOTE_HEADER_PATTERN = re.compile(r'^On\b.*\bwrote:\s*$')
+
+def latest_reply_text(content):
+    # Only the customer's new text; quoted history would repeat old requests
+    lines = []
+    for line in content.splitlines():
+        if QUOTE_HEADER_PATTERN.match(line.strip()):
+            break
+        if not line.lstrip().startswith('>'):
+            lines.append(line)
+    return '\n'.join(lines).lower()
+
+def parse_placement_intent(content, size_ratio, config=None):
+    # Returns {'position': DesignPosition or None, 'size_ratio': float or None},
+    # or None when the reply asks for nothing we can re-render
+    config = config or load_mockup_config()
+    text = latest_reply_text(content)
+
+    position = None
+    for candidate, pattern in POSITION_PATTERNS:
+        if pattern.search(text):
+            position = candidate
+            break
+
+    new_ratio = None
+    grow, shrink = GROW_PATTERN.search(text), SHRINK_PATTERN.search(text)
+    if grow or shrink:
+        step = config['size_step']
+        if STRONG_PATTERN.search(text):
+            step = step ** 2
+        elif SLIGHT_PATTERN.search(text):
+            step = step ** 0.5
+        new_ratio = size_ratio * step if grow else size_ratio / step
+        new_ratio = round(min(max(new_ratio, config['min_size_ratio']), config['max_size_ratio']), 3)
+
+    if position is None and new_ratio is None:
+        return None
+    return {'position': position, 'size_ratio': new_ratio}
+
+def thread_job_id(thread_id):
+    return f"thread_{thread_id}"
+
+def save_thread_state(thread_id, cutout_data, state):
+    # The cutout is content-addressed, so this is a new reference, not a copy
+    store = get_store()
+    job_id = thread_job_id(thread_id)
+    store.put(job_id, 'cutout.png', cutout_data)
+    state = {**state, 'cutout': 'cutout.png', 'updated': time.time()}
+    store.put(job_id, 'state.json', json.dumps(state).encode('utf-8'))
+    return state
+
+def load_thread_state(thread_id):
+    data = get_store().read(thread_job_id(thread_id), 'state.json')
+    return json.loads(data) if data is not None else None
+
+def has_thread_state(thread_id):
+    return get_store().get(thread_job_id(thread_id), 'state.json') is not None
+
+def rerender_mockup(thread_id, state, intent):
+    # Returns (mockup image, updated state), or None if the cached cutout is gone
+    path = get_store().get(thread_job_id(thread_id), state['cutout'])
+    if path is None:
+        return None
+    position = intent['position'] or DesignPosition[state['position']]
+    size_ratio = intent['size_ratio'] or state['size_ratio']
+
+    start = time.perf_counter()
+    with Image.open(path) as cutout:
+        mockup = create_tshirt_mockup(cutout, state['tshirt_path'], None, position=position, size_ratio=size_ratio)
+    logger.info(f"Re-rendered mockup for thread {thread_id} in {time.perf_counter() - start:.2f}s "
+                f"({position.name}, size {size_ratio})")
+
+    state = {**state, 'position': position.name, 'size_ratio': size_ratio, 'updated': time.time()}
+    get_store().put(thread_job_id(thread_id), 'state.json', json.dumps(state).encode('utf-8'))
+    return mockup, state
@@ -0,0 +1,219 @@
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from config import load_store_config
+
+logger = logging.getLogger(__name__)
+
+# Content-addressed artifact store.
+#
+# Every blob is written once under objects/<hash[:2]>/<hash>.<ext>; jobs (an
+# email message id, a Flask request id, ...) get human-readable names under
+# jobs/<job_id>/ that are hard links to those objects, so identical outputs
+# cost disk space only once. A SQLite index maps (job_id, name) to a hash for
+# primary-key lookups and drives size/age based garbage collection.
+class ArtifactStore:
+    def __init__(self, root, max_bytes=None, max_age_seconds=None, gc_interval_seconds=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.gc_interval_seconds = gc_interval_seconds
+        self._last_gc = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+        os.makedirs(os.path.join(root, 'jobs'), exist_ok=True)
+
+        self._db = sqlite3.connect(os.path.join(root, 'index.sqlite3'), check_same_thread=False, timeout=30)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS objects (
+                hash TEXT PRIMARY KEY,
+                ext TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_access REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS refs (
+                job_id TEXT NOT NULL,
+                name TEXT NOT NULL,
+                hash TEXT NOT NULL REFERENCES objects(hash),
+                created REAL NOT NULL,
+                PRIMARY KEY (job_id, name)
+            );
+            CREATE INDEX IF NOT EXISTS refs_hash ON refs(hash);
+            CREATE INDEX IF NOT EXISTS refs_created ON refs(created);
+            CREATE INDEX IF NOT EXISTS objects_last_access ON objects(last_access);
+        ''')
+        self._db.commit()
+
+    def object_path(self, content_hash, ext):
+        return os.path.join(self.root, 'objects', content_hash[:2], f"{content_hash}.{ext}")
+
+    def job_path(self, job_id, name):
+        # Names come from attachment filenames, so they are flattened to one
+        # path component and must land inside the job's directory
+        job_dir = os.path.join(self.root, 'jobs', safe_name(job_id))
+        path = os.path.join(job_dir, safe_name(name))
+        if os.path.dirname(os.path.abspath(path)) != os.path.abspath(job_dir):
+            raise ValueError(f"Artifact name escapes its job directory: {name!r}")
+        return path
+
+    def put(self, job_id, name, data):
+        content_hash = hashlib.sha256(data).hexdigest()
+        ext = os.path.splitext(name)[1].lstrip('.') or 'bin'
+        object_path = self.object_path(content_hash, ext)
+        now = time.time()
+
+        with self._lock:
+            row = self._db.execute('SELECT ext FROM objects WHERE hash = ?', (content_hash,)).fetchone()
+            if row is None:
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                # Write to a temp file first so readers never see a partial object
+                tmp_path = f"{object_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, object_path)
+                self._db.execute('INSERT OR IGNORE INTO objects (hash, ext, size, created, last_access) VALUES (?, ?, ?, ?, ?)',
+                                 (content_hash, ext, len(data), now, now))
+            else:
+                object_path = self.object_path(content_hash, row[0])
+                self._db.execute('UPDATE objects SET last_access = ? WHERE hash = ?', (now, content_hash))
+
+            self._db.execute('INSERT OR REPLACE INTO refs (job_id, name, hash, created) VALUES (?, ?, ?, ?)',
+                             (job_id, name, content_hash, now))
+            self._db.commit()
+
+        path = self._link(object_path, self.job_path(job_id, name))
+        self.maybe_gc()
+        return {'hash': content_hash, 'path': path, 'size': len(data)}
+
+    def _link(self, object_path, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            if os.path.samefile(object_path, path):
+                return path
+            os.remove(path)
+        try:
+            os.link(object_path, path)
+        except OSError:
+            # Filesystems without hard links: fall back to pointing at the object itself
+            return object_path
+        return path
+
+    def get(self, job_id, name):
+        with self._lock:
+            row = self._db.execute(
+                'SELECT objects.hash, objects.ext FROM refs JOIN objects ON refs.hash = objects.hash '
+                'WHERE refs.job_id = ? AND refs.name = ?', (job_id, name)).fetchone()
+            if row is None:
+                return None
+            self._db.execute('UPDATE objects SET last_access = ? WHERE hash = ?', (time.time(), row[0]))
+            self._db.commit()
+        path = self.job_path(job_id, name)
+        return path if os.path.exists(path) else self.object_path(*row)
+
+    def read(self, job_id, name):
+        path = self.get(job_id, name)
+        if path is None:
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def lookup(self, job_id):
+        with self._lock:
+            rows = self._db.execute('SELECT name FROM refs WHERE job_id = ?', (job_id,)).fetchall()
+        return {name: self.job_path(job_id, name) for (name,) in rows}
+
+    def maybe_gc(self):
+        if self.gc_interval_seconds is None or time.time() - self._last_gc < self.gc_interval_seconds:
+            return None
+        return self.gc()
+
+    def gc(self):
+        self._last_gc = time.time()
+        removed_refs = 0
+        removed_objects = 0
+
+        with self._lock:
+            # Age-based: expire job references, then any objects nobody points at
+            if self.max_age_seconds is not None:
+                cutoff = time.time() - self.max_age_seconds
+                expired = self._db.execute('SELECT job_id, name FROM refs WHERE created < ?', (cutoff,)).fetchall()
+                for job_id, name in expired:
+                    self._unlink(self.job_path(job_id, name))
+                self._db.execute('DELETE FROM refs WHERE created < ?', (cutoff,))
+                removed_refs += len(expired)
+
+            orphans = self._db.execute(
+                'SELECT hash, ext FROM objects WHERE NOT EXISTS (SELECT 1 FROM refs WHERE refs.hash = objects.hash)').fetchall()
+            for content_hash, ext in orphans:
+                self._unlink(self.object_path(content_hash, ext))
+                self._db.execute('DELETE FROM objects WHERE hash = ?', (content_hash,))
+            removed_objects += len(orphans)
+
+            # Size-based: evict least recently used objects together with their references
+            if self.max_bytes is not None:
+                total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM objects').fetchone()[0]
+                if total > self.max_bytes:
+                    for content_hash, ext, size in self._db.execute(
+                            'SELECT hash, ext, size FROM objects ORDER BY last_access').fetchall():
+                        if total <= self.max_bytes:
+                            break
+                        refs = self._db.execute('SELECT job_id, name FROM refs WHERE hash = ?', (content_hash,)).fetchall()
+                        for job_id, name in refs:
+                            self._unlink(self.job_path(job_id, name))
+                        self._unlink(self.object_path(content_hash, ext))
+                        self._db.execute('DELETE FROM refs WHERE hash = ?', (content_hash,))
+                        self._db.execute('DELETE FROM objects WHERE hash = ?', (content_hash,))
+                        removed_refs += len(refs)
+                        removed_objects += 1
+                        total -= size
+
+            self._db.commit()
+
+        self._remove_empty_job_dirs()
+        if removed_refs or removed_objects:
+            logger.info(f"Artifact store GC removed {removed_objects} objects and {removed_refs} job references")
+        return {'removed_objects': removed_objects, 'removed_refs': removed_refs}
+
+    def _unlink(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _remove_empty_job_dirs(self):
+        jobs_root = os.path.join(self.root, 'jobs')
+        for entry in os.scandir(jobs_root):
+            if entry.is_dir():
+                try:
+                    os.rmdir(entry.path)
+                except OSError:
+                    pass  # Still has files
+
+def safe_name(text, max_length=150):
+    # Like batch.safe_id, but keeps the extension when a long name is cut
+    # and never leaves '.' or '..'
+    name = re.sub(r'[^A-Za-z0-9._-]+', '_', str(text)).strip('._')
+    stem, ext = os.path.splitext(name)
+    return (stem[:max_length - len(ext)] + ext if len(name) > max_length else name) or '_'
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            config = load_store_config()
+            _store = ArtifactStore(
+                config['root'],
+                max_bytes=config['max_bytes'],
+                max_age_seconds=config['max_age_seconds'],
+                gc_interval_seconds=config['gc_interval_seconds'],
+            )
+        return _store
@@ -0,0 +1,158 @@
+import asyncio
+import time
+import pytest
+from googleapiclient.errors import HttpError
+from config import load_gmail_quota_config
+from fakegmail import FakeGmail
+from gmail_quota import GmailScheduler, TokenBucket
+
+def quota_config(**overrides):
+    config = load_gmail_quota_config()
+    config.update(backoff_base_seconds=0.01, backoff_max_seconds=0.05)
+    config.update(overrides)
+    return config
+
+def list_request(gmail):
+    return gmail.users().messages().list(userId='me', labelIds=['INBOX'], q='is:unread')
+
+def test_429s_are_retried_with_backoff():
+    # The client's burst is twice the fake's per-second limit, so the first
+    # calls get 429s; after that the bucket's rate keeps under the limit
+    gmail = FakeGmail(units_per_second=50)
+    gmail.add_message('customer@example.com', 'Proof', 'hi')
+    scheduler = GmailScheduler(quota_config(units_per_second=40, burst_units=100, max_retries=20,
+                                            backoff_max_seconds=0.2))
+
+    async def burst():
+        return await asyncio.gather(*[scheduler.execute(gmail, 'messages.list', list_request(gmail))
+                                      for _ in range(20)])
+
+    results = asyncio.run(burst())
+    assert len(results) == 20
+    assert all(len(result['messages']) == 1 for result in results)
+    assert gmail.rejected['messages.list'] > 0
+    assert scheduler.stats['retries'] == gmail.rejected['messages.list']
+    assert scheduler.stats['throttled'] > 0
+    assert scheduler.stats['failures'] == 0
+
+def test_errors_are_raised_once_retries_run_out():
+    gmail = FakeGmail(error_rate=1.0, seed=1)
+    scheduler = GmailScheduler(quota_config(max_retries=2))
+    with pytest.raises(HttpError):
+        asyncio.run(scheduler.execute(gmail, 'messages.list', list_request(gmail)))
+    assert scheduler.stats['retries'] == 2
+    assert scheduler.stats['failures'] == 1
+    assert gmail.errors['messages.list'] == 3
+
+def test_send_and_modify_run_before_queued_intake():
+    gmail = FakeGmail(latency={'messages.list': 0.2, 'default': 0.0})
+    message_id = gmail.add_message('customer@example.com', 'Proof', 'hi')
+    scheduler = GmailScheduler(quota_config(initial_concurrency=1, max_concurrency=1))
+    order = []
+
+    def traced(method, request):
+        handler = request.handler
+        def run():
+            order.append(method)
+            return handler()
+        request.handler = run
+        return scheduler.execute(gmail, method, request)
+
+    messages = gmail.users().messages()
+
+    async def run():
+        # The first list holds the only slot; the rest queue up behind it
+        # in the order intake would normally issue them
+        first = asyncio.create_task(traced('messages.list', list_request(gmail)))
+        await asyncio.sleep(0.05)
+        queued = [
+            traced('messages.list', list_request(gmail)),
+            traced('messages.get', messages.get(userId='me', id=message_id)),
+            traced('messages.modify', messages.modify(userId='me', id=message_id, body={'removeLabelIds': ['UNREAD']})),
+            traced('messages.send', messages.send(userId='me', body={'raw': '', 'threadId': message_id})),
+        ]
+        await asyncio.gather(first, *queued)
+
+    asyncio.run(run())
+    assert order[0] == 'messages.list'
+    assert set(order[1:3]) == {'messages.modify', 'messages.send'}
+    assert order[3:] == ['messages.get', 'messages.list']
+
+def test_concurrency_grows_additively_and_halves_on_pushback():
+    gmail = FakeGmail()
+    scheduler = GmailScheduler(quota_config(initial_concurrency=4, max_concurrency=16))
+
+    async def calls(count):
+        for _ in range(count):
+            await scheduler.execute(gmail, 'messages.list', list_request(gmail))
+
+    # +1/limit per success: four clean calls raise the limit by about one
+    asyncio.run(calls(4))
+    assert 4.8 < scheduler.limit < 5.0
+
+    # Each retryable error halves it, down to min_concurrency
+    scheduler.limit = 8.0
+    gmail.error_rate = 1.0
+    scheduler.config['max_retries'] = 2
+    with pytest.raises(HttpError):
+        asyncio.run(calls(1))
+    assert scheduler.limit == 2.0
+    with pytest.raises(HttpError):
+        asyncio.run(calls(1))
+    assert scheduler.limit == scheduler.config['min_concurrency']
+
+def test_token_bucket_charges_method_costs():
+    gmail = FakeGmail()
+    message_id = gmail.add_message('customer@example.com', 'Proof', 'hi')
+    scheduler = GmailScheduler(quota_config(units_per_second=400, burst_units=150))
+    messages = gmail.users().messages()
+
+    async def run():
+        await scheduler.execute(gmail, 'messages.get', messages.get(userId='me', id=message_id))
+        await scheduler.execute(gmail, 'messages.send', messages.send(userId='me', body={'raw': ''}))
+
+    asyncio.run(run())
+    assert scheduler.stats['units'] == 5 + 100
+    assert gmail.units_used == 5 + 100
+    # 150 - 105 spent plus a little refill, never above capacity
+    assert 45 <= scheduler.bucket.tokens <= 150
+
+def test_token_bucket_waits_for_refill():
+    bucket = TokenBucket(rate=100, capacity=50)
+
+    async def run():
+        start = time.monotonic()
+        await bucket.acquire(50)
+        drained = time.monotonic() - start
+        await bucket.acquire(30)
+        return drained, time.monotonic() - start
+
+    drained, total = asyncio.run(run())
+    assert drained < 0.05
+    assert 0.25 <= total < 0.6
+
+def test_thread_connections_are_kept_per_account():
+    # One scheduler serving two accounts must not send B's calls with A's credentials
+    from types import SimpleNamespace
+    from google.oauth2.credentials import Credentials
+    scheduler = GmailScheduler(quota_config())
+    account_a = SimpleNamespace(_http=SimpleNamespace(credentials=Credentials('token-a')))
+    account_b = SimpleNamespace(_http=SimpleNamespace(credentials=Credentials('token-b')))
+    http_a = scheduler._thread_http(account_a)
+    http_b = scheduler._thread_http(account_b)
+    assert http_a.credentials is account_a._http.credentials
+    assert http_b.credentials is account_b._http.credentials
+    assert scheduler._thread_http(account_a) is http_a
+
+def test_each_account_gets_its_own_scheduler():
+    # Gmail's quota is per user; one account's 429s must not throttle another
+    from gmail_quota import get_scheduler
+    first, second = FakeGmail(), FakeGmail()
+
+    async def schedulers():
+        return get_scheduler(first), get_scheduler(second), get_scheduler(first)
+
+    a, b, a_again = asyncio.run(schedulers())
+    assert a is a_again
+    assert a is not b
+    assert a.bucket is not b.bucket